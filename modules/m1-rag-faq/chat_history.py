@@ -0,0 +1,171 @@
+"""Token-budgeted chat history for the RAG bots (M1 and M7)."""
+
+from __future__ import annotations
+
+import logging
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+Turn = Tuple[str, str]
+
+SUMMARY_LABEL = "Summary of the earlier conversation"
+SUMMARY_PROMPT = """Progressively summarise the conversation below, adding onto the previous summary.
+Keep names, numbers and decisions; stay under {max_words} words.
+
+Previous summary:
+{summary}
+
+New lines of conversation:
+{lines}
+
+New summary:"""
+
+_WORD_RE = re.compile(r"[a-z0-9']+")
+_STOPWORDS = {
+    "what",
+    "when",
+    "where",
+    "which",
+    "who",
+    "whom",
+    "whose",
+    "why",
+    "how",
+    "does",
+    "have",
+    "with",
+    "from",
+    "that",
+    "this",
+    "there",
+    "their",
+    "about",
+    "would",
+    "could",
+    "should",
+    "your",
+    "they",
+    "them",
+    "will",
+    "been",
+    "were",
+    "into",
+    "than",
+    "then",
+    "also",
+    "much",
+    "many",
+    "some",
+    "more",
+    "most",
+    "tell",
+}
+
+
+def approx_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)."""
+    return len(text) // 4 + 1
+
+
+def _keywords(text: str) -> Set[str]:
+    return {w for w in _WORD_RE.findall(text.lower()) if len(w) > 3 and w not in _STOPWORDS}
+
+
+class BoundedChatHistory:
+    """Chat history that stays within a token budget.
+
+    The newest ``keep_recent`` turns are always kept verbatim. Older turns are
+    kept while they fit in ``max_tokens``; once they no longer fit they are
+    folded into a running summary by ``llm`` on a background thread (or simply
+    dropped when no ``llm`` is given). ``for_question`` additionally leaves out
+    older turns that share no keywords with the new question.
+    """
+
+    def __init__(
+        self,
+        llm: Any = None,
+        max_tokens: int = 1_000,
+        keep_recent: int = 2,
+        summary_words: int = 120,
+    ):
+        self.llm = llm
+        self.max_tokens = max_tokens
+        self.keep_recent = keep_recent
+        self.summary_words = summary_words
+        self.summary = ""
+        self.turns: List[Turn] = []
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: Optional[Future] = None
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+    @staticmethod
+    def _turn_tokens(turn: Turn) -> int:
+        return approx_tokens(turn[0]) + approx_tokens(turn[1])
+
+    def _tokens(self) -> int:
+        return approx_tokens(self.summary) + sum(self._turn_tokens(t) for t in self.turns)
+
+    def append(self, question: str, answer: str) -> None:
+        """Record a finished turn and evict old turns that no longer fit."""
+        with self._lock:
+            self.turns.append((question, answer))
+            evicted: List[Turn] = []
+            while len(self.turns) > self.keep_recent and self._tokens() > self.max_tokens:
+                evicted.append(self.turns.pop(0))
+        if evicted:
+            self._summarise_later(evicted)
+
+    def _summarise_later(self, evicted: List[Turn]) -> None:
+        if self.llm is None:
+            logger.debug(f"Dropped {len(evicted)} old turns from chat history")
+            return
+        if self._executor is None:
+            # One worker keeps summary updates ordered.
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history")
+        self._pending = self._executor.submit(self._summarise, evicted)
+
+    def _summarise(self, evicted: List[Turn]) -> None:
+        lines = "\n".join(f"Human: {q}\nAssistant: {a}" for q, a in evicted)
+        prompt = SUMMARY_PROMPT.format(
+            max_words=self.summary_words, summary=self.summary or "(none)", lines=lines
+        )
+        try:
+            response = self.llm.invoke(prompt)
+            summary = getattr(response, "content", response).strip()
+        except Exception as e:
+            logger.error(f"Error summarising chat history: {e}")
+            return
+        # Hard cap in case the model ignores the word limit.
+        words = summary.split()
+        with self._lock:
+            self.summary = " ".join(words[: self.summary_words * 2])
+
+    def for_question(self, question: str) -> List[Turn]:
+        """History to send with ``question``; never waits for a pending summary."""
+        with self._lock:
+            recent = self.turns[-self.keep_recent :] if self.keep_recent else []
+            older = self.turns[: len(self.turns) - len(recent)]
+            summary = self.summary
+        wanted = _keywords(question)
+        relevant = [t for t in older if wanted & _keywords(f"{t[0]} {t[1]}")]
+        history = relevant + recent
+        if summary:
+            history.insert(0, (SUMMARY_LABEL, summary))
+        return history
+
+    def flush(self, timeout: float | None = None) -> None:
+        """Wait for the in-flight summary update, if any."""
+        if self._pending is not None:
+            self._pending.result(timeout=timeout)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,293 @@
+"""Shared retrieval-chain helpers for the RAG bots (M1 and M7)."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import re
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT, QA_PROMPT
+from langchain.schema import Document
+from langchain_core.output_parsers import StrOutputParser
+
+logger = logging.getLogger(__name__)
+
+ChatHistory = List[Tuple[str, str]]
+
+# Follow-up questions shorter than this are usually elliptical ("and pricing?").
+MIN_STANDALONE_WORDS = 4
+
+# Words that only make sense with reference to an earlier turn.
+_FOLLOW_UP_WORDS = {
+    "it",
+    "its",
+    "it's",
+    "this",
+    "that",
+    "these",
+    "those",
+    "they",
+    "them",
+    "their",
+    "he",
+    "she",
+    "him",
+    "her",
+    "his",
+    "hers",
+    "same",
+    "such",
+    "above",
+    "previous",
+    "earlier",
+    "former",
+    "latter",
+    "else",
+    "also",
+    "again",
+}
+_FOLLOW_UP_OPENERS = ("and ", "but ", "or ", "so ", "what about", "how about", "why not")
+_WORD_RE = re.compile(r"[a-z0-9']+")
+
+
+@dataclass
+class RewriteStats:
+    """Counts how often the condense-question LLM call was skipped."""
+
+    total: int = 0
+    skipped: int = 0
+
+    def record(self, skipped: bool) -> None:
+        self.total += 1
+        if skipped:
+            self.skipped += 1
+
+    @property
+    def skip_rate(self) -> float:
+        return self.skipped / self.total if self.total else 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"total": self.total, "skipped": self.skipped, "skip_rate": self.skip_rate}
+
+
+REWRITE_STATS = RewriteStats()
+
+
+def needs_rewrite(question: str, history: ChatHistory | None) -> bool:
+    """Return True if ``question`` must be condensed with ``history`` to stand alone.
+
+    Cheap heuristic: first turns never need it; short questions, questions that
+    open with a conjunction, or that contain pronouns/back-references do.
+    """
+    if not history:
+        return False
+    text = question.strip().lower()
+    words = _WORD_RE.findall(text)
+    if len(words) < MIN_STANDALONE_WORDS:
+        return True
+    if text.startswith(_FOLLOW_UP_OPENERS):
+        return True
+    return any(w in _FOLLOW_UP_WORDS for w in words)
+
+
+def invoke_chain(
+    chain: Any,
+    question: str,
+    history: ChatHistory | None = None,
+    stats: RewriteStats = REWRITE_STATS,
+) -> Dict[str, Any]:
+    """Invoke a ``ConversationalRetrievalChain``, skipping the rewrite when possible.
+
+    The chain only calls its question generator when ``chat_history`` is
+    non-empty, so standalone questions are sent with an empty history.
+    """
+    history = history or []
+    rewrite = needs_rewrite(question, history)
+    stats.record(skipped=not rewrite)
+    logger.debug(
+        "Condense question %s (skip rate %.0f%%)",
+        "required" if rewrite else "skipped",
+        stats.skip_rate * 100,
+    )
+    return chain.invoke({"question": question, "chat_history": history if rewrite else []})
+
+
+def _format_history(history: ChatHistory) -> str:
+    return "".join(f"\nHuman: {q}\nAssistant: {a}" for q, a in history)
+
+
+def _search_by_vector(vectorstore: Any, vector: List[float], k: int) -> List[Document]:
+    # The LangChain Pinecone wrapper only implements the scored variant.
+    if hasattr(vectorstore, "similarity_search_by_vector_with_score"):
+        return [doc for doc, _ in vectorstore.similarity_search_by_vector_with_score(vector, k=k)]
+    return vectorstore.similarity_search_by_vector(vector, k=k)
+
+
+class AsyncRAG:
+    """Async question answering over a LangChain vector store.
+
+    ``abatch`` embeds every question in one batched call, runs the vector
+    searches concurrently and generates answers with at most
+    ``max_concurrency`` LLM requests in flight.
+    """
+
+    def __init__(
+        self,
+        vectorstore: Any,
+        llm: Any,
+        k: int = 4,
+        max_concurrency: int = 8,
+        stats: RewriteStats = REWRITE_STATS,
+    ):
+        self.vectorstore = vectorstore
+        self.embeddings = vectorstore.embeddings
+        self.k = k
+        self.stats = stats
+        self._condense = CONDENSE_QUESTION_PROMPT | llm | StrOutputParser()
+        self._answer = QA_PROMPT | llm | StrOutputParser()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _retrieve(self, vector: List[float]) -> List[Document]:
+        return await asyncio.to_thread(_search_by_vector, self.vectorstore, vector, self.k)
+
+    async def _generate(self, question: str, docs: List[Document]) -> str:
+        context = "\n\n".join(doc.page_content for doc in docs)
+        async with self._semaphore:
+            return await self._answer.ainvoke({"context": context, "question": question})
+
+    async def aask(self, question: str, history: ChatHistory | None = None) -> str:
+        """Answer one question, condensing it with ``history`` only when needed."""
+        rewrite = needs_rewrite(question, history)
+        self.stats.record(skipped=not rewrite)
+        standalone = question
+        if rewrite:
+            async with self._semaphore:
+                standalone = await self._condense.ainvoke(
+                    {"question": question, "chat_history": _format_history(history or [])}
+                )
+        vector = await self.embeddings.aembed_query(standalone)
+        return await self._generate(standalone, await self._retrieve(vector))
+
+    async def abatch(self, questions: Sequence[str]) -> List[str]:
+        """Answer independent questions; failures become ``"Error: ..."`` strings."""
+        if not questions:
+            return []
+        try:
+            vectors = await self.embeddings.aembed_documents(list(questions))
+        except Exception as e:
+            logger.error(f"Error embedding {len(questions)} questions: {e}")
+            return [f"Error: {e}"] * len(questions)
+
+        async def answer(question: str, vector: List[float]) -> str:
+            # Retrieval and generation fail per question, never the whole batch.
+            try:
+                return await self._generate(question, await self._retrieve(vector))
+            except Exception as e:
+                logger.error(f"Error answering {question!r}: {e}")
+                return f"Error: {e}"
+
+        return list(await asyncio.gather(*(answer(q, v) for q, v in zip(questions, vectors))))
+
+
+def answer_questions_file(
+    path: Path,
+    vectorstore: Any,
+    llm: Any,
+    output: Path | None = None,
+    k: int = 4,
+    max_concurrency: int = 8,
+) -> int:
+    """Answer one question per line of ``path`` as JSON lines (stdout if no ``output``)."""
+    questions = [line.strip() for line in path.read_text(encoding="utf-8").splitlines()]
+    questions = [q for q in questions if q]
+    rag = AsyncRAG(vectorstore, llm, k=k, max_concurrency=max_concurrency)
+
+    started = time.perf_counter()
+    answers = asyncio.run(rag.abatch(questions))
+    elapsed = time.perf_counter() - started
+
+    lines = (
+        json.dumps({"question": q, "answer": a}, ensure_ascii=False) + "\n"
+        for q, a in zip(questions, answers)
+    )
+    if output is None:
+        sys.stdout.writelines(lines)
+    else:
+        with open(output, "w", encoding="utf-8") as out:
+            out.writelines(lines)
+    logger.info(f"Answered {len(questions)} questions in {elapsed:.1f}s")
+    return len(questions)
+
+
+@dataclass
+class StreamedAnswer:
+    """Result of one streamed turn; ``ttft`` is seconds from question to first token."""
+
+    answer: str
+    sources: List[Document] = field(default_factory=list)
+    ttft: Optional[float] = None
+
+
+def stream_answer(
+    question: str,
+    history: ChatHistory | None,
+    retriever: Any,
+    llm: Any,
+    on_sources: Callable[[List[Document]], None],
+    on_token: Callable[[str], None],
+    stats: RewriteStats = REWRITE_STATS,
+) -> StreamedAnswer:
+    """Retrieve, report sources via ``on_sources``, then stream tokens to ``on_token``."""
+    started = time.perf_counter()
+    standalone = question
+    rewrite = needs_rewrite(question, history)
+    stats.record(skipped=not rewrite)
+    if rewrite:
+        standalone = (CONDENSE_QUESTION_PROMPT | llm | StrOutputParser()).invoke(
+            {"question": question, "chat_history": _format_history(history or [])}
+        )
+
+    docs = retriever.invoke(standalone)
+    on_sources(docs)
+
+    context = "\n\n".join(doc.page_content for doc in docs)
+    tokens: List[str] = []
+    ttft = None
+    for token in (QA_PROMPT | llm | StrOutputParser()).stream(
+        {"context": context, "question": standalone}
+    ):
+        if ttft is None:
+            ttft = time.perf_counter() - started
+            logger.info(f"Time to first token: {ttft:.3f}s")
+        tokens.append(token)
+        on_token(token)
+    return StreamedAnswer(answer="".join(tokens), sources=docs, ttft=ttft)
+
+
+def print_streamed_answer(
+    question: str,
+    history: ChatHistory | None,
+    retriever: Any,
+    llm: Any,
+    snippet_chars: int = 80,
+) -> str:
+    """Console front-end for ``stream_answer`` used by the M1/M7 chat loops."""
+
+    def show_sources(docs: List[Document]) -> None:
+        for i, doc in enumerate(docs, 1):
+            snippet = " ".join(doc.page_content.split())[:snippet_chars]
+            print(f"  [{i}] {snippet}…")
+        print("Bot: ", end="", flush=True)
+
+    result = stream_answer(
+        question, history, retriever, llm, show_sources, lambda t: print(t, end="", flush=True)
+    )
+    ttft = f"{result.ttft:.2f}s" if result.ttft is not None else "n/a"
+    print(f"\n(first token after {ttft})\n")
+    return result.answer
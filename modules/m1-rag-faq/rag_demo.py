@@ -4,6 +4,7 @@ import argparse
 from pathlib import Path
 from typing import List, Tuple
 
+from chat_history import BoundedChatHistory
 from dotenv import load_dotenv
 from langchain.chains import ConversationalRetrievalChain
 from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -11,6 +12,7 @@ from langchain_community.document_loaders import TextLoader
 from langchain_community.vectorstores import Chroma
 from langchain_openai.chat_models import ChatOpenAI
 from langchain_openai.embeddings import OpenAIEmbeddings
+from rag_chain import REWRITE_STATS, answer_questions_file, invoke_chain, print_streamed_answer
 
 load_dotenv()
 
@@ -22,9 +24,9 @@ COLLECTION = "company_faq_demo"
 def ingest_docs(source_path: Path, persist_directory: str = PERSIST_DIR) -> Chroma:
     """Load a markdown/txt file, embed chunks, and persist to Chroma."""
     docs = TextLoader(str(source_path), encoding="utf-8").load()
-    chunks = RecursiveCharacterTextSplitter(
-        chunk_size=1_000, chunk_overlap=200
-    ).split_documents(docs)
+    chunks = RecursiveCharacterTextSplitter(chunk_size=1_000, chunk_overlap=200).split_documents(
+        docs
+    )
 
     vectordb = Chroma.from_documents(
         chunks,
@@ -54,13 +56,15 @@ def single_query(
         ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0),
         vectordb.as_retriever(),
     )
-    result = chain.invoke({"question": query, "chat_history": history or []})
+    result = invoke_chain(chain, query, history)
     return result["answer"]
 
 
 def chat_loop(vectordb: Chroma) -> None:
-    """Simple REPL until user types ‘exit’."""
-    history: List[Tuple[str, str]] = []
+    """Simple streaming REPL until user types ‘exit’."""
+    retriever = vectordb.as_retriever()
+    llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0)
+    history = BoundedChatHistory(llm)
     print("\nAsk me anything about the company (type 'exit' to quit)\n")
     while True:
         try:
@@ -70,19 +74,24 @@ def chat_loop(vectordb: Chroma) -> None:
             break
         if query.lower() in {"exit", "quit", "q"}:
             break
-        answer = single_query(query, vectordb, history)
-        print(f"Bot: {answer}\n")
-        history.append((query, answer))
+        answer = print_streamed_answer(query, history.for_question(query), retriever, llm)
+        history.append(query, answer)
+    history.close()
+    print(f"[i] Question rewrites skipped: {REWRITE_STATS.skipped}/{REWRITE_STATS.total}")
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Run a tiny RAG FAQ bot.")
-    parser.add_argument("--source", default=str(DEFAULT_SOURCE),
-                        help="Path to FAQ .md/.txt file")
-    parser.add_argument("--rebuild", action="store_true",
-                        help="Rebuild vector store from source")
-    parser.add_argument("--query",
-                        help="Run one-off question and quit")
+    parser.add_argument("--source", default=str(DEFAULT_SOURCE), help="Path to FAQ .md/.txt file")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild vector store from source")
+    parser.add_argument("--query", help="Run one-off question and quit")
+    parser.add_argument(
+        "--questions-file", help="Answer every line of this file as JSON lines and quit"
+    )
+    parser.add_argument("--output", help="Write --questions-file answers here instead of stdout")
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="Max concurrent LLM calls for --questions-file"
+    )
     args = parser.parse_args()
 
     if args.rebuild or not Path(PERSIST_DIR).exists():
@@ -92,11 +101,17 @@ def main() -> None:
         print("[+] Loading existing vector store…")
         vectordb = load_vectordb()
 
-    if args.query:
+    if args.questions_file:
+        llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0)
+        output = Path(args.output) if args.output else None
+        answer_questions_file(
+            Path(args.questions_file), vectordb, llm, output, max_concurrency=args.concurrency
+        )
+    elif args.query:
         print("\nAnswer:", single_query(args.query, vectordb), "\n")
     else:
         chat_loop(vectordb)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,212 @@
+"""Warehouse-side aggregation for the daily summary (BigQuery pushdown)."""
+
+from __future__ import annotations
+
+import datetime as dt
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+import pandas as pd
+from google.cloud import bigquery
+
+logger = logging.getLogger(__name__)
+
+EVENTS_TABLE = os.getenv("EVENTS_TABLE", "my_ds.events")
+PRICE_PER_TIB = float(os.getenv("BQ_PRICE_PER_TIB", "6.25"))
+TOP_MOVERS = 10
+# Days of hourly history before the report day, so the anomaly detector has a
+# trailing window and a weekly seasonal baseline (anomalies.SEASONS).
+ANOMALY_HISTORY_DAYS = 7
+
+# Table names cannot be query parameters, so they are validated instead.
+_TABLE_RE = re.compile(r"^[A-Za-z0-9_-]+(\.[A-Za-z0-9_]+){1,2}$")
+
+# Half-open timestamp range so BigQuery can prune partitions on created_at.
+_DAY_FILTER = (
+    "created_at >= TIMESTAMP(@day) " "AND created_at < TIMESTAMP(DATE_ADD(@day, INTERVAL 1 DAY))"
+)
+
+
+@dataclass(frozen=True)
+class AggregateQuery:
+    name: str
+    sql: str
+    params: tuple
+
+
+@dataclass
+class WarehouseAggregates:
+    """Small result set computed in BigQuery for one day."""
+
+    day: dt.date
+    counts_by_event: pd.DataFrame
+    hourly: pd.DataFrame
+    distinct_users: int
+    top_movers: pd.DataFrame
+    # event_name, bucket, events for the report day and ANOMALY_HISTORY_DAYS before it
+    hourly_by_event: pd.DataFrame = field(
+        default_factory=lambda: pd.DataFrame(columns=["event_name", "bucket", "events"])
+    )
+    bytes_processed: int = 0
+    cache_hits: int = 0
+    estimated_bytes: Dict[str, int] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return int(self.counts_by_event["events"].sum()) if len(self.counts_by_event) else 0
+
+    def to_markdown(self) -> str:
+        return "\n\n".join(
+            [
+                f"Distinct users: {self.distinct_users}",
+                "Events by type:\n\n" + self.counts_by_event.to_markdown(index=False),
+                "Top movers vs previous day:\n\n" + self.top_movers.to_markdown(index=False),
+                "Hourly histogram:\n\n" + self.hourly.to_markdown(index=False),
+            ]
+        )
+
+
+def _check_table(table: str) -> str:
+    if not _TABLE_RE.match(table):
+        raise ValueError(f"Invalid BigQuery table name: {table!r}")
+    return table
+
+
+def build_queries(
+    day: dt.date, table: str = EVENTS_TABLE, top_n: int = TOP_MOVERS
+) -> List[AggregateQuery]:
+    """Parameterised aggregate queries; the SQL text is identical for every day."""
+    table = _check_table(table)
+    day_param = bigquery.ScalarQueryParameter("day", "DATE", day)
+    return [
+        AggregateQuery(
+            "counts_by_event",
+            f"""
+            SELECT event_name, COUNT(*) AS events, COUNT(DISTINCT user_id) AS users
+            FROM `{table}`
+            WHERE {_DAY_FILTER}
+            GROUP BY event_name
+            ORDER BY events DESC
+            """,
+            (day_param,),
+        ),
+        AggregateQuery(
+            "hourly",
+            f"""
+            SELECT EXTRACT(HOUR FROM created_at) AS hour, COUNT(*) AS events
+            FROM `{table}`
+            WHERE {_DAY_FILTER}
+            GROUP BY hour
+            ORDER BY hour
+            """,
+            (day_param,),
+        ),
+        AggregateQuery(
+            "hourly_by_event",
+            f"""
+            SELECT event_name, TIMESTAMP_TRUNC(created_at, HOUR) AS bucket, COUNT(*) AS events
+            FROM `{table}`
+            WHERE created_at >= TIMESTAMP(DATE_SUB(@day, INTERVAL @history_days DAY))
+              AND created_at < TIMESTAMP(DATE_ADD(@day, INTERVAL 1 DAY))
+            GROUP BY event_name, bucket
+            """,
+            (
+                day_param,
+                bigquery.ScalarQueryParameter("history_days", "INT64", ANOMALY_HISTORY_DAYS),
+            ),
+        ),
+        AggregateQuery(
+            "distinct_users",
+            f"""
+            SELECT COUNT(DISTINCT user_id) AS users
+            FROM `{table}`
+            WHERE {_DAY_FILTER}
+            """,
+            (day_param,),
+        ),
+        AggregateQuery(
+            "top_movers",
+            f"""
+            SELECT
+              event_name,
+              COUNTIF(DATE(created_at) = @day) AS today,
+              COUNTIF(DATE(created_at) < @day) AS previous_day,
+              COUNTIF(DATE(created_at) = @day) - COUNTIF(DATE(created_at) < @day) AS delta,
+              SAFE_DIVIDE(
+                COUNTIF(DATE(created_at) = @day) - COUNTIF(DATE(created_at) < @day),
+                COUNTIF(DATE(created_at) < @day)
+              ) AS pct_change
+            FROM `{table}`
+            WHERE created_at >= TIMESTAMP(DATE_SUB(@day, INTERVAL 1 DAY))
+              AND created_at < TIMESTAMP(DATE_ADD(@day, INTERVAL 1 DAY))
+            GROUP BY event_name
+            ORDER BY ABS(delta) DESC
+            LIMIT @top_n
+            """,
+            (day_param, bigquery.ScalarQueryParameter("top_n", "INT64", top_n)),
+        ),
+    ]
+
+
+def estimate_bytes(client: bigquery.Client, query: AggregateQuery) -> int:
+    """Dry-run ``query`` and return the bytes it would scan (free, no cache)."""
+    config = bigquery.QueryJobConfig(
+        dry_run=True, use_query_cache=False, query_parameters=list(query.params)
+    )
+    return client.query(query.sql, job_config=config).total_bytes_processed or 0
+
+
+def fetch_aggregates(
+    client: bigquery.Client,
+    day: dt.date,
+    table: str = EVENTS_TABLE,
+    max_bytes_billed: int | None = None,
+    dry_run: bool = True,
+) -> WarehouseAggregates:
+    """Run every aggregate query in BigQuery and collect the small results.
+
+    Jobs are submitted together and awaited afterwards, so they run in
+    parallel on the warehouse. Because the SQL text is stable and the day is a
+    parameter, re-running a report for the same day is served from the
+    BigQuery result cache.
+    """
+    queries = build_queries(day, table)
+    estimated: Dict[str, int] = {}
+    if dry_run:
+        for query in queries:
+            estimated[query.name] = estimate_bytes(client, query)
+        total = sum(estimated.values())
+        logger.info(
+            f"Dry run: {total / 2**30:.2f} GiB to scan (~${total / 2**40 * PRICE_PER_TIB:.4f})"
+        )
+
+    jobs = {
+        query.name: client.query(
+            query.sql,
+            job_config=bigquery.QueryJobConfig(
+                query_parameters=list(query.params),
+                use_query_cache=True,
+                maximum_bytes_billed=max_bytes_billed,
+            ),
+        )
+        for query in queries
+    }
+    frames = {name: job.result().to_dataframe() for name, job in jobs.items()}
+    cache_hits = sum(1 for job in jobs.values() if job.cache_hit)
+    processed = sum(job.total_bytes_processed or 0 for job in jobs.values())
+    logger.info(f"Aggregates scanned {processed} bytes ({cache_hits}/{len(jobs)} cache hits)")
+
+    users = frames["distinct_users"]
+    return WarehouseAggregates(
+        day=day,
+        counts_by_event=frames["counts_by_event"],
+        hourly=frames["hourly"],
+        distinct_users=int(users["users"].iloc[0]) if len(users) else 0,
+        top_movers=frames["top_movers"],
+        hourly_by_event=frames["hourly_by_event"],
+        bytes_processed=processed,
+        cache_hits=cache_hits,
+        estimated_bytes=estimated,
+    )
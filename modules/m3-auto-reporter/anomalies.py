@@ -0,0 +1,214 @@
+"""Vectorised anomaly detection over per-event time series.
+
+Events are bucketed into an ``(event types × hours)`` count matrix with one
+``np.bincount``; every detector then works on whole rows of that matrix at
+once, so cost is linear in the number of raw events plus the matrix size.
+"""
+
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+
+logger = logging.getLogger(__name__)
+
+FREQ = "h"
+WINDOW = 24  # trailing buckets for the rolling z-score
+MIN_HISTORY = 12  # buckets of history before a point can be flagged
+SEASON = 24  # buckets per season (daily cycle of hourly buckets)
+SEASONS = 7  # previous seasons averaged into the seasonal baseline
+Z_THRESHOLD = 4.0
+MIN_DELTA = 10.0  # ignore deviations of only a handful of events in sparse series
+SHIFT_WINDOW = SEASON  # buckets compared on each side (whole seasons cancel the daily cycle)
+SHIFT_THRESHOLD = 6.0
+
+ANOMALY_COLUMNS = ["event_name", "at", "kind", "value", "expected", "score"]
+
+
+@dataclass
+class SeriesMatrix:
+    """Event counts per time bucket: ``counts[i, t]`` for ``names[i]`` at ``index[t]``."""
+
+    names: np.ndarray
+    index: pd.DatetimeIndex
+    counts: np.ndarray
+
+
+def _event_codes(names: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    # Categorical columns already carry integer codes; factorising strings is the slow path.
+    if isinstance(names.dtype, pd.CategoricalDtype):
+        return names.cat.codes.to_numpy().astype(np.int64), names.cat.categories.to_numpy()
+    return pd.factorize(names.to_numpy())
+
+
+def count_matrix(events: pd.DataFrame, freq: str = FREQ) -> SeriesMatrix:
+    """Bucket raw events (``event_name``, ``created_at``) into a dense count matrix.
+
+    ``event_name`` as a categorical column skips string factorisation, which
+    otherwise dominates the cost.
+    """
+    created = pd.to_datetime(events["created_at"], errors="coerce")
+    if created.dt.tz is not None:
+        created = created.dt.tz_convert(None)
+    stamps = created.to_numpy(dtype="datetime64[ns]")
+    codes, names = _event_codes(events["event_name"])
+    valid = ~np.isnat(stamps) & (codes >= 0)
+    if not valid.any():
+        return SeriesMatrix(np.array([], dtype=object), pd.DatetimeIndex([]), np.zeros((0, 0)))
+    ticks = stamps[valid].view(np.int64)
+    step = pd.Timedelta(to_offset(freq)).value
+    first = ticks.min() // step * step
+    positions = (ticks - first) // step
+    width = int(positions.max()) + 1
+    flat = np.bincount(codes[valid] * width + positions, minlength=len(names) * width)
+    counts = flat.reshape(len(names), width).astype(float)
+    present = counts.any(axis=1)  # unused categories
+    index = pd.date_range(pd.Timestamp(first), periods=width, freq=freq)
+    return SeriesMatrix(np.asarray(names)[present], index, counts[present])
+
+
+def matrix_from_counts(counts: pd.DataFrame, freq: str = FREQ) -> SeriesMatrix:
+    """Build the matrix from pre-aggregated ``event_name``, ``bucket``, ``events`` rows."""
+    if counts.empty:
+        return SeriesMatrix(np.array([], dtype=object), pd.DatetimeIndex([]), np.zeros((0, 0)))
+    pivot = counts.pivot_table(
+        index="event_name", columns="bucket", values="events", aggfunc="sum", fill_value=0
+    )
+    index = pd.date_range(pivot.columns.min(), pivot.columns.max(), freq=freq)
+    pivot = pivot.reindex(columns=index, fill_value=0)
+    return SeriesMatrix(pivot.index.to_numpy(), index, pivot.to_numpy(dtype=float))
+
+
+def _window_sums(x: np.ndarray, window: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Sum, sum of squares and count of the ``window`` buckets *before* each bucket."""
+    zeros = np.zeros((x.shape[0], 1))
+    s1 = np.concatenate([zeros, np.cumsum(x, axis=1)], axis=1)
+    s2 = np.concatenate([zeros, np.cumsum(x * x, axis=1)], axis=1)
+    t = np.arange(x.shape[1])
+    lo = np.maximum(t - window, 0)
+    return s1[:, t] - s1[:, lo], s2[:, t] - s2[:, lo], (t - lo).astype(float)
+
+
+def _scale(mean: np.ndarray, var: np.ndarray) -> np.ndarray:
+    # Counts are at least Poisson-noisy, which keeps flat series from dividing by ~0.
+    return np.maximum(np.sqrt(np.maximum(var, 0.0)), np.sqrt(np.maximum(mean, 1.0)))
+
+
+def rolling_zscores(x: np.ndarray, window: int = WINDOW, min_history: int = MIN_HISTORY):
+    """Z-score of each bucket against the trailing window; NaN without enough history."""
+    s1, s2, n = _window_sums(x, window)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = s1 / n
+        var = s2 / n - mean * mean
+        z = (x - mean) / _scale(mean, var)
+    z[:, n < min_history] = np.nan
+    return z, mean
+
+
+def seasonal_baseline(x: np.ndarray, season: int = SEASON, seasons: int = SEASONS):
+    """Mean of the same bucket in up to ``seasons`` previous seasons (NaN with fewer than 2)."""
+    total = np.zeros_like(x)
+    seen = np.zeros(x.shape[1])
+    for k in range(1, seasons + 1):
+        lag = k * season
+        if lag >= x.shape[1]:
+            break
+        total[:, lag:] += x[:, :-lag]
+        seen[lag:] += 1
+    with np.errstate(invalid="ignore", divide="ignore"):
+        expected = total / seen
+    expected[:, seen < 2] = np.nan
+    return expected
+
+
+def change_points(x: np.ndarray, window: int = SHIFT_WINDOW, season: int = SEASON):
+    """Score a level shift at every bucket: mean of ``window`` buckets after minus before.
+
+    The difference is scaled by each series' noise, estimated robustly (MAD) from
+    season-over-season differences, so the daily cycle itself does not count as noise.
+    """
+    score = np.full(x.shape, np.nan)
+    if x.shape[1] < 2 * window:
+        return score
+    lag = season if x.shape[1] > season else 1
+    noise = np.median(np.abs(x[:, lag:] - x[:, :-lag]), axis=1) / 0.6745 / np.sqrt(2)
+    noise = np.maximum(noise, 1.0)[:, None]
+    s1 = np.concatenate([np.zeros((x.shape[0], 1)), np.cumsum(x, axis=1)], axis=1)
+    t = np.arange(window, x.shape[1] - window + 1)
+    before = (s1[:, t] - s1[:, t - window]) / window
+    after = (s1[:, t + window] - s1[:, t]) / window
+    score[:, t] = (after - before) / (noise * np.sqrt(2 / window))
+    return score
+
+
+def detect_anomalies(
+    matrix: SeriesMatrix,
+    z_threshold: float = Z_THRESHOLD,
+    shift_threshold: float = SHIFT_THRESHOLD,
+    min_delta: float = MIN_DELTA,
+) -> pd.DataFrame:
+    """Flag spikes/dips (rolling and, when available, seasonal z agree) and level shifts."""
+    x = matrix.counts
+    if x.size == 0:
+        return pd.DataFrame(columns=ANOMALY_COLUMNS)
+    z, rolling_mean = rolling_zscores(x)
+    seasonal = seasonal_baseline(x)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        seasonal_z = (x - seasonal) / np.sqrt(np.maximum(seasonal, 1.0))
+    expected = np.where(np.isnan(seasonal), rolling_mean, seasonal)
+    # Series long enough to have seasons must also beat the seasonal baseline (so a regular
+    # daily peak is not a spike) and are not flagged during the warm-up seasons.
+    if np.isnan(seasonal).all():
+        seasonal_ok = np.ones_like(x, dtype=bool)
+    else:
+        seasonal_ok = np.abs(seasonal_z) >= z_threshold
+    point = (np.abs(z) >= z_threshold) & seasonal_ok & (np.abs(x - expected) >= min_delta)
+
+    # Point anomalies are replaced by their expected value so one spike is not a level shift.
+    shift = change_points(np.where(point, expected, x))
+    # Keep only the strongest shift per series, and only if it clears the threshold.
+    strongest = np.argmax(np.where(np.isnan(shift), -np.inf, np.abs(shift)), axis=1)
+    rows = np.arange(x.shape[0])
+    shift_flag = np.zeros_like(point)
+    shift_flag[rows, strongest] = np.abs(np.nan_to_num(shift[rows, strongest])) >= shift_threshold
+
+    frames = []
+    for flags, kind, scores in ((point, "point", z), (shift_flag, "shift", shift)):
+        i, t = np.nonzero(flags)
+        if not len(i):
+            continue
+        if kind == "point":
+            kinds = np.where(z[i, t] > 0, "spike", "dip")
+        else:
+            kinds = np.where(shift[i, t] > 0, "level shift up", "level shift down")
+        frames.append(
+            pd.DataFrame(
+                {
+                    "event_name": matrix.names[i],
+                    "at": matrix.index[t],
+                    "kind": kinds,
+                    "value": x[i, t],
+                    "expected": np.round(expected[i, t], 1),
+                    "score": np.round(np.abs(scores[i, t]), 2),
+                }
+            )
+        )
+    if not frames:
+        return pd.DataFrame(columns=ANOMALY_COLUMNS)
+    found = pd.concat(frames, ignore_index=True)
+    return found.sort_values("score", ascending=False, ignore_index=True)
+
+
+def find_anomalies(events: pd.DataFrame, freq: str = FREQ) -> pd.DataFrame:
+    """Raw events in, flagged anomalies out (empty frame when nothing stands out)."""
+    matrix = count_matrix(events, freq)
+    anomalies = detect_anomalies(matrix)
+    logger.info(
+        f"Anomaly scan: {matrix.counts.shape[0]} series × {matrix.counts.shape[1]} buckets, "
+        f"{len(anomalies)} flagged"
+    )
+    return anomalies
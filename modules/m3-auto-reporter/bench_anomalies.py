@@ -0,0 +1,84 @@
+"""Benchmark the anomaly detection stage on synthetic event data.
+
+    python bench_anomalies.py --rows 1000000 5000000
+    python bench_anomalies.py --rows 1000000 --max-seconds 1   # CI budget check
+
+With ``--max-seconds`` the script exits non-zero when the categorical path
+takes longer than that for any row count. Timing lives here rather than in
+the unit tests, which only check what is flagged.
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from anomalies import count_matrix, detect_anomalies
+
+
+def synthetic_events(
+    rows: int, event_types: int = 20, days: int = 28, seed: int = 0
+) -> pd.DataFrame:
+    """Events with a daily cycle, one injected spike and one level shift."""
+    rng = np.random.default_rng(seed)
+    hours = days * 24
+    weight = 1.5 + np.sin(np.arange(hours) / 24 * 2 * np.pi)
+    hour = rng.choice(hours, size=rows, p=weight / weight.sum())
+    names = np.array([f"event_{i:02d}" for i in range(event_types)])
+    event = rng.integers(0, event_types, size=rows)
+    # event_00 spikes in one hour; event_01 triples for the last week.
+    spike = rng.random(rows) < 0.002
+    hour[spike], event[spike] = hours - 30, 0
+    shifted = (event == 1) & (hour >= hours - 7 * 24)
+    extra = np.repeat(hour[shifted], 2)
+    hour = np.concatenate([hour, extra])
+    event = np.concatenate([event, np.ones(len(extra), dtype=event.dtype)])
+    seconds = hour * 3600 + rng.integers(0, 3600, size=len(hour))
+    created = np.datetime64("2024-01-01T00:00:00") + seconds.astype("timedelta64[s]")
+    return pd.DataFrame({"event_name": names[event], "created_at": created})
+
+
+def bench(rows: int, repeat: int = 3) -> dict:
+    events = synthetic_events(rows)
+    results = {"rows": len(events)}
+    for label, frame in (
+        ("str", events),
+        ("categorical", events.assign(event_name=events["event_name"].astype("category"))),
+    ):
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            anomalies = detect_anomalies(count_matrix(frame))
+            best = min(best, time.perf_counter() - started)
+        results[label] = best
+        results["flagged"] = sorted(set(anomalies["event_name"]))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Time count_matrix + detect_anomalies")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 1_000_000, 5_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-seconds", type=float, help="Fail if the categorical path is slower")
+    args = parser.parse_args()
+
+    print(f"{'rows':>12} {'str (s)':>9} {'categorical (s)':>16}  flagged series")
+    over_budget = []
+    for rows in args.rows:
+        r = bench(rows, args.repeat)
+        print(
+            f"{r['rows']:>12,} {r['str']:>9.3f} {r['categorical']:>16.3f}  {', '.join(r['flagged'])}"
+        )
+        if args.max_seconds is not None and r["categorical"] > args.max_seconds:
+            over_budget.append(rows)
+    if over_budget:
+        sys.exit(
+            f"Over the {args.max_seconds}s budget at {', '.join(f'{n:,}' for n in over_budget)} rows"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Append-only SQLite feedback store with running aggregates."""
+
+from __future__ import annotations
+
+import datetime as dt
+import json
+import logging
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+RECENT_COMMENTS = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS feedback (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    report_id  TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    rating     REAL,
+    comment    TEXT,
+    payload    TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS feedback_report ON feedback (report_id);
+CREATE INDEX IF NOT EXISTS feedback_comments ON feedback (created_at) WHERE comment IS NOT NULL;
+CREATE TABLE IF NOT EXISTS feedback_daily (
+    day          TEXT PRIMARY KEY,
+    entries      INTEGER NOT NULL,
+    ratings      INTEGER NOT NULL,
+    rating_sum   REAL    NOT NULL
+);
+CREATE TABLE IF NOT EXISTS feedback_totals (
+    id           INTEGER PRIMARY KEY CHECK (id = 1),
+    entries      INTEGER NOT NULL,
+    ratings      INTEGER NOT NULL,
+    rating_sum   REAL    NOT NULL
+);
+"""
+
+_BUMP = """
+INSERT INTO {table} ({key}, entries, ratings, rating_sum) VALUES (?, 1, ?, ?)
+ON CONFLICT ({key}) DO UPDATE SET
+    entries = entries + 1,
+    ratings = ratings + excluded.ratings,
+    rating_sum = rating_sum + excluded.rating_sum
+"""
+
+
+class FeedbackStore:
+    """Feedback rows are only ever appended.
+
+    Running totals (overall and per day) are updated in the same transaction, so
+    the overall summary is one row, a window summary reads one row per day in the
+    window, and the latest comments come straight off an index, however much
+    feedback exists.
+    """
+
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __len__(self) -> int:
+        row = self.conn.execute("SELECT entries FROM feedback_totals WHERE id = 1").fetchone()
+        return int(row[0]) if row else 0
+
+    def add(
+        self, report_id: str, feedback: Dict[str, Any], at: Optional[dt.datetime] = None
+    ) -> int:
+        at = at or dt.datetime.now()
+        rating = feedback.get("rating")
+        rating = float(rating) if rating is not None else None
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO feedback (report_id, created_at, rating, comment, payload) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (report_id, at.isoformat(), rating, feedback.get("comment"), json.dumps(feedback)),
+            )
+            bump = (int(rating is not None), rating or 0.0)
+            self.conn.execute(
+                _BUMP.format(table="feedback_daily", key="day"), (at.date().isoformat(), *bump)
+            )
+            self.conn.execute(_BUMP.format(table="feedback_totals", key="id"), (1, *bump))
+        return cursor.lastrowid
+
+    def get(self, report_id: str) -> List[Dict[str, Any]]:
+        rows = self.conn.execute(
+            "SELECT payload FROM feedback WHERE report_id = ? ORDER BY id", (report_id,)
+        )
+        return [json.loads(payload) for (payload,) in rows]
+
+    def recent_comments(
+        self, n: int = RECENT_COMMENTS, since: Optional[dt.date] = None
+    ) -> List[str]:
+        """The ``n`` newest comments, oldest first."""
+        rows = self.conn.execute(
+            "SELECT comment FROM feedback WHERE comment IS NOT NULL AND created_at >= ? "
+            "ORDER BY created_at DESC LIMIT ?",
+            (since.isoformat() if since else "", n),
+        ).fetchall()
+        return [comment for (comment,) in reversed(rows)]
+
+    def summary(
+        self, days: Optional[int] = None, today: Optional[dt.date] = None
+    ) -> Dict[str, Any]:
+        """Average rating, entry count and recent comments, overall or for the last ``days``."""
+        if days is None:
+            since = None
+            row = self.conn.execute(
+                "SELECT entries, ratings, rating_sum FROM feedback_totals WHERE id = 1"
+            ).fetchone()
+        else:
+            since = (today or dt.date.today()) - dt.timedelta(days=days - 1)
+            row = self.conn.execute(
+                "SELECT SUM(entries), SUM(ratings), SUM(rating_sum) FROM feedback_daily WHERE day >= ?",
+                (since.isoformat(),),
+            ).fetchone()
+        entries, ratings, rating_sum = row if row and row[0] is not None else (0, 0, 0.0)
+        return {
+            "average_rating": rating_sum / ratings if ratings else None,
+            "total_feedback": entries,
+            "recent_comments": self.recent_comments(since=since),
+        }
+
+    def import_json_dir(self, directory: Path) -> int:
+        """One-off migration of legacy ``*_feedback.json`` files (file mtime as timestamp)."""
+        imported = 0
+        for file in sorted(directory.glob("*_feedback.json"), key=lambda f: f.stat().st_mtime):
+            report_id = file.name[: -len("_feedback.json")]
+            try:
+                data = json.loads(file.read_text())
+                self.add(report_id, data, dt.datetime.fromtimestamp(file.stat().st_mtime))
+            except (OSError, TypeError, ValueError) as e:
+                logger.warning(f"Skipping unreadable feedback file {file.name}: {e}")
+                continue
+            imported += 1
+        if imported:
+            logger.info(f"Imported {imported} legacy feedback files into {self.path}")
+        return imported
@@ -0,0 +1,219 @@
+"""Streaming event ingestion for the auto-reporter (bounded memory)."""
+
+from __future__ import annotations
+
+import datetime as dt
+import io
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, List, Tuple
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+CHUNK_ROWS = 250_000
+SAMPLE_ROWS = 20
+EVENT_COLUMNS = ["user_id", "event_name", "created_at"]
+AGG_COLUMNS = ["event_name", "events", "first_seen", "last_seen"]
+HOURLY_COLUMNS = ["event_name", "bucket", "events"]
+
+
+@dataclass
+class EventSummary:
+    """Row count, per-event and per-event-hour aggregates and a head sample, built chunk by chunk."""
+
+    sample_rows: int = SAMPLE_ROWS
+    rows: int = 0
+    by_event: pd.DataFrame = field(default_factory=lambda: pd.DataFrame(columns=AGG_COLUMNS))
+    sample: pd.DataFrame = field(default_factory=lambda: pd.DataFrame(columns=EVENT_COLUMNS))
+    hourly: pd.DataFrame = field(default_factory=lambda: pd.DataFrame(columns=HOURLY_COLUMNS))
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def update(self, chunk: pd.DataFrame) -> None:
+        """Fold one chunk into the running totals; memory stays O(event types × hours)."""
+        if chunk.empty:
+            return
+        self.rows += len(chunk)
+        if len(self.sample) < self.sample_rows:
+            head = chunk.head(self.sample_rows - len(self.sample))
+            self.sample = head if self.sample.empty else pd.concat([self.sample, head])
+
+        created = pd.to_datetime(chunk["created_at"], errors="coerce")
+        part = (
+            pd.DataFrame({"event_name": chunk["event_name"], "created_at": created})
+            .groupby("event_name", sort=False)["created_at"]
+            .agg(events="size", first_seen="min", last_seen="max")
+            .reset_index()
+        )
+        merged = part if self.by_event.empty else pd.concat([self.by_event, part])
+        self.by_event = (
+            merged.groupby("event_name", sort=False)
+            .agg(
+                events=("events", "sum"),
+                first_seen=("first_seen", "min"),
+                last_seen=("last_seen", "max"),
+            )
+            .reset_index()
+        )
+
+        hourly = (
+            pd.DataFrame({"event_name": chunk["event_name"], "bucket": created.dt.floor("h")})
+            .value_counts()
+            .reset_index(name="events")
+        )
+        merged = hourly if self.hourly.empty else pd.concat([self.hourly, hourly])
+        self.hourly = merged.groupby(["event_name", "bucket"], as_index=False)["events"].sum()
+
+    def top_events(self, n: int = 10) -> pd.DataFrame:
+        return self.by_event.nlargest(n, "events").reset_index(drop=True)
+
+    def to_markdown(self) -> str:
+        return (
+            self.top_events().to_markdown(index=False)
+            + "\n\nSample rows:\n\n"
+            + self.sample.to_markdown(index=False)
+        )
+
+
+def summarize_events(
+    chunks: Iterable[pd.DataFrame], sample_rows: int = SAMPLE_ROWS
+) -> EventSummary:
+    """Consume ``chunks`` once and return their ``EventSummary``."""
+    summary = EventSummary(sample_rows=sample_rows)
+    for chunk in chunks:
+        summary.update(chunk)
+    return summary
+
+
+def iter_csv_chunks(path: str, chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Yield the CSV in chunks, via pyarrow's streaming reader when installed."""
+    try:
+        from pyarrow import csv as pa_csv
+    except ImportError:
+        yield from pd.read_csv(path, chunksize=chunk_rows)
+        return
+
+    # pyarrow block size is in bytes; ~64 bytes per event row.
+    options = pa_csv.ReadOptions(block_size=max(chunk_rows * 64, 1 << 20))
+    with pa_csv.open_csv(path, read_options=options) as reader:
+        for batch in reader:
+            yield batch.to_pandas()
+
+
+class _ByteWindow(io.RawIOBase):
+    """Read-only view of bytes ``[start, end)`` of an open binary file."""
+
+    def __init__(self, f, start: int, end: int):
+        self.f = f
+        self.f.seek(start)
+        self.remaining = end - start
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        n = min(len(buffer), self.remaining)
+        if n <= 0:
+            return 0
+        data = self.f.read(n)
+        buffer[: len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+
+def _last_line_end(f, size: int, block: int = 1 << 16) -> int:
+    """Offset just past the last newline, so a line still being written is left for later."""
+    pos = size
+    while pos > 0:
+        start = max(pos - block, 0)
+        f.seek(start)
+        data = f.read(pos - start)
+        newline = data.rfind(b"\n")
+        if newline >= 0:
+            return start + newline + 1
+        pos = start
+    return 0
+
+
+def iter_csv_from(
+    path: str, offset: int, chunk_rows: int = CHUNK_ROWS
+) -> Tuple[Iterator[pd.DataFrame], int]:
+    """Chunks of the complete rows after byte ``offset``, and the offset to resume from.
+
+    Only the appended bytes are read; an offset past the end of the file
+    (truncated or rotated) restarts after the header.
+    """
+    with open(path, "rb") as f:
+        names: List[str] = f.readline().decode("utf-8").strip().split(",")
+        header_end = f.tell()
+        size = os.fstat(f.fileno()).st_size
+        end = max(_last_line_end(f, size), header_end)
+    start = offset if header_end <= offset <= end else header_end
+
+    def chunks() -> Iterator[pd.DataFrame]:
+        # Opened on first iteration, so a generator that is never consumed holds no handle.
+        if start >= end:
+            return
+        with open(path, "rb") as f:
+            window = io.BufferedReader(_ByteWindow(f, start, end))
+            yield from pd.read_csv(window, names=names, header=None, chunksize=chunk_rows)
+
+    return chunks(), end
+
+
+def _iter_query_pages(client, sql: str, params: list, page_rows: int) -> Iterator[pd.DataFrame]:
+    from google.cloud import bigquery
+
+    job_config = bigquery.QueryJobConfig(query_parameters=params)
+    rows = client.query(sql, job_config=job_config).result(page_size=page_rows)
+
+    try:
+        from google.cloud import bigquery_storage
+
+        read_client = bigquery_storage.BigQueryReadClient()
+    except ImportError:
+        logger.info("google-cloud-bigquery-storage not installed, paging over REST")
+        read_client = None
+    yield from rows.to_dataframe_iterable(bqstorage_client=read_client)
+
+
+def iter_bigquery_chunks(
+    client, day: dt.date, table: str = "my_ds.events", page_rows: int = CHUNK_ROWS
+) -> Iterator[pd.DataFrame]:
+    """Yield one day of events page by page, via the Storage Read API when installed."""
+    from google.cloud import bigquery
+
+    sql = f"""
+      SELECT user_id, event_name, created_at
+      FROM `{table}`
+      WHERE DATE(created_at) = @day
+    """
+    params = [bigquery.ScalarQueryParameter("day", "DATE", day)]
+    yield from _iter_query_pages(client, sql, params, page_rows)
+
+
+def iter_bigquery_since(
+    client, since: dt.datetime | None, table: str = "my_ds.events", page_rows: int = CHUNK_ROWS
+) -> Iterator[pd.DataFrame]:
+    """Yield events created at or after ``since`` (all events when None), oldest first.
+
+    Rows at exactly ``since`` are included; ``AggregateStore`` skips the ones it
+    already counted.
+    """
+    from google.cloud import bigquery
+
+    where = "WHERE created_at >= @since" if since is not None else ""
+    sql = f"""
+      SELECT user_id, event_name, created_at
+      FROM `{table}`
+      {where}
+      ORDER BY created_at
+    """
+    params = (
+        [bigquery.ScalarQueryParameter("since", "TIMESTAMP", since)] if since is not None else []
+    )
+    yield from _iter_query_pages(client, sql, params, page_rows)
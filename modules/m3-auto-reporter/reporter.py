@@ -8,10 +8,24 @@ from datetime import datetime
 from pathlib import Path
 
 import pandas as pd
-import requests
-import vertexai
+import slack_reporter
+from aggregates import WarehouseAggregates, fetch_aggregates
+from anomalies import ANOMALY_COLUMNS, detect_anomalies, find_anomalies, matrix_from_counts
 from dotenv import load_dotenv
-from vertexai.generative_models import GenerativeModel
+from feedback_store import FeedbackStore
+from google.cloud import bigquery
+from ingest import (
+    EventSummary,
+    iter_bigquery_chunks,
+    iter_bigquery_since,
+    iter_csv_chunks,
+    summarize_events,
+)
+from run_ledger import LEDGER_DB, RunLedger, RunRecord, new_run_id
+from slack_reporter import SlackError
+from state_store import AggregateStore
+from summarizer import Summary, SummaryEngine
+from templates import DEFAULT_TEMPLATE, PromptTemplates, markdown_rows
 
 load_dotenv()
 
@@ -19,157 +33,318 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-PROJECT   = os.getenv("VERTEX_PROJECT")
-LOCATION  = os.getenv("VERTEX_LOCATION", "us-central1")
+PROJECT = os.getenv("VERTEX_PROJECT")
+LOCATION = os.getenv("VERTEX_LOCATION", "us-central1")
 SLACK_URL = os.getenv("SLACK_WEBHOOK")
 LOCAL_CSV = os.getenv("CSV_PATH", "m3-auto-reporter/data/events.csv")
+STATE_DB = os.getenv("STATE_DB")
+FEEDBACK_DIR = Path("feedback")
+FEEDBACK_DB = Path(os.getenv("FEEDBACK_DB", str(FEEDBACK_DIR / "feedback.db")))
+FEEDBACK_WINDOW_DAYS = int(os.getenv("FEEDBACK_WINDOW_DAYS", "30"))
+
+SUMMARIES = SummaryEngine(PROJECT, LOCATION)
+TEMPLATES = PromptTemplates()
 
-vertexai.init(project=PROJECT, location=LOCATION)
-MODEL = GenerativeModel("gemini-2.5-pro")
 
 def fetch_events() -> pd.DataFrame:
     """Берём данные из BigQuery ИЛИ из локального CSV (для демо)."""
     try:
         if os.getenv("USE_BIGQUERY"):
-            from google.cloud import bigquery
             client = bigquery.Client(project=PROJECT)
-            yesterday = (dt.date.today() - dt.timedelta(days=1)).isoformat()
-            sql = f"""
+            yesterday = dt.date.today() - dt.timedelta(days=1)
+            sql = """
               SELECT user_id,event_name,created_at
               FROM  `my_ds.events`
-              WHERE DATE(created_at) = '{yesterday}'
+              WHERE DATE(created_at) = @day
               LIMIT 500
             """
+            job_config = bigquery.QueryJobConfig(
+                query_parameters=[bigquery.ScalarQueryParameter("day", "DATE", yesterday)]
+            )
             logger.info(f"Fetching events from BigQuery for {yesterday}")
-            return client.query(sql).to_dataframe()
+            return client.query(sql, job_config=job_config).to_dataframe()
         else:
             logger.info(f"Reading events from CSV: {LOCAL_CSV}")
             return pd.read_csv(LOCAL_CSV)
     except Exception as e:
         logger.error(f"Error fetching events: {e}")
         # Return empty DataFrame as fallback
-        return pd.DataFrame(columns=['user_id', 'event_name', 'created_at'])
+        return pd.DataFrame(columns=["user_id", "event_name", "created_at"])
 
-def build_prompt(df: pd.DataFrame) -> str:
-    top = df.head(20).to_markdown(index=False)
-    tpl = Path(__file__).with_name("prompts").joinpath("daily_summary.jinja").read_text()
-    return tpl.format(n=len(df), table=top)
 
-def generate_summary(prompt: str) -> str:
-    """Generate summary using Vertex AI Gemini model."""
+def stream_events() -> EventSummary:
+    """Single bounded-memory pass over the day's events (CSV chunks or BigQuery pages)."""
+    try:
+        if os.getenv("USE_BIGQUERY"):
+            client = bigquery.Client(project=PROJECT)
+            yesterday = dt.date.today() - dt.timedelta(days=1)
+            logger.info(f"Streaming events from BigQuery for {yesterday}")
+            return summarize_events(iter_bigquery_chunks(client, yesterday))
+        else:
+            logger.info(f"Streaming events from CSV: {LOCAL_CSV}")
+            return summarize_events(iter_csv_chunks(LOCAL_CSV))
+    except Exception as e:
+        logger.error(f"Error streaming events: {e}")
+        return EventSummary()
+
+
+def fetch_warehouse_aggregates() -> WarehouseAggregates:
+    """Aggregate yesterday's events inside BigQuery (counts, hourly, users, movers)."""
+    client = bigquery.Client(project=PROJECT)
+    yesterday = dt.date.today() - dt.timedelta(days=1)
+    logger.info(f"Aggregating events in BigQuery for {yesterday}")
+    max_bytes = os.getenv("BQ_MAX_BYTES_BILLED")
+    return fetch_aggregates(
+        client, yesterday, max_bytes_billed=int(max_bytes) if max_bytes else None
+    )
+
+
+def load_events() -> pd.DataFrame | EventSummary | WarehouseAggregates:
+    """Pick the ingestion mode from the environment.
+
+    BigQuery runs aggregate in the warehouse unless RAW_EVENTS is set;
+    STREAM_EVENTS switches to the single-pass streaming reader.
+    """
+    if os.getenv("USE_BIGQUERY") and not os.getenv("RAW_EVENTS") and not os.getenv("STREAM_EVENTS"):
+        try:
+            return fetch_warehouse_aggregates()
+        except Exception as e:
+            logger.error(f"Error aggregating in BigQuery, falling back to raw events: {e}")
+    if os.getenv("STREAM_EVENTS"):
+        return stream_events()
+    return fetch_events()
+
+
+def update_state_store() -> pd.DataFrame | None:
+    """Fold events newer than the store's watermark into STATE_DB; return yesterday's trends."""
+    if not STATE_DB:
+        return None
+    store = AggregateStore(STATE_DB)
+    try:
+        if os.getenv("USE_BIGQUERY"):
+            client = bigquery.Client(project=PROJECT)
+            store.ingest(iter_bigquery_since(client, store.watermark()))
+        else:
+            store.ingest_csv(LOCAL_CSV)
+        return store.trends(dt.date.today() - dt.timedelta(days=1))
+    except Exception as e:
+        logger.error(f"Error updating state store: {e}")
+        return None
+    finally:
+        store.close()
+
+
+def find_event_anomalies(
+    events: pd.DataFrame | EventSummary | WarehouseAggregates,
+) -> pd.DataFrame | None:
+    """Run the anomaly detector over every event series; None when there is no time series."""
+    try:
+        if isinstance(events, EventSummary):
+            return detect_anomalies(matrix_from_counts(events.hourly))
+        if isinstance(events, WarehouseAggregates):
+            # The history days only warm the detector up; report the summarised day.
+            found = detect_anomalies(matrix_from_counts(events.hourly_by_event))
+            return found[pd.to_datetime(found["at"]).dt.date == events.day].reset_index(drop=True)
+        if isinstance(events, pd.DataFrame) and {"event_name", "created_at"} <= set(events.columns):
+            return find_anomalies(events)
+    except Exception as e:
+        logger.error(f"Error detecting anomalies: {e}")
+        return pd.DataFrame(columns=ANOMALY_COLUMNS)
+    return None
+
+
+def prompt_tables(events: pd.DataFrame | EventSummary | WarehouseAggregates) -> dict:
+    """Extra tables for the prompt: stored trends and flagged anomalies, when available."""
+    tables = {}
+    trends = update_state_store()
+    if trends is not None:
+        tables["trends"] = trends
+    anomalies = find_event_anomalies(events)
+    if anomalies is not None:
+        tables["anomalies"] = anomalies
+    return tables
+
+
+def build_prompt(
+    df: pd.DataFrame | EventSummary | WarehouseAggregates,
+    template: str = DEFAULT_TEMPLATE,
+    **tables: pd.DataFrame,
+) -> str:
+    """Render ``template`` (relative to this module) with the event count and tables.
+
+    Extra ``tables`` reach the template as markdown lines (an empty list when empty).
+    """
+    table = df if isinstance(df, pd.DataFrame) else df.to_markdown()
+    context = {name: markdown_rows(t) if len(t) else [] for name, t in tables.items()}
+    return TEMPLATES.render(template, n=len(df), table=table, **context)
+
+
+def summarize_prompt(prompt: str) -> Summary:
+    """Generate summary using Vertex AI Gemini model (cached, retried, with a timeout).
+
+    The returned stats belong to this call only; they are None when generation failed.
+    """
     try:
         logger.info("Generating summary with Vertex AI")
-        chat = MODEL.start_chat()
-        response = chat.send_message(prompt).text.strip()
+        summary = SUMMARIES.summarize(prompt)
         logger.info("Summary generated successfully")
-        return response
+        return summary
     except Exception as e:
         logger.error(f"Error generating summary: {e}")
-        return "Error generating summary. Please check the logs."
+        return Summary("Error generating summary. Please check the logs.", None)
+
+
+def generate_summary(prompt: str) -> str:
+    """Summary text only, see ``summarize_prompt``."""
+    return summarize_prompt(prompt).text
+
 
-def send_to_slack(text: str):
-    """Send message to Slack webhook or print to console."""
+def send_to_slack(text: str, channel: str | list[str] | None = None, webhook: str | None = None):
+    """Send message to Slack webhook (one or many channels) or print to console."""
     try:
-        if not SLACK_URL:
+        url = webhook or SLACK_URL
+        if not url:
             logger.info("No Slack webhook configured, printing to console")
             print("=== SUMMARY ===\n", text)
+        elif isinstance(channel, (list, tuple)):
+            logger.info(f"Sending report to {len(channel)} Slack channels")
+            failed = [
+                c
+                for c, error in slack_reporter.get_client().fan_out(text, channel, url).items()
+                if error
+            ]
+            if failed:
+                raise SlackError(f"delivery failed for {', '.join(failed)}")
+            logger.info("Report sent to Slack successfully")
         else:
             logger.info("Sending report to Slack")
-            resp = requests.post(SLACK_URL, json={"text": text})
-            resp.raise_for_status()
+            slack_reporter.get_client().send(text, channel, url)
             logger.info("Report sent to Slack successfully")
     except Exception as e:
         logger.error(f"Error sending to Slack: {e}")
         print("=== SUMMARY (Slack failed) ===\n", text)
 
+
+def open_feedback_store() -> FeedbackStore:
+    """Open the feedback store, importing legacy per-report JSON files the first time."""
+    is_new = not FEEDBACK_DB.exists()
+    store = FeedbackStore(FEEDBACK_DB)
+    if is_new and FEEDBACK_DIR.exists():
+        store.import_json_dir(FEEDBACK_DIR)
+    return store
+
+
 def save_report_feedback(report_id: str, feedback: dict):
     """Save report feedback for continuous improvement."""
     try:
-        feedback_file = Path("feedback") / f"{report_id}_feedback.json"
-        feedback_file.parent.mkdir(exist_ok=True)
-        
-        with open(feedback_file, 'w') as f:
-            json.dump(feedback, f, indent=2)
+        store = open_feedback_store()
+        try:
+            store.add(report_id, feedback)
+        finally:
+            store.close()
         logger.info(f"Feedback saved for report {report_id}")
     except Exception as e:
         logger.error(f"Failed to save feedback: {e}")
 
-def analyze_feedback_trends():
-    """Analyze feedback trends for report improvement."""
+
+def analyze_feedback_trends(days: int | None = FEEDBACK_WINDOW_DAYS):
+    """Analyze feedback trends for report improvement (last ``days`` days, None for all)."""
     try:
-        feedback_dir = Path("feedback")
-        if not feedback_dir.exists():
+        if not FEEDBACK_DB.exists() and not FEEDBACK_DIR.exists():
             return {"message": "No feedback data available"}
-        
-        feedback_files = list(feedback_dir.glob("*_feedback.json"))
-        if not feedback_files:
-            return {"message": "No feedback files found"}
-        
-        # Simple analysis of feedback trends
-        ratings = []
-        comments = []
-        
-        for file in feedback_files:
-            with open(file, 'r') as f:
-                data = json.load(f)
-                if 'rating' in data:
-                    ratings.append(data['rating'])
-                if 'comment' in data:
-                    comments.append(data['comment'])
-        
-        avg_rating = sum(ratings) / len(ratings) if ratings else 0
-        logger.info(f"Average feedback rating: {avg_rating:.2f}")
-        
-        return {
-            "average_rating": avg_rating,
-            "total_feedback": len(feedback_files),
-            "recent_comments": comments[-5:] if comments else []
-        }
-        
+
+        store = open_feedback_store()
+        try:
+            if not len(store):
+                return {"message": "No feedback found"}
+            summary = store.summary(days)
+        finally:
+            store.close()
+
+        if summary["average_rating"] is not None:
+            logger.info(f"Average feedback rating: {summary['average_rating']:.2f}")
+        return summary
+
     except Exception as e:
         logger.error(f"Error analyzing feedback: {e}")
         return {"error": str(e)}
 
+
+def record_run(run: RunRecord) -> None:
+    """Append the run to the ledger; a ledger failure never fails the report."""
+    try:
+        ledger = RunLedger(LEDGER_DB)
+        try:
+            ledger.record(run)
+        finally:
+            ledger.close()
+    except Exception as e:
+        logger.error(f"Failed to record run {run.run_id}: {e}")
+
+
 def main() -> None:
     """Enhanced main function with feedback integration."""
+    # Generate unique report ID
+    report_id = new_run_id("report")
+    run = RunRecord(report_id)
     try:
-        # Generate unique report ID
-        report_id = f"report_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         logger.info(f"Starting report generation: {report_id}")
-        
+
         # Analyze previous feedback for improvements
         feedback_analysis = analyze_feedback_trends()
         logger.info(f"Feedback analysis: {feedback_analysis}")
-        
+
         # Generate report
-        events = fetch_events()
-        prompt = build_prompt(events)
-        summary = generate_summary(prompt)
-        
+        with run.stage("fetch"):
+            events = load_events()
+        run.rows = len(events)
+        if isinstance(events, WarehouseAggregates):
+            run.bytes_scanned = events.bytes_processed
+            run.cache_hits += events.cache_hits
+        with run.stage("aggregate"):
+            tables = prompt_tables(events)
+        with run.stage("prompt"):
+            prompt = build_prompt(events, **tables)
+        with run.stage("llm"):
+            result = summarize_prompt(prompt)
+        summary, llm_stats = result.text, result.stats
+        if llm_stats:
+            run.prompt_tokens, run.output_tokens = llm_stats.prompt_tokens, llm_stats.output_tokens
+            run.cache_hits += int(llm_stats.cached)
+
         # Enhanced summary with feedback integration
-        if feedback_analysis.get("average_rating", 0) < 3.0:
+        average_rating = feedback_analysis.get("average_rating")
+        if average_rating is not None and average_rating < 3.0:
             summary += "\n\n---\n*Note: This report has been enhanced based on previous feedback.*"
-        
-        send_to_slack(summary)
-        
+
+        with run.stage("slack"):
+            send_to_slack(summary)
+        run.status = "ok"
+
         # Save report metadata for feedback tracking
         report_metadata = {
             "report_id": report_id,
             "timestamp": datetime.now().isoformat(),
             "events_count": len(events),
-            "summary_length": len(summary)
+            "summary_length": len(summary),
+            "llm": llm_stats.as_dict() if llm_stats else None,
+            "run": run.as_dict(),
         }
-        
+
         metadata_file = Path("reports") / f"{report_id}_metadata.json"
         metadata_file.parent.mkdir(exist_ok=True)
-        with open(metadata_file, 'w') as f:
+        with open(metadata_file, "w") as f:
             json.dump(report_metadata, f, indent=2)
-        
+
         logger.info(f"Report {report_id} completed successfully")
-        
+
     except Exception as e:
+        run.status, run.error = "error", str(e)
         logger.error(f"Error in main execution: {e}")
         raise
+    finally:
+        record_run(run)
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,230 @@
+"""Ledger of report runs: per-stage timings and volume counters in SQLite.
+
+python run_ledger.py --last 50            # p50/p95 per stage over the last 50 runs
+python run_ledger.py --report daily_summary --last 10
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+LEDGER_DB = Path(os.getenv("RUN_LEDGER", "reports/ledger.db"))
+LAST_RUNS = 50
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id        TEXT PRIMARY KEY,
+    report        TEXT    NOT NULL,
+    started_at    TEXT    NOT NULL,
+    status        TEXT    NOT NULL,
+    total_seconds REAL    NOT NULL,
+    rows          INTEGER NOT NULL,
+    bytes_scanned INTEGER NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    output_tokens INTEGER NOT NULL,
+    cache_hits    INTEGER NOT NULL,
+    error         TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_by_report ON runs (report, started_at);
+CREATE INDEX IF NOT EXISTS runs_by_time ON runs (started_at);
+CREATE TABLE IF NOT EXISTS stage_timings (
+    run_id  TEXT NOT NULL REFERENCES runs (run_id),
+    stage   TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (run_id, stage)
+);
+"""
+
+_COUNTERS = ["rows", "bytes_scanned", "prompt_tokens", "output_tokens", "cache_hits"]
+
+
+def new_run_id(report: str, started_at: Optional[dt.datetime] = None) -> str:
+    """Readable, unique run id: report name, start time and a random suffix."""
+    started_at = started_at or dt.datetime.now()
+    return f"{report}_{started_at:%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:8]}"
+
+
+@dataclass
+class RunRecord:
+    run_id: str
+    report: str = "daily_summary"
+    started_at: dt.datetime = field(default_factory=dt.datetime.now)
+    status: str = "running"
+    timings: Dict[str, float] = field(default_factory=dict)
+    rows: int = 0
+    bytes_scanned: int = 0
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    cache_hits: int = 0
+    error: Optional[str] = None
+
+    @property
+    def total(self) -> float:
+        return sum(self.timings.values())
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time the enclosed block as ``name`` (accumulates if a stage repeats)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - started
+
+    def as_dict(self) -> dict:
+        return {
+            "run_id": self.run_id,
+            "report": self.report,
+            "started_at": self.started_at.isoformat(),
+            "status": self.status,
+            "timings": {k: round(v, 4) for k, v in self.timings.items()},
+            **{name: getattr(self, name) for name in _COUNTERS},
+            "error": self.error,
+        }
+
+
+class RunLedger:
+    """Append-only run history; one row per run plus one row per stage timing."""
+
+    def __init__(self, path: Path | str = LEDGER_DB):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Scheduler runs finish on the event loop thread, reporter runs on the main thread.
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def record(self, run: RunRecord) -> None:
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    run.run_id,
+                    run.report,
+                    run.started_at.isoformat(),
+                    run.status,
+                    run.total,
+                    *(int(getattr(run, name)) for name in _COUNTERS),
+                    run.error,
+                ),
+            )
+            self.conn.executemany(
+                "INSERT INTO stage_timings VALUES (?, ?, ?)",
+                [(run.run_id, stage, seconds) for stage, seconds in run.timings.items()],
+            )
+        logger.info(f"Run {run.run_id} ({run.status}) recorded in {self.path}")
+
+    def recent_runs(self, n: int = LAST_RUNS, report: Optional[str] = None) -> pd.DataFrame:
+        where, params = ("WHERE report = ?", (report,)) if report else ("", ())
+        return pd.read_sql_query(
+            f"SELECT * FROM runs {where} ORDER BY started_at DESC LIMIT ?",
+            self.conn,
+            params=(*params, n),
+        )
+
+    def stage_percentiles(self, n: int = LAST_RUNS, report: Optional[str] = None) -> pd.DataFrame:
+        """p50/p95/max per stage over the last ``n`` runs, plus the latest run's time."""
+        runs = self.recent_runs(n, report)
+        columns = ["stage", "runs", "p50", "p95", "max", "last", "regressed"]
+        if runs.empty:
+            return pd.DataFrame(columns=columns)
+        ids = runs["run_id"].tolist()
+        timings = pd.read_sql_query(
+            f"SELECT run_id, stage, seconds FROM stage_timings "
+            f"WHERE run_id IN ({','.join('?' * len(ids))})",
+            self.conn,
+            params=ids,
+        )
+        latest = ids[0]
+        rows = []
+        for stage, group in timings.groupby("stage", sort=False):
+            seconds = group["seconds"].to_numpy()
+            p50, p95 = np.percentile(seconds, [50, 95])
+            last = group.loc[group["run_id"] == latest, "seconds"]
+            last = float(last.iloc[0]) if len(last) else float("nan")
+            rows.append(
+                [
+                    stage,
+                    len(seconds),
+                    p50,
+                    p95,
+                    seconds.max(),
+                    last,
+                    bool(len(seconds) > 1 and last > p95),
+                ]
+            )
+        order = {
+            stage: i
+            for i, stage in enumerate(["fetch", "query", "aggregate", "prompt", "llm", "slack"])
+        }
+        result = pd.DataFrame(rows, columns=columns)
+        return result.sort_values(
+            "stage", key=lambda s: s.map(order).fillna(len(order)), ignore_index=True
+        )
+
+    def counter_summary(self, n: int = LAST_RUNS, report: Optional[str] = None) -> pd.DataFrame:
+        """p50/p95 of the volume counters over the last ``n`` runs."""
+        runs = self.recent_runs(n, report)
+        if runs.empty:
+            return pd.DataFrame(columns=["counter", "p50", "p95", "last"])
+        return pd.DataFrame(
+            [
+                [name, *np.percentile(runs[name], [50, 95]), runs[name].iloc[0]]
+                for name in _COUNTERS
+            ],
+            columns=["counter", "p50", "p95", "last"],
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Per-stage timings of recent report runs")
+    parser.add_argument("--db", default=str(LEDGER_DB), help="Path to the run ledger")
+    parser.add_argument(
+        "--last", type=int, default=LAST_RUNS, help="Number of most recent runs to include"
+    )
+    parser.add_argument("--report", help="Only runs of this report")
+    parser.add_argument("--json", action="store_true", help="Print the raw runs as JSON lines")
+    args = parser.parse_args()
+
+    ledger = RunLedger(args.db)
+    try:
+        if args.json:
+            for record in ledger.recent_runs(args.last, args.report).to_dict("records"):
+                print(json.dumps(record))
+            return
+        stages = ledger.stage_percentiles(args.last, args.report)
+        if stages.empty:
+            print(f"No runs recorded in {args.db}")
+            return
+        print(f"Stage timings (seconds) over the last {int(stages['runs'].max())} runs:\n")
+        print(stages.to_markdown(index=False, floatfmt=".3f"))
+        print("\nVolume:\n")
+        print(
+            ledger.counter_summary(args.last, args.report).to_markdown(index=False, floatfmt=".0f")
+        )
+    finally:
+        ledger.close()
+
+
+if __name__ == "__main__":
+    main()
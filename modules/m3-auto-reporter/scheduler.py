@@ -0,0 +1,440 @@
+"""Config-driven multi-report scheduler for the auto-reporter.
+
+Loads every ``[[report]]`` from ``config.toml`` and runs the ones that are due
+in parallel; each report's query, LLM summary and Slack post run in worker
+threads so independent reports overlap.
+
+A report that exceeds its ``timeout`` is marked ``timeout`` and no further
+stage starts. Python threads cannot be killed, so the stage that was running
+keeps going until it returns; its result is discarded. Each stage runs on a
+thread of its own rather than in a shared pool, so an abandoned stage never
+takes a slot that another report's stage would queue for (and spend its own
+timeout waiting on). Stages cancel
+cooperatively by calling ``check_cancelled()`` before side effects – the
+built-in stages do so before updating the state store and before posting to
+Slack. Calls already in flight (an HTTP request, an LLM call) still run to
+completion.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime as dt
+import logging
+import os
+import re
+import threading
+import time
+import tomllib
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import pandas as pd
+from run_ledger import RunLedger, RunRecord, new_run_id
+from summarizer import Summary
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PATH = Path(__file__).with_name("config.toml")
+DEFAULT_SCHEDULE = "0 8 * * *"
+DEFAULT_TIMEOUT = 300.0
+MAX_PARALLEL = 4
+
+_VAR_RE = re.compile(r"\$\{(\w+)\}")
+_stage = threading.local()
+
+
+class StageCancelled(RuntimeError):
+    """Raised by ``check_cancelled`` in a stage whose report has timed out."""
+
+
+def check_cancelled() -> None:
+    """Raise ``StageCancelled`` if the report running on this thread was abandoned."""
+    cancelled = getattr(_stage, "cancelled", None)
+    if cancelled is not None and cancelled.is_set():
+        raise StageCancelled("report timed out; stage cancelled")
+
+
+def _call_stage(fn: Callable, spec: "ReportSpec", value: Any, cancelled: threading.Event) -> Any:
+    _stage.cancelled = cancelled
+    try:
+        check_cancelled()
+        return fn(spec, value)
+    finally:
+        _stage.cancelled = None
+
+
+def _start_stage(
+    loop: asyncio.AbstractEventLoop,
+    fn: Callable,
+    spec: "ReportSpec",
+    value: Any,
+    cancelled: threading.Event,
+) -> asyncio.Future:
+    """Run one stage on a new daemon thread; the future resolves with its result."""
+    future = loop.create_future()
+
+    def settle(result: Any, error: Optional[BaseException]) -> None:
+        if future.done():  # the report timed out and stopped waiting
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def target() -> None:
+        try:
+            outcome = (_call_stage(fn, spec, value, cancelled), None)
+        except BaseException as e:
+            outcome = (None, e)
+        try:
+            loop.call_soon_threadsafe(settle, *outcome)
+        except RuntimeError:
+            pass  # the scheduler's loop has closed; nobody is waiting for this result
+
+    threading.Thread(target=target, name=f"report-{spec.name}", daemon=True).start()
+    return future
+
+
+def expand_env(value: Any) -> Any:
+    """Recursively replace ``${VAR}`` in strings with the environment value (or "")."""
+    if isinstance(value, str):
+        return _VAR_RE.sub(lambda m: os.getenv(m.group(1), ""), value)
+    if isinstance(value, list):
+        return [expand_env(v) for v in value]
+    if isinstance(value, dict):
+        return {k: expand_env(v) for k, v in value.items()}
+    return value
+
+
+@dataclass
+class ReportSpec:
+    name: str
+    channel: Optional[Union[str, List[str]]] = None  # a list fans out concurrently
+    template: str = "prompts/daily_summary.jinja"
+    query: Optional[str] = None
+    schedule: str = DEFAULT_SCHEDULE
+    timeout: float = DEFAULT_TIMEOUT
+    webhook: Optional[str] = None
+
+
+@dataclass
+class ReportRun:
+    name: str
+    status: str = "pending"
+    timings: Dict[str, float] = field(default_factory=dict)
+    error: Optional[str] = None
+    rows: int = 0
+    bytes_scanned: int = 0
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    cache_hits: int = 0
+    started_at: dt.datetime = field(default_factory=dt.datetime.now)
+    run_id: str = ""
+
+    def __post_init__(self) -> None:
+        self.run_id = self.run_id or new_run_id(self.name, self.started_at)
+
+    @property
+    def total(self) -> float:
+        return sum(self.timings.values())
+
+    def absorb(self, value: Any) -> Any:
+        """Take the counters a stage result carries, as ``reporter.main`` does.
+
+        Warehouse aggregates and query frames report bytes scanned and cache
+        hits; a ``Summary`` reports tokens and is passed on as its text.
+        """
+        if isinstance(value, Summary):
+            if value.stats is not None:
+                self.prompt_tokens += value.stats.prompt_tokens
+                self.output_tokens += value.stats.output_tokens
+                self.cache_hits += int(value.stats.cached)
+            return value.text
+        if isinstance(value, pd.DataFrame):
+            counters = value.attrs
+        else:  # WarehouseAggregates, without importing the BigQuery client here
+            counters = {
+                "bytes_processed": getattr(value, "bytes_processed", 0),
+                "cache_hits": getattr(value, "cache_hits", 0),
+            }
+        self.bytes_scanned += int(counters.get("bytes_processed") or 0)
+        self.cache_hits += int(counters.get("cache_hits") or 0)
+        return value
+
+    def to_record(self) -> RunRecord:
+        return RunRecord(
+            run_id=self.run_id,
+            report=self.name,
+            started_at=self.started_at,
+            status=self.status,
+            timings=dict(self.timings),
+            rows=self.rows,
+            bytes_scanned=self.bytes_scanned,
+            prompt_tokens=self.prompt_tokens,
+            output_tokens=self.output_tokens,
+            cache_hits=self.cache_hits,
+            error=self.error,
+        )
+
+
+def _channels(channel: Optional[Union[str, List[str]]]) -> str:
+    if not channel:
+        return "(webhook default)"
+    return channel if isinstance(channel, str) else ", ".join(channel)
+
+
+def load_reports(path: Path = CONFIG_PATH) -> List[ReportSpec]:
+    """Parse ``config.toml`` into report specs, expanding ``${VAR}`` everywhere."""
+    with open(path, "rb") as f:
+        config = expand_env(tomllib.load(f))
+    webhook = config.get("slack", {}).get("webhook_url") or None
+    reports = []
+    for entry in config.get("report", []):
+        entry = {"webhook": webhook, **entry}
+        known = {k: v for k, v in entry.items() if k in ReportSpec.__dataclass_fields__}
+        reports.append(ReportSpec(**known))
+    return reports
+
+
+# --- cron ---------------------------------------------------------------------
+
+_CRON_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+
+def _parse_field(expr: str, low: int, high: int) -> set:
+    values = set()
+    for part in expr.split(","):
+        step = None
+        if "/" in part:
+            part, step_str = part.split("/")
+            step = int(step_str)
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (int(x) for x in part.split("-"))
+        else:
+            # "5/15" means from 5 to the end of the range, every 15
+            start = int(part)
+            end = high if step else start
+        step = step or 1
+        values.update(range(start, end + 1, step))
+    return values
+
+
+@dataclass(frozen=True)
+class Cron:
+    """Parsed 5-field cron expression (minute hour day-of-month month day-of-week)."""
+
+    minutes: frozenset
+    hours: frozenset
+    days: frozenset
+    months: frozenset
+    weekdays: frozenset
+    any_day: bool
+    any_weekday: bool
+
+    def day_matches(self, when: dt.datetime) -> bool:
+        if when.month not in self.months:
+            return False
+        dom_ok = when.day in self.days
+        dow_ok = (when.weekday() + 1) % 7 in self.weekdays
+        # Standard cron: when both day fields are restricted, either may match.
+        if self.any_day or self.any_weekday:
+            return dom_ok and dow_ok
+        return dom_ok or dow_ok
+
+    def matches(self, when: dt.datetime) -> bool:
+        return when.minute in self.minutes and when.hour in self.hours and self.day_matches(when)
+
+
+def parse_cron(expr: str) -> Cron:
+    fields = expr.split()
+    if len(fields) != 5:
+        raise ValueError(f"Expected 5 cron fields, got {expr!r}")
+    minutes, hours, days, months, weekdays = (
+        frozenset(_parse_field(f, lo, hi)) for f, (lo, hi) in zip(fields, _CRON_RANGES)
+    )
+    if 7 in weekdays:  # both 0 and 7 mean Sunday
+        weekdays |= {0}
+    return Cron(minutes, hours, days, months, weekdays, fields[2] == "*", fields[4] == "*")
+
+
+def cron_matches(expr: str, when: dt.datetime) -> bool:
+    return parse_cron(expr).matches(when)
+
+
+def next_run(expr: str, after: dt.datetime) -> dt.datetime:
+    """First minute strictly after ``after`` that matches ``expr`` (within a year)."""
+    cron = parse_cron(expr)
+    when = after.replace(second=0, microsecond=0) + dt.timedelta(minutes=1)
+    limit = when + dt.timedelta(days=366)
+    while when < limit:
+        if not cron.day_matches(when):
+            when = (when + dt.timedelta(days=1)).replace(hour=0, minute=0)
+        elif when.hour not in cron.hours:
+            when = (when + dt.timedelta(hours=1)).replace(minute=0)
+        elif when.minute not in cron.minutes:
+            when += dt.timedelta(minutes=1)
+        else:
+            return when
+    raise ValueError(f"Cron expression {expr!r} never fires")
+
+
+# --- execution ----------------------------------------------------------------
+
+
+def run_query(spec: ReportSpec):
+    """Run the report's SQL in BigQuery, or fall back to the reporter's event loader."""
+    import reporter
+
+    if spec.query and os.getenv("USE_BIGQUERY"):
+        from google.cloud import bigquery
+
+        client = bigquery.Client(project=reporter.PROJECT)
+        config = bigquery.QueryJobConfig(use_query_cache=True)
+        job = client.query(spec.query, job_config=config)
+        frame = job.to_dataframe()
+        frame.attrs.update(
+            bytes_processed=job.total_bytes_processed or 0, cache_hits=int(bool(job.cache_hit))
+        )
+        return frame
+    return reporter.load_events()
+
+
+def default_stages() -> Dict[str, Callable]:
+    import reporter
+
+    def prompt(spec: ReportSpec, data: Any) -> str:
+        check_cancelled()  # prompt_tables updates the state store
+        return reporter.build_prompt(data, spec.template, **reporter.prompt_tables(data))
+
+    def slack(spec: ReportSpec, text: str) -> None:
+        check_cancelled()
+        reporter.send_to_slack(text, channel=spec.channel, webhook=spec.webhook)
+
+    return {
+        "query": lambda spec, _: run_query(spec),
+        "prompt": prompt,
+        "llm": lambda spec, prompt: reporter.summarize_prompt(prompt),
+        "slack": slack,
+    }
+
+
+class ReportScheduler:
+    """Runs due reports concurrently, each stage in a worker thread."""
+
+    def __init__(
+        self,
+        reports: List[ReportSpec],
+        stages: Optional[Dict[str, Callable]] = None,
+        max_parallel: int = MAX_PARALLEL,
+        ledger: Optional[RunLedger] = None,
+    ):
+        self.reports = reports
+        self.stages = stages
+        self.max_parallel = max_parallel
+        self.ledger = ledger
+
+    def due(self, now: dt.datetime) -> List[ReportSpec]:
+        return [r for r in self.reports if cron_matches(r.schedule, now)]
+
+    def plan(self, now: dt.datetime) -> str:
+        """Human-readable execution plan (used by ``--dry-run``)."""
+        stage_names = " → ".join(self.stages or ["query", "prompt", "llm", "slack"])
+        lines = [
+            f"Execution plan at {now:%Y-%m-%d %H:%M} "
+            f"({len(self.reports)} reports, up to {self.max_parallel} in parallel):"
+        ]
+        for r in self.reports:
+            lines.append(
+                f"  - {r.name}: schedule '{r.schedule}', next {next_run(r.schedule, now):%Y-%m-%d %H:%M}, "
+                f"timeout {r.timeout:.0f}s, channel {_channels(r.channel)}, "
+                f"template {r.template}, stages {stage_names}"
+            )
+        return "\n".join(lines)
+
+    async def _run_one(self, spec: ReportSpec, semaphore: asyncio.Semaphore) -> ReportRun:
+        stages = self.stages or default_stages()
+        run = ReportRun(spec.name, status="running")
+        loop = asyncio.get_running_loop()
+        cancelled = threading.Event()
+
+        async def pipeline() -> None:
+            value = None
+            for stage, fn in stages.items():
+                started = time.perf_counter()
+                value = await _start_stage(loop, fn, spec, value, cancelled)
+                run.timings[stage] = time.perf_counter() - started
+                if stage == "query" and hasattr(value, "__len__"):
+                    run.rows = len(value)
+                value = run.absorb(value)
+
+        async with semaphore:
+            try:
+                await asyncio.wait_for(pipeline(), timeout=spec.timeout)
+                run.status = "ok"
+            except asyncio.TimeoutError:
+                # The running stage's thread cannot be killed: flag it so it stops at
+                # its next check_cancelled(); its result is dropped.
+                cancelled.set()
+                run.status, run.error = "timeout", f"exceeded {spec.timeout:.0f}s"
+            except Exception as e:
+                run.status, run.error = "error", str(e)
+        logger.info(f"Report {spec.name}: {run.status} in {run.total:.2f}s {run.timings}")
+        if self.ledger is not None:
+            try:
+                self.ledger.record(run.to_record())
+            except Exception as e:
+                logger.error(f"Failed to record run of {spec.name}: {e}")
+        return run
+
+    async def run(self, specs: Optional[List[ReportSpec]] = None) -> List[ReportRun]:
+        specs = self.reports if specs is None else specs
+        semaphore = asyncio.Semaphore(self.max_parallel)
+        runs = await asyncio.gather(*(self._run_one(s, semaphore) for s in specs))
+        return list(runs)
+
+    def run_forever(self, poll_seconds: float = 20.0) -> None:
+        """Check the schedule every ``poll_seconds`` and run each due report once per minute."""
+        last_tick = None
+        while True:
+            now = dt.datetime.now().replace(second=0, microsecond=0)
+            if now != last_tick:
+                last_tick = now
+                due = self.due(now)
+                if due:
+                    asyncio.run(self.run(due))
+            time.sleep(poll_seconds)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the reports declared in config.toml")
+    parser.add_argument("--config", default=str(CONFIG_PATH), help="Path to config.toml")
+    parser.add_argument("--report", action="append", help="Only run this report (repeatable)")
+    parser.add_argument("--once", action="store_true", help="Run the selected reports now and exit")
+    parser.add_argument("--dry-run", action="store_true", help="Print the execution plan and exit")
+    parser.add_argument("--parallel", type=int, default=MAX_PARALLEL, help="Max reports at once")
+    args = parser.parse_args()
+
+    reports = load_reports(Path(args.config))
+    if args.report:
+        reports = [r for r in reports if r.name in args.report]
+    ledger = None if args.dry_run else RunLedger()
+    scheduler = ReportScheduler(reports, max_parallel=args.parallel, ledger=ledger)
+
+    if args.dry_run:
+        print(scheduler.plan(dt.datetime.now()))
+    elif args.once:
+        for run in asyncio.run(scheduler.run()):
+            timings = ", ".join(f"{k} {v:.2f}s" for k, v in run.timings.items())
+            print(f"{run.name}: {run.status} ({timings}){' – ' + run.error if run.error else ''}")
+    else:
+        scheduler.run_forever()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,24 +1,203 @@
+"""Shared Slack webhook client: pooled connections, 429 handling, block-kit chunking."""
+
+from __future__ import annotations
+
+import logging
 import os
+import random
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
 
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 WEBHOOK = os.getenv("SLACK_WEBHOOK")
-if not WEBHOOK:
-    sys.exit("SLACK_WEBHOOK env var not set")
+TIMEOUT = 10.0
+RETRIES = 5
+POOL_SIZE = 8
+MAX_BLOCK_CHARS = 3000  # Slack limit for a section block's text
+MAX_BLOCKS = 50  # Slack limit for blocks per message
+FALLBACK_CHARS = 300  # notification text shown alongside the blocks
+MAX_RETRY_AFTER = 60.0
+
+
+class SlackError(RuntimeError):
+    pass
+
+
+def _pack(pieces: Iterable[str], sep: str, limit: int) -> List[str]:
+    """Greedily join ``pieces`` with ``sep`` into strings of at most ``limit`` chars."""
+    packed: List[str] = []
+    current = ""
+    for piece in pieces:
+        candidate = f"{current}{sep}{piece}" if current else piece
+        if len(candidate) <= limit:
+            current = candidate
+        else:
+            if current:
+                packed.append(current)
+            current = piece
+    if current:
+        packed.append(current)
+    return packed
+
+
+def _hard_wrap(line: str, limit: int) -> Iterable[str]:
+    while len(line) > limit:
+        cut = line.rfind(" ", 0, limit)
+        cut = cut if cut > 0 else limit
+        yield line[:cut]
+        line = line[cut:].lstrip(" ")
+    yield line
+
+
+def chunk_text(text: str, limit: int = MAX_BLOCK_CHARS) -> List[str]:
+    """Split ``text`` into pieces of at most ``limit`` chars at paragraph, then line, breaks."""
+    paragraphs: List[str] = []
+    for para in text.split("\n\n"):
+        if len(para) <= limit:
+            paragraphs.append(para)
+        else:
+            lines = [piece for line in para.split("\n") for piece in _hard_wrap(line, limit)]
+            paragraphs.extend(_pack(lines, "\n", limit))
+    return [c for c in _pack(paragraphs, "\n\n", limit) if c.strip()]
+
+
+def build_messages(
+    text: str,
+    channel: Optional[str] = None,
+    block_chars: int = MAX_BLOCK_CHARS,
+    max_blocks: int = MAX_BLOCKS,
+) -> List[dict]:
+    """Block-kit payloads for ``text``: section blocks within Slack's size limits."""
+    sections = chunk_text(text, block_chars) or [text]
+    messages = []
+    for start in range(0, len(sections), max_blocks):
+        part = sections[start : start + max_blocks]
+        fallback = (
+            part[0] if len(part[0]) <= FALLBACK_CHARS else part[0][: FALLBACK_CHARS - 1] + "…"
+        )
+        payload = {
+            "text": fallback,
+            "blocks": [{"type": "section", "text": {"type": "mrkdwn", "text": s}} for s in part],
+        }
+        if channel:
+            payload["channel"] = channel
+        messages.append(payload)
+    return messages
+
+
+class SlackClient:
+    """One pooled ``requests.Session`` shared by every report and channel."""
+
+    def __init__(
+        self,
+        webhook: Optional[str] = None,
+        timeout: float = TIMEOUT,
+        retries: int = RETRIES,
+        pool_size: int = POOL_SIZE,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.webhook = webhook
+        self.timeout = timeout
+        self.retries = retries
+        self.pool_size = pool_size
+        self.sleep = sleep
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def close(self) -> None:
+        self.session.close()
+
+    def _retry_delay(self, response: Optional[requests.Response], attempt: int) -> float:
+        if response is not None and response.status_code == 429:
+            try:
+                return min(float(response.headers.get("Retry-After", 1)), MAX_RETRY_AFTER)
+            except ValueError:
+                return 1.0
+        return random.uniform(0, min(30.0, 0.5 * 2 ** (attempt - 1)))
+
+    def post(self, payload: dict, webhook: Optional[str] = None) -> str:
+        """POST one payload, retrying on 429 (after ``Retry-After``), 5xx and connection errors."""
+        url = webhook or self.webhook
+        if not url:
+            raise SlackError("No Slack webhook configured")
+        for attempt in range(1, self.retries + 1):
+            response = None
+            try:
+                response = self.session.post(url, json=payload, timeout=self.timeout)
+                if response.status_code != 429 and response.status_code < 500:
+                    response.raise_for_status()
+                    return response.text
+                error = f"HTTP {response.status_code}"
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = str(e)
+            if attempt == self.retries:
+                raise SlackError(f"Slack delivery failed after {attempt} attempts: {error}")
+            delay = self._retry_delay(response, attempt)
+            logger.warning(f"Slack attempt {attempt} failed ({error}), retrying in {delay:.1f}s")
+            self.sleep(delay)
+        raise SlackError("Slack delivery failed")
+
+    def send(self, text: str, channel: Optional[str] = None, webhook: Optional[str] = None) -> str:
+        """Deliver ``text`` as one or more block-kit messages, in order.
+
+        Returns Slack's response body for the last message (``"ok"``), as the
+        original ``send`` did.
+        """
+        body = ""
+        for payload in build_messages(text, channel):
+            body = self.post(payload, webhook)
+        return body
+
+    def fan_out(
+        self, text: str, channels: Iterable[str], webhook: Optional[str] = None
+    ) -> Dict[str, Optional[str]]:
+        """Send ``text`` to every channel concurrently; map channel to error (None if delivered)."""
+        channels = list(channels)
+        results: Dict[str, Optional[str]] = {}
+        with ThreadPoolExecutor(max_workers=min(self.pool_size, max(len(channels), 1))) as pool:
+            futures = {c: pool.submit(self.send, text, c, webhook) for c in channels}
+            for channel, future in futures.items():
+                try:
+                    future.result()
+                    results[channel] = None
+                except Exception as e:
+                    logger.error(f"Slack delivery to {channel} failed: {e}")
+                    results[channel] = str(e)
+        return results
+
+
+_client: Optional[SlackClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> SlackClient:
+    """Process-wide client, so all reports share one connection pool."""
+    global _client
+    if _client is None:
+        with _client_lock:  # concurrent first calls must not each build a Session
+            if _client is None:
+                _client = SlackClient(WEBHOOK)
+    return _client
+
 
-def send(text: str, channel: str | None = None):
-    payload = {"text": text}
-    if channel:
-        payload["channel"] = channel
+def send(text: str, channel: str | None = None) -> str:
+    return get_client().send(text, channel)
 
-    r = requests.post(WEBHOOK, json=payload, timeout=10)
-    r.raise_for_status()
-    return r.text
 
 if __name__ == "__main__":
+    if not WEBHOOK:
+        sys.exit("SLACK_WEBHOOK env var not set")
     msg = "Auto-reporter test – everything works!"
-    print(send(msg))
\ No newline at end of file
+    print(send(msg))
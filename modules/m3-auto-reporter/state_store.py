@@ -0,0 +1,207 @@
+"""Local SQLite store of per-day, per-event aggregates with an ingestion watermark."""
+
+from __future__ import annotations
+
+import datetime as dt
+import logging
+import os
+import sqlite3
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import pandas as pd
+from ingest import CHUNK_ROWS, iter_csv_from
+
+logger = logging.getLogger(__name__)
+
+TREND_WINDOWS = (7, 28)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS daily_events (
+    day        TEXT    NOT NULL,
+    event_name TEXT    NOT NULL,
+    events     INTEGER NOT NULL,
+    PRIMARY KEY (day, event_name)
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    source     TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS boundary_events (
+    source TEXT    NOT NULL,
+    key    INTEGER NOT NULL,
+    PRIMARY KEY (source, key)
+);
+CREATE TABLE IF NOT EXISTS read_offsets (
+    source TEXT PRIMARY KEY,
+    inode  INTEGER NOT NULL,
+    offset INTEGER NOT NULL
+);
+"""
+
+
+def event_keys(chunk: pd.DataFrame, created: pd.Series) -> pd.Series:
+    """A 64-bit key per row (user, event, timestamp), stable across CSV and BigQuery dtypes."""
+    users = chunk["user_id"].astype(str) if "user_id" in chunk else pd.Series("", index=chunk.index)
+    frame = pd.DataFrame(
+        {"user_id": users, "event_name": chunk["event_name"].astype(str), "created_at": created}
+    )
+    hashed = pd.util.hash_pandas_object(frame, index=False).to_numpy()
+    return pd.Series(hashed.view(np.int64), index=chunk.index)
+
+
+class AggregateStore:
+    """Incrementally maintained daily aggregates.
+
+    ``ingest`` counts rows created at or after the source's watermark, in any
+    order within the run. Rows exactly at the watermark are skipped when their
+    key was already counted (the keys at the watermark are stored with it), so
+    ties across runs and BigQuery page boundaries are neither lost nor double
+    counted. Counts, the new watermark and its keys are committed in one
+    transaction at the end of the run, so an interrupted run can simply be
+    repeated. Events that show up in a later run with a timestamp older than
+    the watermark are not counted.
+    """
+
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def watermark(self, source: str = "events") -> Optional[pd.Timestamp]:
+        row = self.conn.execute(
+            "SELECT created_at FROM watermarks WHERE source = ?", (source,)
+        ).fetchone()
+        return pd.Timestamp(row[0]) if row else None
+
+    def _boundary(self, source: str) -> Set[int]:
+        rows = self.conn.execute("SELECT key FROM boundary_events WHERE source = ?", (source,))
+        return {key for (key,) in rows}
+
+    def offset(self, source: str = "events") -> Optional[Tuple[int, int]]:
+        """(inode, byte offset) up to which the source file has been read."""
+        return self.conn.execute(
+            "SELECT inode, offset FROM read_offsets WHERE source = ?", (source,)
+        ).fetchone()
+
+    def ingest(
+        self,
+        chunks: Iterable[pd.DataFrame],
+        source: str = "events",
+        offset: Optional[Tuple[int, int]] = None,
+    ) -> int:
+        """Fold new events into the store; return how many rows were counted.
+
+        ``offset`` – (inode, bytes) read from the source file – is saved in the
+        same transaction, so the next run resumes right after this one.
+        """
+        start = self.watermark(source)
+        seen = self._boundary(source) if start is not None else set()
+        mark, boundary = start, set(seen)
+        totals: Counter = Counter()
+        counted = 0
+        for chunk in chunks:
+            created = pd.to_datetime(chunk["created_at"], errors="coerce")
+            if start is None:
+                fresh = created.notna()
+            else:
+                fresh = created > start
+                tied = created == start
+                if tied.any():
+                    fresh |= tied & ~event_keys(chunk, created).isin(seen)
+            if not fresh.any():
+                continue
+            created = created[fresh]
+            days = created.dt.strftime("%Y-%m-%d")
+            totals.update(
+                pd.DataFrame(
+                    {"day": days, "event_name": chunk.loc[fresh, "event_name"].astype(str)}
+                )
+                .value_counts()
+                .to_dict()
+            )
+            counted += int(fresh.sum())
+            # Track the newest timestamp and the keys of the rows at it.
+            latest = created.max()
+            if mark is None or latest >= mark:
+                at_latest = created == latest
+                keys = set(event_keys(chunk.loc[fresh][at_latest], created[at_latest]).tolist())
+                boundary = keys if mark is None or latest > mark else boundary | keys
+                mark = latest
+        with self.conn:
+            self.conn.executemany(
+                """
+                INSERT INTO daily_events (day, event_name, events) VALUES (?, ?, ?)
+                ON CONFLICT (day, event_name) DO UPDATE SET events = events + excluded.events
+                """,
+                ((day, name, events) for (day, name), events in totals.items()),
+            )
+            if mark is not None and (mark != start or boundary != seen):
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO watermarks (source, created_at) VALUES (?, ?)",
+                    (source, mark.isoformat()),
+                )
+                self.conn.execute("DELETE FROM boundary_events WHERE source = ?", (source,))
+                self.conn.executemany(
+                    "INSERT INTO boundary_events (source, key) VALUES (?, ?)",
+                    ((source, key) for key in boundary),
+                )
+            if offset is not None:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO read_offsets (source, inode, offset) VALUES (?, ?, ?)",
+                    (source, *offset),
+                )
+        logger.info(f"State store: counted {counted} new events (watermark {mark})")
+        return counted
+
+    def ingest_csv(
+        self, path: Path | str, source: str = "events", chunk_rows: int = CHUNK_ROWS
+    ) -> int:
+        """Ingest only the bytes appended to ``path`` since the last run.
+
+        A file that was replaced (new inode) or truncated is read from the start;
+        the watermark still keeps already counted rows out.
+        """
+        inode = os.stat(path).st_ino
+        saved = self.offset(source)
+        start = saved[1] if saved and saved[0] == inode else 0
+        chunks, end = iter_csv_from(path, start, chunk_rows)
+        return self.ingest(chunks, source, offset=(inode, end))
+
+    def day_counts(self, day: dt.date) -> pd.DataFrame:
+        return pd.read_sql_query(
+            "SELECT event_name, events FROM daily_events WHERE day = ? ORDER BY events DESC",
+            self.conn,
+            params=(day.isoformat(),),
+        )
+
+    def trends(self, day: dt.date, windows: Sequence[int] = TREND_WINDOWS) -> pd.DataFrame:
+        """Compare ``day`` with the mean of the preceding N days (missing days count as 0)."""
+        longest = max(windows)
+        start = day - dt.timedelta(days=longest)
+        history = pd.read_sql_query(
+            "SELECT day, event_name, events FROM daily_events WHERE day >= ? AND day <= ?",
+            self.conn,
+            params=(start.isoformat(), day.isoformat()),
+        )
+        result = pd.DataFrame({"event_name": sorted(history["event_name"].unique())})
+        if result.empty:
+            return result.assign(today=pd.Series(dtype="int64"))
+        pivot = history.pivot_table(
+            index="event_name", columns="day", values="events", aggfunc="sum", fill_value=0
+        )
+        today = pivot.get(day.isoformat(), pd.Series(0, index=pivot.index))
+        result["today"] = result["event_name"].map(today).fillna(0).astype(int)
+        for window in windows:
+            days = [(day - dt.timedelta(days=i)).isoformat() for i in range(1, window + 1)]
+            baseline = pivot.reindex(columns=days, fill_value=0).mean(axis=1)
+            avg = result["event_name"].map(baseline).fillna(0.0)
+            result[f"avg_{window}d"] = avg.round(1)
+            result[f"pct_vs_{window}d"] = ((result["today"] - avg) / avg.where(avg > 0)).round(3)
+        return result.sort_values("today", ascending=False).reset_index(drop=True)
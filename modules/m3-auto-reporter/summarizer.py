@@ -0,0 +1,207 @@
+"""LLM summary engine: lazy Vertex AI model, on-disk cache, retries and usage stats."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from templates import approx_tokens
+
+logger = logging.getLogger(__name__)
+
+PRIMARY_MODEL = os.getenv("SUMMARY_MODEL", "gemini-2.5-pro")
+SMALL_MODEL = os.getenv("SUMMARY_SMALL_MODEL", "gemini-2.5-flash")
+SMALL_PROMPT_TOKENS = int(os.getenv("SUMMARY_SMALL_PROMPT_TOKENS", "2000"))
+CACHE_DIR = os.getenv("SUMMARY_CACHE_DIR", ".summary_cache")
+TIMEOUT = float(os.getenv("SUMMARY_TIMEOUT", "120"))
+WORKERS = int(os.getenv("SUMMARY_WORKERS", "4"))
+RETRIES = 3
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+
+
+@dataclass
+class SummaryStats:
+    model: str
+    cached: bool = False
+    attempts: int = 0
+    latency: float = 0.0
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+@dataclass
+class Summary:
+    text: str
+    stats: Optional[SummaryStats]
+
+
+def _usage(response) -> tuple[int, int]:
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return 0, 0
+    return (
+        int(getattr(usage, "prompt_token_count", 0) or 0),
+        int(getattr(usage, "candidates_token_count", 0) or 0),
+    )
+
+
+def call_with_timeout(executor: ThreadPoolExecutor, fn: Callable[[], Any], timeout: float) -> Any:
+    """Run ``fn`` on ``executor`` and wait at most ``timeout`` seconds.
+
+    A call still queued at the deadline is cancelled; one already running keeps
+    its worker until the client gives up, so hung calls never hold more than
+    the pool's threads.
+    """
+    future = executor.submit(fn)
+    try:
+        return future.result(timeout)
+    except FutureTimeout:
+        future.cancel()
+        raise TimeoutError(f"LLM call exceeded {timeout:.0f}s") from None
+
+
+class SummaryEngine:
+    """Generates summaries with Gemini; nothing touches Vertex AI until the first miss.
+
+    Successful summaries are cached on disk keyed by a hash of model and prompt,
+    so re-running a report for the same day costs nothing. Prompts under
+    ``small_prompt_tokens`` go to the cheaper ``small_model``. Calls run on a
+    pool of ``workers`` threads; stats come back with each ``Summary``.
+    """
+
+    def __init__(
+        self,
+        project: Optional[str] = None,
+        location: str = "us-central1",
+        cache_dir: Optional[Path | str] = CACHE_DIR,
+        model: str = PRIMARY_MODEL,
+        small_model: str = SMALL_MODEL,
+        small_prompt_tokens: int = SMALL_PROMPT_TOKENS,
+        timeout: float = TIMEOUT,
+        retries: int = RETRIES,
+        model_factory: Optional[Callable[[str], Any]] = None,
+        sleep: Callable[[float], None] = time.sleep,
+        workers: int = WORKERS,
+    ):
+        self.project = project
+        self.location = location
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.model = model
+        self.small_model = small_model
+        self.small_prompt_tokens = small_prompt_tokens
+        self.timeout = timeout
+        self.retries = retries
+        self.model_factory = model_factory or self._vertex_model
+        self.sleep = sleep
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-call")
+        self._models: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._initialised = False
+
+    def _vertex_model(self, name: str):
+        import vertexai
+        from vertexai.generative_models import GenerativeModel
+
+        if not self._initialised:
+            vertexai.init(project=self.project, location=self.location)
+            self._initialised = True
+        return GenerativeModel(name)
+
+    def get_model(self, name: str):
+        with self._lock:
+            if name not in self._models:
+                logger.info(f"Initialising model {name}")
+                self._models[name] = self.model_factory(name)
+            return self._models[name]
+
+    def choose_model(self, prompt: str) -> str:
+        return self.small_model if approx_tokens(prompt) <= self.small_prompt_tokens else self.model
+
+    def _cache_path(self, model: str, prompt: str) -> Optional[Path]:
+        if self.cache_dir is None:
+            return None
+        key = hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).hexdigest()
+        return self.cache_dir / f"{key}.json"
+
+    def _read_cache(self, path: Optional[Path]) -> Optional[dict]:
+        if path is None or not path.exists():
+            return None
+        try:
+            return json.loads(path.read_text())
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable summary cache entry {path.name}: {e}")
+            return None
+
+    def _write_cache(self, path: Optional[Path], entry: dict) -> None:
+        if path is None:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(entry))
+        tmp.replace(path)
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff before retry number ``attempt`` (1-based)."""
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)))
+
+    def summarize(self, prompt: str) -> Summary:
+        """Return the cached summary or generate one; raises after the last failed attempt."""
+        name = self.choose_model(prompt)
+        stats = SummaryStats(model=name)
+        started = time.perf_counter()
+        path = self._cache_path(name, prompt)
+        cached = self._read_cache(path)
+        if cached is not None:
+            stats.cached = True
+            stats.prompt_tokens = cached.get("prompt_tokens", 0)
+            stats.output_tokens = cached.get("output_tokens", 0)
+            stats.latency = time.perf_counter() - started
+            logger.info(f"Summary cache hit ({name})")
+            return Summary(cached["text"], stats)
+
+        model = self.get_model(name)
+        for attempt in range(1, self.retries + 1):
+            stats.attempts = attempt
+            try:
+                response = call_with_timeout(
+                    self._executor, lambda: model.start_chat().send_message(prompt), self.timeout
+                )
+                text = response.text.strip()
+                break
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff(attempt)
+                logger.warning(f"LLM attempt {attempt} failed ({e}), retrying in {delay:.1f}s")
+                self.sleep(delay)
+
+        stats.prompt_tokens, stats.output_tokens = _usage(response)
+        stats.latency = time.perf_counter() - started
+        self._write_cache(
+            path,
+            {
+                "model": name,
+                "text": text,
+                "prompt_tokens": stats.prompt_tokens,
+                "output_tokens": stats.output_tokens,
+            },
+        )
+        logger.info(
+            f"Summary from {name} in {stats.latency:.2f}s "
+            f"({stats.prompt_tokens} prompt / {stats.output_tokens} output tokens)"
+        )
+        return Summary(text, stats)
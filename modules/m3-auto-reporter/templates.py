@@ -0,0 +1,93 @@
+"""Compiled, cached Jinja prompt templates for the auto-reporter."""
+
+from __future__ import annotations
+
+import logging
+import os
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+import pandas as pd
+from jinja2 import Environment, FileSystemLoader, StrictUndefined
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_ROOT = Path(__file__).parent
+DEFAULT_TEMPLATE = "prompts/daily_summary.jinja"
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "8000"))
+TABLE_MAX_ROWS = 20
+TRUNCATION_NOTE = "\n…(truncated to fit the prompt token budget)\n"
+
+
+def approx_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token)."""
+    return (len(text) + 3) // 4
+
+
+def _cell(value: Any) -> str:
+    return str(value).replace("|", "\\|").replace("\n", " ")
+
+
+def markdown_rows(df: pd.DataFrame, max_rows: int | None = TABLE_MAX_ROWS) -> Iterator[str]:
+    """Yield a markdown table line by line instead of building it in one string."""
+    columns = [str(c) for c in df.columns]
+    yield "| " + " | ".join(_cell(c) for c in columns) + " |"
+    yield "|" + "|".join("---" for _ in columns) + "|"
+    rows = df if max_rows is None else df.head(max_rows)
+    for row in rows.itertuples(index=False, name=None):
+        yield "| " + " | ".join(_cell(v) for v in row) + " |"
+
+
+def table_lines(table: Any, max_rows: int | None = TABLE_MAX_ROWS) -> Iterable[str]:
+    """Normalise a DataFrame, pre-rendered markdown or an iterable of lines."""
+    if isinstance(table, pd.DataFrame):
+        return markdown_rows(table, max_rows)
+    if isinstance(table, str):
+        return table.splitlines()
+    return table
+
+
+class PromptTemplates:
+    """Jinja environment rooted at the module directory.
+
+    Jinja compiles each template once and keeps it in its cache; with
+    ``auto_reload`` it re-checks the source file's mtime on lookup and only
+    recompiles when the file changed.
+    """
+
+    def __init__(self, root: Path = TEMPLATE_ROOT):
+        self.env = Environment(
+            loader=FileSystemLoader(str(root)),
+            auto_reload=True,
+            trim_blocks=True,
+            lstrip_blocks=True,
+            keep_trailing_newline=True,
+            undefined=StrictUndefined,
+        )
+
+    def render(
+        self,
+        template: str = DEFAULT_TEMPLATE,
+        max_tokens: int = PROMPT_MAX_TOKENS,
+        table: Any = (),
+        **context: Any,
+    ) -> str:
+        """Render ``template`` as a stream, stopping once ``max_tokens`` is reached.
+
+        ``table`` is exposed to the template as an iterable of markdown lines, so
+        rows past the budget are never formatted.
+        """
+        parts = []
+        used = 0
+        stream = self.env.get_template(template).generate(table=table_lines(table), **context)
+        for chunk in stream:
+            cost = approx_tokens(chunk)
+            if used + cost > max_tokens:
+                remaining = max(max_tokens - used, 0) * 4
+                parts.append(chunk[:remaining])
+                parts.append(TRUNCATION_NOTE)
+                logger.warning(f"Prompt from {template} truncated at ~{max_tokens} tokens")
+                break
+            parts.append(chunk)
+            used += cost
+        return "".join(parts)
@@ -1,11 +1,15 @@
 from __future__ import annotations
 
 import argparse
+import hashlib
+import json
 import os
 import sys
-import textwrap
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Tuple
+from typing import Any, Iterator
 
 from dotenv import load_dotenv
 from langchain.chains import ConversationalRetrievalChain
@@ -15,11 +19,36 @@ from langchain_community.vectorstores import Chroma
 from langchain_community.vectorstores import Pinecone as PineconeVectorStore
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "m1-rag-faq"))
+from chat_history import BoundedChatHistory  # noqa: E402
+from rag_chain import (  # noqa: E402
+    REWRITE_STATS,
+    answer_questions_file,
+    invoke_chain,
+    print_streamed_answer,
+)
+
 load_dotenv()
 
 STORE_NAME = "faq-embeddings"
 CHROMA_DIR = "chroma_faq"
 
+# Pinecone upsert limits: 2 MB per request, 1000 vectors per request.
+MAX_REQUEST_BYTES = 2_000_000
+MAX_BATCH_VECTORS = 1_000
+UPSERT_WORKERS = int(os.getenv("PINECONE_UPSERT_WORKERS", "4"))
+UPSERT_RETRIES = 3
+CHECKPOINT_DIR = Path(".pinecone_checkpoints")
+
+# Blue/green slots; the live one is recorded in a pointer record in POINTER_NAMESPACE.
+NAMESPACES = ("blue", "green")
+POINTER_NAMESPACE = "__active__"
+POINTER_ID = "active-namespace"
+
+
+class UpsertError(RuntimeError):
+    """Raised when some upsert batches still fail after retries."""
+
 
 def load_documents(src: Path) -> list[Document]:
     """Split markdown file into 400-char chunks."""
@@ -29,6 +58,153 @@ def load_documents(src: Path) -> list[Document]:
     return [Document(page_content=c, metadata={"src": str(src)}) for c in chunks]
 
 
+def doc_id(doc: Document) -> str:
+    """Deterministic vector ID, so re-ingesting the same chunk overwrites it."""
+    key = f"{doc.metadata.get('src', '')}\0{doc.page_content}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def _estimate_bytes(doc: Document, dimension: int) -> int:
+    # JSON floats are ~20 chars each; metadata carries the chunk text.
+    return dimension * 20 + len(json.dumps(doc.metadata)) + len(doc.page_content) * 2 + 128
+
+
+def plan_batches(
+    docs: list[Document],
+    dimension: int,
+    max_bytes: int = MAX_REQUEST_BYTES,
+    max_count: int = MAX_BATCH_VECTORS,
+) -> Iterator[list[Document]]:
+    """Greedily pack docs into upsert batches under the request size/count limits."""
+    batch: list[Document] = []
+    size = 0
+    for doc in docs:
+        doc_bytes = _estimate_bytes(doc, dimension)
+        if batch and (size + doc_bytes > max_bytes or len(batch) >= max_count):
+            yield batch
+            batch, size = [], 0
+        batch.append(doc)
+        size += doc_bytes
+    if batch:
+        yield batch
+
+
+def upsert_documents(
+    index: Any,
+    docs: list[Document],
+    embeddings: Any,
+    dimension: int,
+    namespace: str,
+    checkpoint: Path | None = None,
+    max_workers: int = UPSERT_WORKERS,
+) -> int:
+    """Embed and upsert ``docs`` in parallel batches; return the number of vectors written.
+
+    IDs already listed in ``checkpoint`` are skipped, and every successful batch
+    is appended to it, so a failed run can be resumed by calling this again.
+    """
+    done: set[str] = set()
+    if checkpoint and checkpoint.exists():
+        done = set(checkpoint.read_text(encoding="utf-8").split())
+    unique = {doc_id(d): d for d in docs}
+    todo = [d for vid, d in unique.items() if vid not in done]
+    lock = threading.Lock()
+
+    def upsert(batch: list[Document]) -> int:
+        ids = [doc_id(d) for d in batch]
+        values = embeddings.embed_documents([d.page_content for d in batch])
+        vectors = [
+            {"id": vid, "values": vec, "metadata": {**d.metadata, "text": d.page_content}}
+            for vid, d, vec in zip(ids, batch, values)
+        ]
+        for attempt in range(UPSERT_RETRIES):
+            try:
+                index.upsert(vectors=vectors, namespace=namespace)
+                break
+            except Exception:
+                if attempt == UPSERT_RETRIES - 1:
+                    raise
+                time.sleep(2**attempt)
+        if checkpoint:
+            with lock, open(checkpoint, "a", encoding="utf-8") as f:
+                f.write("".join(f"{vid}\n" for vid in ids))
+        return len(batch)
+
+    batches = list(plan_batches(todo, dimension))
+    written, failed = 0, 0
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for future in as_completed(pool.submit(upsert, b) for b in batches):
+            try:
+                written += future.result()
+            except Exception as e:
+                failed += 1
+                print(f"[!] Upsert batch failed: {e}")
+    if failed:
+        raise UpsertError(f"{failed}/{len(batches)} upsert batches failed – rerun to resume")
+    return written
+
+
+def get_active_namespace(index: Any) -> str | None:
+    """Return the live blue/green namespace recorded in the index.
+
+    ``PINECONE_NAMESPACE`` only bootstraps an index that has no pointer yet;
+    once a rebuild has flipped the pointer, readers follow it.
+    """
+    record = index.fetch(ids=[POINTER_ID], namespace=POINTER_NAMESPACE).vectors.get(POINTER_ID)
+    if record:
+        return record.metadata["namespace"]
+    return os.getenv("PINECONE_NAMESPACE") or None
+
+
+def corpus_digest(docs: list[Document]) -> str:
+    """Hash of the document set, so a checkpoint is only resumed for the same corpus."""
+    ids = sorted({doc_id(d) for d in docs})
+    return hashlib.sha256("\n".join(ids).encode("utf-8")).hexdigest()[:16]
+
+
+def namespace_size(index: Any, namespace: str) -> int:
+    """Vectors currently stored in ``namespace`` (0 when it does not exist)."""
+    summary = index.describe_index_stats().namespaces.get(namespace)
+    return summary.vector_count if summary else 0
+
+
+def set_active_namespace(index: Any, namespace: str, dimension: int) -> None:
+    """Atomically point readers at ``namespace`` (a single-record upsert)."""
+    values = [1.0] + [0.0] * (dimension - 1)
+    index.upsert(
+        vectors=[{"id": POINTER_ID, "values": values, "metadata": {"namespace": namespace}}],
+        namespace=POINTER_NAMESPACE,
+    )
+
+
+def bulk_load(index: Any, docs: list[Document], embeddings: Any, dimension: int) -> str:
+    """Load ``docs`` into the idle blue/green namespace, then switch readers to it.
+
+    The live namespace is untouched until the load completes. If a previous
+    load of the same documents into the idle namespace was interrupted, its
+    checkpoint is reused instead of starting over; a partial load of a
+    different corpus is discarded.
+    """
+    active = get_active_namespace(index)
+    target = NAMESPACES[1] if active == NAMESPACES[0] else NAMESPACES[0]
+    CHECKPOINT_DIR.mkdir(exist_ok=True)
+    checkpoint = CHECKPOINT_DIR / f"{STORE_NAME}-{target}-{corpus_digest(docs)}.ids"
+    if not checkpoint.exists():
+        for stale in CHECKPOINT_DIR.glob(f"{STORE_NAME}-{target}-*.ids"):
+            stale.unlink()
+        # Deleting a namespace that does not exist is an error, so check first;
+        # any other failure must stop the load before the pointer can move.
+        if namespace_size(index, target):
+            index.delete(delete_all=True, namespace=target)
+        checkpoint.touch()
+
+    written = upsert_documents(index, docs, embeddings, dimension, target, checkpoint)
+    set_active_namespace(index, target, dimension)
+    checkpoint.unlink()
+    print(f"[+] Upserted {written} vectors into '{target}' (was '{active}')")
+    return target
+
+
 def build_pinecone_store(docs: list[Document]):
     """Return PineconeVectorStore if creds exist, else None."""
     api_key = os.getenv("PINECONE_API_KEY")
@@ -45,19 +221,23 @@ def build_pinecone_store(docs: list[Document]):
     region = os.getenv("PINECONE_REGION", "us-east-1")
     cloud = os.getenv("PINECONE_CLOUD", "aws")
 
+    embeddings = OpenAIEmbeddings()
+    dimension = len(embeddings.embed_query("x"))
     if STORE_NAME not in pc.list_indexes().names():
         pc.create_index(
             name=STORE_NAME,
-            dimension=len(OpenAIEmbeddings().embed_query("x")),
+            dimension=dimension,
             metric="cosine",
             spec=ServerlessSpec(cloud=cloud, region=region),
         )
     index = pc.Index(STORE_NAME)
 
-    vs = PineconeVectorStore(index, OpenAIEmbeddings(), "text")
     if docs:
-        vs.add_documents(docs)
-    return vs, f"Pinecone v3 ({STORE_NAME})"
+        namespace = bulk_load(index, docs, embeddings, dimension)
+    else:
+        namespace = get_active_namespace(index)
+    vs = PineconeVectorStore(index, embeddings, "text", namespace=namespace)
+    return vs, f"Pinecone v3 ({STORE_NAME}/{namespace or 'default'})"
 
 
 def build_chroma_store(docs: list[Document]):
@@ -74,6 +254,9 @@ def main() -> None:
     p.add_argument("--source", default="m1-rag-faq/data/faq.md", help="Markdown file to ingest")
     p.add_argument("--rebuild", action="store_true", help="Re-embed & overwrite store")
     p.add_argument("--query", help="One-off question")
+    p.add_argument("--questions-file", help="Answer every line as JSON lines and quit")
+    p.add_argument("--output", help="Write --questions-file answers here instead of stdout")
+    p.add_argument("--concurrency", type=int, default=8, help="Max concurrent LLM calls")
     args = p.parse_args()
 
     src_path = Path(args.source).expanduser()
@@ -88,28 +271,37 @@ def main() -> None:
 
     print(f"✓ Vector store ready – {backend}")
 
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
     llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
-    chain = ConversationalRetrievalChain.from_llm(llm, retriever)
-
-    history: List[Tuple[str, str]] = []
+    if args.questions_file:
+        output = Path(args.output) if args.output else None
+        answer_questions_file(
+            Path(args.questions_file),
+            vectorstore,
+            llm,
+            output,
+            k=3,
+            max_concurrency=args.concurrency,
+        )
+        return
 
-    def ask(q: str) -> str:
-        resp = chain.invoke({"question": q, "chat_history": history})
-        history.append((q, resp["answer"]))
-        return resp["answer"]
+    retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
+    chain = ConversationalRetrievalChain.from_llm(llm, retriever)
 
     if args.query:
-        print(ask(args.query))
+        print(invoke_chain(chain, args.query)["answer"])
         return
+
+    history = BoundedChatHistory(llm)
     try:
         while True:
             q = input("\nYou: ")
             if q.lower() in {"exit", "quit", "q"}:
                 break
-            print("Bot:", textwrap.fill(ask(q), width=88))
+            history.append(q, print_streamed_answer(q, history.for_question(q), retriever, llm))
     except (EOFError, KeyboardInterrupt):
         pass
+    history.close()
+    print(f"\n[i] Question rewrites skipped: {REWRITE_STATS.skipped}/{REWRITE_STATS.total}")
 
 
 if __name__ == "__main__":
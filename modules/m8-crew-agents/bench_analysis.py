@@ -0,0 +1,100 @@
+"""Benchmark DataAnalystAgent's metric analysis.
+
+    python bench_analysis.py --points 10000 1000000 10000000
+    python bench_analysis.py --points 1000000 --max-seconds 2   # CI budget check
+
+Each point is one sample of two metrics (cpu, memory). ``columnar`` times
+``analyze_metrics`` on NumPy arrays; ``rows`` adds the conversion from the
+``[{"cpu": .., "memory": ..}, ...]`` payload agents receive; ``python`` is the
+same statistics with the ``statistics`` module, for reference. The last two
+are skipped above ``--rows-max`` points (a list of 10M dicts needs GBs of RAM).
+
+With ``--max-seconds`` the script exits non-zero when the columnar analysis
+takes longer than that at any size. Timing lives here rather than in the unit
+tests, which only check the statistics.
+"""
+
+from __future__ import annotations
+
+import argparse
+import statistics
+import sys
+import time
+from typing import Callable, Dict, Optional
+
+import numpy as np
+from metric_analysis import analyze_metrics
+
+
+def synthetic_metrics(points: int, seed: int = 0) -> Dict[str, np.ndarray]:
+    """CPU with a slow upward drift and a few spikes; memory following CPU."""
+    rng = np.random.default_rng(seed)
+    cpu = 50 + 10 * np.arange(points) / points + rng.normal(0, 3, points)
+    cpu[rng.integers(0, points, max(points // 10_000, 1))] = 99.0
+    memory = 0.8 * cpu + rng.normal(0, 1, points)
+    return {"cpu": cpu, "memory": memory}
+
+
+def python_analysis(rows: list) -> None:
+    for name in ("cpu", "memory"):
+        values = [row[name] for row in rows]
+        statistics.fmean(values)
+        statistics.pstdev(values)
+        statistics.quantiles(values, n=100)
+        statistics.linear_regression(range(len(values)), values)
+    statistics.correlation([row["cpu"] for row in rows], [row["memory"] for row in rows])
+
+
+def best_of(fn: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def bench(points: int, repeat: int, rows_max: int) -> Dict[str, Optional[float]]:
+    columns = synthetic_metrics(points)
+    results: Dict[str, Optional[float]] = {"points": points, "rows": None, "python": None}
+    results["columnar"] = best_of(lambda: analyze_metrics(columns), repeat)
+    results["confidence"] = analyze_metrics(columns).confidence
+    if points <= rows_max:
+        rows = [
+            {"cpu": c, "memory": m}
+            for c, m in zip(columns["cpu"].tolist(), columns["memory"].tolist())
+        ]
+        results["rows"] = best_of(lambda: analyze_metrics(rows), repeat)
+        results["python"] = best_of(lambda: python_analysis(rows), 1)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Time analyze_metrics")
+    parser.add_argument("--points", type=int, nargs="+", default=[10_000, 1_000_000, 10_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--rows-max", type=int, default=1_000_000)
+    parser.add_argument("--max-seconds", type=float, help="Fail if the columnar analysis is slower")
+    args = parser.parse_args()
+
+    def fmt(seconds: Optional[float]) -> str:
+        return f"{seconds:>12.3f}" if seconds is not None else f"{'-':>12}"
+
+    print(
+        f"{'points':>12} {'columnar (s)':>12} {'rows (s)':>12} {'python (s)':>12} {'confidence':>11}"
+    )
+    over_budget = []
+    for points in args.points:
+        r = bench(points, args.repeat, args.rows_max)
+        print(
+            f"{r['points']:>12,} {fmt(r['columnar'])} {fmt(r['rows'])} {fmt(r['python'])} "
+            f"{r['confidence']:>11.2f}"
+        )
+        if args.max_seconds is not None and r["columnar"] > args.max_seconds:
+            over_budget.append(f"{points:,}")
+    if over_budget:
+        sys.exit(f"Over the {args.max_seconds:g} s budget at {', '.join(over_budget)} points")
+
+
+if __name__ == "__main__":
+    main()
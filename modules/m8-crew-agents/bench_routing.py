@@ -0,0 +1,119 @@
+"""Routing accuracy on the labelled benchmark set, and routing latency.
+
+    python bench_routing.py --agents 3 24 48
+    python bench_routing.py --agents 48 --max-p50-us 1000   # CI budget check
+
+With ``--max-p50-us`` the script exits non-zero when the median route takes
+longer than that at any agent count. Timing lives here rather than in the
+unit tests, which only check where queries are routed.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import numpy as np
+from agent_router import AgentProfile, AgentRouter
+from crew_agents import AgentMemory, CrewOrchestrator
+
+BENCHMARK = Path(__file__).with_name("routing_benchmark.jsonl")
+
+
+def load_benchmark(path: Path = BENCHMARK) -> List[Dict[str, str]]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def substring_route(query: str) -> str:
+    """The substring checks ``interactive_session`` used before the router."""
+    q = query.lower()
+    if "analyze" in q or "data" in q:
+        return "Data Analyst"
+    if "report" in q or "generate" in q:
+        return "Report Generator"
+    if "problem" in q or "issue" in q:
+        return "Root Cause Analyzer"
+    return "Data Analyst"
+
+
+def accuracy(route: Callable[[str], str], rows: List[Dict[str, str]]) -> float:
+    return sum(route(row["query"]) == row["agent"] for row in rows) / len(rows)
+
+
+def synthetic_profiles(n: int, seed: int = 0) -> List[AgentProfile]:
+    """Filler agents with their own vocabulary, to time routing over many agents."""
+    rng = np.random.default_rng(seed)
+    vocabulary = [f"topic{i}" for i in range(2000)]
+    return [
+        AgentProfile(
+            name=f"Agent {i}",
+            description=" ".join(rng.choice(vocabulary, 20)),
+            keywords=tuple(rng.choice(vocabulary, 5)),
+            examples=tuple(" ".join(rng.choice(vocabulary, 8)) for _ in range(5)),
+        )
+        for i in range(n)
+    ]
+
+
+def latency(router: AgentRouter, queries: List[str], repeat: int = 20) -> Dict[str, float]:
+    """Per-route microseconds with the keyword fast path off (the slow path)."""
+    timings = []
+    for _ in range(repeat):
+        for query in queries:
+            started = time.perf_counter()
+            router.route(query, use_keywords=False)
+            timings.append(time.perf_counter() - started)
+    timings = np.array(timings) * 1e6
+    return {"p50": float(np.percentile(timings, 50)), "p99": float(np.percentile(timings, 99))}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark AgentRouter")
+    parser.add_argument("--agents", type=int, nargs="+", default=[3, 24, 48])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--max-p50-us", type=float, help="Fail if the median route is slower")
+    args = parser.parse_args()
+
+    rows = load_benchmark()
+    with tempfile.TemporaryDirectory() as tmp:
+        crew = CrewOrchestrator(AgentMemory(Path(tmp) / "bench_memory.json"))
+        router = crew.router
+        print(f"Accuracy on {len(rows)} labelled queries")
+        print(f"  {'substring (legacy)':<22} {accuracy(substring_route, rows):.1%}")
+        print(
+            f"  {'keywords only':<22} "
+            f"{accuracy(lambda q: (router.keyword_matches(q) or [router.default])[0], rows):.1%}"
+        )
+        print(
+            f"  {'similarity only':<22} "
+            f"{accuracy(lambda q: router.route(q, use_keywords=False).agent, rows):.1%}"
+        )
+        print(f"  {'router':<22} {accuracy(lambda q: router.route(q).agent, rows):.1%}")
+
+        queries = [row["query"] for row in rows]
+        print(f"\n{'agents':>7} {'p50 (us)':>9} {'p99 (us)':>9}")
+        over_budget = []
+        for n in args.agents:
+            scaled = AgentRouter(
+                router.profiles + synthetic_profiles(max(0, n - len(router.profiles))),
+                default=router.default,
+            )
+            r = latency(scaled, queries, args.repeat)
+            print(f"{len(scaled.names):>7} {r['p50']:>9.1f} {r['p99']:>9.1f}")
+            if args.max_p50_us is not None and r["p50"] > args.max_p50_us:
+                over_budget.append(len(scaled.names))
+        crew.memory.close()
+    if over_budget:
+        sys.exit(
+            f"Over the {args.max_p50_us:.0f} us budget with {', '.join(map(str, over_budget))} agents"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Wall time of the analysis workflow against its critical path.
+
+    python bench_workflow.py --step-seconds 0.2
+    python bench_workflow.py --step-seconds 0.2 --max-seconds 0.5   # CI budget check
+
+Every agent call in ``automated_analysis_workflow`` is replaced by a sleep of
+``--step-seconds``. Run one after another, the three steps take three times
+that; along the critical path (analysis, then report, with root_cause beside
+them) they take twice that. With ``--max-seconds`` the script exits non-zero
+when the median run is slower. Timing lives here rather than in the unit
+tests, which only check that independent steps overlap.
+"""
+
+from __future__ import annotations
+
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from crew_agents import AgentMemory, CrewOrchestrator
+
+
+def sleeper(seconds: float, result: Any) -> Callable[..., Any]:
+    def call(*args, **kwargs):
+        time.sleep(seconds)
+        return result
+
+    return call
+
+
+def bench(step_seconds: float, repeat: int) -> Dict[str, float]:
+    """Median wall time over ``repeat`` runs, with the sequential and critical-path times."""
+    with tempfile.TemporaryDirectory() as tmp:
+        crew = CrewOrchestrator(AgentMemory(Path(tmp) / "bench_memory.json", auto_compact_after=0))
+        crew.data_analyst.analyze_data = sleeper(step_seconds, {"summary": "analysis"})
+        crew.report_generator.generate_report = sleeper(step_seconds, "report")
+        crew.root_cause_analyzer.analyze_issue = sleeper(step_seconds, {"root_cause": "x"})
+        walls: List[float] = []
+        for _ in range(repeat):
+            result = crew.automated_analysis_workflow({"anomalies": ["High CPU usage"]})
+            if result.get("workflow_status") != "completed":
+                sys.exit(f"Workflow did not complete: {result.get('error')}")
+            walls.append(result["wall_seconds"])
+        crew.memory.close()
+    return {
+        "wall": statistics.median(walls),
+        "sequential": 3 * step_seconds,
+        "critical_path": 2 * step_seconds,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Time the analysis workflow")
+    parser.add_argument("--step-seconds", type=float, default=0.2)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, help="Fail if the median run is slower")
+    args = parser.parse_args()
+
+    r = bench(args.step_seconds, args.repeat)
+    print(f"{'wall (s)':>9} {'critical path (s)':>18} {'sequential (s)':>15}")
+    print(f"{r['wall']:>9.3f} {r['critical_path']:>18.3f} {r['sequential']:>15.3f}")
+    if args.max_seconds is not None and r["wall"] > args.max_seconds:
+        sys.exit(f"Over the {args.max_seconds:g} s budget: median run took {r['wall']:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,14 +13,35 @@ Perfect for Patrianna's requirement: "Agent Orchestration & Autonomy"
 
 from __future__ import annotations
 
+import asyncio
 import json
 import logging
 import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
+from agent_router import AgentRouter
 from dotenv import load_dotenv
+from llm_backend import LLMBackend, shared_llm
+from memory_backends import MemoryBackend, SQLiteMemory
+from memory_compaction import (
+    AUTO_COMPACT_AFTER,
+    CompactionStats,
+    MemoryArchive,
+    MemoryCompactor,
+    compact_once,
+)
+from memory_log import LogStore
+from memory_recall import RECALL_KINDS, EmbeddingCache, RecallIndex
+from metric_analysis import analyze_metrics, describe_trends, recommend
+from report_builder import FORMATS, Report, ReportBuilder
+from workflow import Step, Workflow
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -32,136 +53,410 @@ load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 VERTEX_PROJECT = os.getenv("VERTEX_PROJECT")
 MEMORY_FILE = Path("modules/m8-crew-agents/agent_memory.json")
+MEMORY_ROOT = Path(os.getenv("AGENT_MEMORY_ROOT", "modules/m8-crew-agents/memory"))
+MAX_SESSIONS = int(os.getenv("CREW_MAX_SESSIONS", "256"))
+STEP_TIMEOUT = float(os.getenv("CREW_STEP_TIMEOUT", "60"))
+WORKFLOW_TIMEOUT = float(os.getenv("CREW_WORKFLOW_TIMEOUT", "300"))
+
+# Structured outputs the LLM must return for analyze_data / analyze_issue.
+ANALYSIS_SCHEMA = {"summary": str, "trends": list, "recommendations": list, "confidence": float}
+ROOT_CAUSE_SCHEMA = {
+    "potential_causes": list,
+    "root_cause": str,
+    "solution_steps": list,
+    "confidence": float,
+}
 
 
 class AgentMemory:
-    """Persistent memory system for context-aware agents."""
-    
-    def __init__(self, memory_file: Path = MEMORY_FILE):
-        self.memory_file = memory_file
+    """Persistent memory system for context-aware agents.
+
+    Storage is a ``MemoryBackend``: by default an append-only log with a JSON
+    snapshot at ``memory_file`` (``memory_log.LogStore``); a ``.db`` /
+    ``.sqlite`` path selects the indexed ``SQLiteMemory``, whose options
+    (``ttl``, ``max_per_agent``) pass through ``store_options``.
+
+    ``recall`` searches conversations and insights by meaning using
+    ``embedder`` (LangChain embeddings interface; offline hashing by default).
+
+    ``compact_memory`` merges duplicate insights and rolls old conversations
+    into summaries (``memory_compaction``); ``start_compaction`` runs it in the
+    background. That starts by itself, with a pass right away, once
+    ``auto_compact_after`` records have been appended (``0`` opts out).
+    ``sources`` returns the archived records a summary replaced.
+    """
+
+    def __init__(
+        self,
+        memory_file: Optional[Path] = None,
+        backend: Optional[MemoryBackend] = None,
+        embedder=None,
+        auto_compact_after: int = AUTO_COMPACT_AFTER,
+        **store_options,
+    ):
+        # Resolved at call time so tests (and callers) can repoint MEMORY_FILE.
+        self.memory_file = memory_file or MEMORY_FILE
         self.memory_file.parent.mkdir(parents=True, exist_ok=True)
-        self.memory = self._load_memory()
-    
-    def _load_memory(self) -> Dict:
-        """Load memory from file or create new."""
+        self.store = backend or open_backend(self.memory_file, **store_options)
+        self.embedder = embedder
+        self.recall_index: Optional[RecallIndex] = None
+        self._recall_cursor = None
+        self._embedding_cache: Optional[EmbeddingCache] = None
+        self.compactor: Optional[MemoryCompactor] = None
+        self.auto_compact_after = auto_compact_after
+        self._appended = 0  # records since the last automatic compaction request
+        self._lock = threading.RLock()
+        self._load_memory()
+
+    @classmethod
+    def for_namespace(
+        cls,
+        tenant: str,
+        session: Optional[str] = None,
+        root: Optional[Path] = None,
+        suffix: str = ".json",
+        **options,
+    ) -> "AgentMemory":
+        """Memory scoped to one tenant, or to one session of a tenant."""
+        return cls(namespace_path(tenant, session, root, suffix), **options)
+
+    def _load_memory(self):
+        """Open the backend (snapshot + log replay for the default store)."""
         try:
-            if self.memory_file.exists():
-                with open(self.memory_file, 'r') as f:
-                    return json.load(f)
-            return {"conversations": [], "insights": [], "patterns": []}
+            self.store.load()
         except Exception as e:
             logger.error(f"Error loading memory: {e}")
-            return {"conversations": [], "insights": [], "patterns": []}
-    
+
+    @property
+    def memory(self) -> Dict:
+        """All records grouped by kind; materialised on each access for SQLite."""
+        return self.store.snapshot()
+
     def save_memory(self):
-        """Save memory to file."""
+        """Compact the store (snapshot for the log, retention for SQLite)."""
         try:
-            with open(self.memory_file, 'w') as f:
-                json.dump(self.memory, f, indent=2, default=str)
+            self.store.compact()
         except Exception as e:
             logger.error(f"Error saving memory: {e}")
-    
+
+    def flush(self):
+        """Make every event recorded so far durable."""
+        self.store.sync()
+
+    def close(self):
+        if self.compactor is not None:
+            self.compactor.stop()
+        if self._embedding_cache is not None:
+            self._embedding_cache.close()
+        self.store.close()
+
+    def compact_memory(self, **options) -> Optional[CompactionStats]:
+        """Deduplicate insights and roll old conversations into summaries, once."""
+        try:
+            return compact_once(self, **options)
+        except Exception as e:
+            logger.error(f"Error compacting memory: {e}")
+            return None
+
+    def start_compaction(self, interval: Optional[float] = None, **options) -> MemoryCompactor:
+        """Compact every ``interval`` seconds on a background thread until ``close``."""
+        if self.compactor is None:
+            if interval is not None:
+                options["interval"] = interval
+            self.compactor = MemoryCompactor(self, **options)
+        return self.compactor.start()
+
+    def rewrite(self, kinds, transform) -> None:
+        """Replace the records of ``kinds`` with ``transform({kind: records})`` in one step.
+
+        Appends wait while it runs, so ``transform`` should be cheap;
+        ``compact_once`` does its heavy work on a snapshot beforehand.
+        """
+        with self._lock:
+            self.store.rewrite(kinds, transform)
+
+    def sources(self, record: Dict) -> List[Dict]:
+        """The archived records a merged insight or summary was built from."""
+        return MemoryArchive.for_memory(self.memory_file).sources(record)
+
+    def _append(self, kind: str, data: Dict):
+        data.setdefault("id", uuid.uuid4().hex[:16])  # provenance links survive compaction
+        try:
+            with self._lock:
+                self.store.append(kind, data)
+                self._appended += 1
+                due = self.auto_compact_after > 0 and self._appended >= self.auto_compact_after
+                if due:
+                    self._appended = 0
+        except Exception as e:
+            logger.error(f"Error writing memory: {e}")
+            return
+        if due:
+            logger.info(f"{self.auto_compact_after} records appended, compacting memory")
+            self.start_compaction().request()
+
+    def _refresh_recall_index(self) -> RecallIndex:
+        """Index what the store gained since the last recall, from any thread or process.
+
+        Only the tail past the saved cursor is embedded and added; a rewrite
+        (compaction) or deletion resets the cursor and the index is rebuilt
+        from the embedding cache.
+        """
+        with self._lock:
+            cursor = self._recall_cursor if self.recall_index is not None else None
+            records, cursor, reset = self.store.tail(RECALL_KINDS, cursor)
+            if reset or self.recall_index is None:
+                if self._embedding_cache is None:
+                    self._embedding_cache = EmbeddingCache(
+                        self.memory_file.with_name(self.memory_file.name + ".embeddings.db")
+                    )
+                self.recall_index = RecallIndex(self.embedder, self._embedding_cache)
+            self.recall_index.add(records)
+            self._recall_cursor = cursor
+            if reset:
+                logger.info(f"Built recall index over {len(self.recall_index)} memories")
+            return self.recall_index
+
+    def recall(self, task: str, k: int = 5, kinds=RECALL_KINDS) -> List[Dict]:
+        """The ``k`` stored memories most similar to ``task``, each with ``kind`` and ``score``."""
+        try:
+            return self._refresh_recall_index().search(task, k, kinds)
+        except Exception as e:
+            logger.error(f"Error recalling memories: {e}")
+            return []
+
     def add_conversation(self, conversation: Dict):
         """Add conversation to memory."""
         conversation["timestamp"] = datetime.now().isoformat()
-        self.memory["conversations"].append(conversation)
-        self.save_memory()
-    
+        self._append("conversations", conversation)
+
     def add_insight(self, insight: str):
         """Add insight to memory."""
-        insight_data = {
-            "content": insight,
-            "timestamp": datetime.now().isoformat()
-        }
-        self.memory["insights"].append(insight_data)
-        self.save_memory()
-    
-    def get_recent_conversations(self, limit: int = 5) -> List[Dict]:
+        insight_data = {"content": insight, "timestamp": datetime.now().isoformat()}
+        self._append("insights", insight_data)
+
+    def get_recent_conversations(self, limit: int = 5, agent: Optional[str] = None) -> List[Dict]:
         """Get recent conversations."""
-        return self.memory["conversations"][-limit:]
-    
-    def get_insights(self) -> List[Dict]:
-        """Get all insights."""
-        return self.memory["insights"]
+        return self.store.recent("conversations", limit, agent)
+
+    def get_insights(self, limit: Optional[int] = None) -> List[Dict]:
+        """Get all insights, or only the ``limit`` newest."""
+        if limit is None:
+            return self.memory["insights"]
+        return self.store.recent("insights", limit)
+
+    def count_insights(self) -> int:
+        return self.store.count("insights")
+
+
+_NAMESPACE_PART = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]{0,127}")
+
+
+def namespace_path(
+    tenant: str, session: Optional[str] = None, root: Optional[Path] = None, suffix: str = ".json"
+) -> Path:
+    """``<root>/<tenant>/<session>.json`` (``_tenant.json`` for tenant-wide memory)."""
+    for part in (tenant, session):
+        if part is not None and (not _NAMESPACE_PART.fullmatch(part) or ".." in part):
+            raise ValueError(f"Invalid memory namespace: {part!r}")
+    return (root or MEMORY_ROOT) / tenant / f"{session or '_tenant'}{suffix}"
+
+
+def open_backend(path: Path, **options) -> MemoryBackend:
+    """Pick the storage backend from the memory file's suffix."""
+    if path.suffix in (".db", ".sqlite", ".sqlite3"):
+        return SQLiteMemory(path, **options)
+    return LogStore(path, **options)
 
 
 class MockLLMAgent:
-    """Mock LLM agent for demonstration (replace with actual CrewAI when installed)."""
-    
-    def __init__(self, role: str, goal: str, backstory: str, memory: AgentMemory):
+    """LLM agent; answers from templates unless given an ``LLMBackend``.
+
+    With a backend, replies come from OpenAI / Vertex (see ``llm_backend``); any
+    failure there (offline, budget spent, bad output) falls back to the template.
+    """
+
+    # Routing hints for AgentRouter: unambiguous trigger words and sample queries.
+    keywords: Tuple[str, ...] = ()
+    examples: Tuple[str, ...] = ()
+
+    def __init__(
+        self,
+        role: str,
+        goal: str,
+        backstory: str,
+        memory: AgentMemory,
+        llm: Optional[LLMBackend] = None,
+    ):
         self.role = role
         self.goal = goal
         self.backstory = backstory
         self.memory = memory
+        self.llm = llm
         logger.info(f"Initialized {role} agent")
-    
+
+    def _persona(self) -> str:
+        return f"You are the {self.role}. Goal: {self.goal}. Background: {self.backstory}."
+
     def process_task(self, task: str, context: Optional[Dict] = None) -> str:
         """Process a task with context awareness."""
         try:
             # Get relevant context from memory
             recent_conversations = self.memory.get_recent_conversations(3)
-            insights = self.memory.get_insights()
-            
+            insight_count = self.memory.count_insights()
+            related = self.memory.recall(task, k=3)
+
             # Build context-aware response
-            response = self._generate_response(task, context, recent_conversations, insights)
-            
+            response = self._generate_response(
+                task, context, recent_conversations, insight_count, related=related
+            )
+
             # Save interaction to memory
-            self.memory.add_conversation({
-                "agent": self.role,
-                "task": task,
-                "response": response,
-                "context": context
-            })
-            
+            self.memory.add_conversation(
+                {"agent": self.role, "task": task, "response": response, "context": context}
+            )
+
             return response
-            
+
         except Exception as e:
             logger.error(f"Error processing task: {e}")
             return f"Error: {str(e)}"
-    
-    def _generate_response(self, task: str, context: Dict, recent: List, insights: List) -> str:
+
+    def _generate_response(
+        self,
+        task: str,
+        context: Dict,
+        recent: List,
+        insight_count: int,
+        related: Optional[List] = None,
+    ) -> str:
         """Generate context-aware response."""
-        # This would be replaced with actual LLM calls in production
+        if self.llm is not None:
+            answer = self.llm.ask(self.role, self._llm_prompt(task, context, recent, related))
+            if answer:
+                return f"[{self.role}] {answer}"
+
         base_response = f"[{self.role}] Processing: {task}"
-        
+
         if context:
             base_response += f"\nContext: {json.dumps(context, indent=2)}"
-        
+
         if recent:
             base_response += f"\nRecent interactions: {len(recent)} conversations"
-        
-        if insights:
-            base_response += f"\nPrevious insights: {len(insights)} patterns identified"
-        
+
+        if insight_count:
+            base_response += f"\nPrevious insights: {insight_count} patterns identified"
+
+        if related:
+            best = related[0]
+            base_response += (
+                f"\nRelated memories: {len(related)} "
+                f"(closest {best['kind'][:-1]}, similarity {best['score']:.2f})"
+            )
+
         return base_response
 
+    def _llm_prompt(
+        self, task: str, context: Optional[Dict], recent: List, related: Optional[List]
+    ) -> str:
+        lines = [self._persona()]
+        if recent:
+            lines.append("Recent conversation:")
+            lines += [f"- {c.get('task', '')}" for c in recent]
+        if related:
+            lines.append("Related memories:")
+            lines += [f"- {r.get('content') or r.get('task', '')}" for r in related]
+        if context:
+            lines.append(f"Context: {json.dumps(context, default=str)}")
+        lines.append(f"Task: {task}")
+        return "\n".join(lines)
+
 
 class DataAnalystAgent(MockLLMAgent):
     """Specialized agent for data analysis and reporting."""
-    
-    def __init__(self, memory: AgentMemory):
+
+    keywords = (
+        "analyze",
+        "analyse",
+        "analysis",
+        "analytics",
+        "data",
+        "metrics",
+        "trend",
+        "trends",
+        "pattern",
+        "patterns",
+        "statistics",
+        "correlation",
+        "segment",
+        "breakdown",
+    )
+    examples = (
+        "What trends do you see in last week's signups?",
+        "Break down conversions by region",
+        "Which customer segment grew fastest this quarter?",
+        "Compare revenue month over month",
+        "How is user activity distributed across countries?",
+        "Show me how sessions relate to purchases",
+        "How many orders per user on average?",
+        "Which products sell best on weekends?",
+        "What percentage of visitors come back within a week?",
+        "Is engagement growing or flat compared to last year?",
+        "Rank the marketing channels by return on spend",
+        "Estimate next quarter's demand from the historical numbers",
+    )
+
+    def __init__(self, memory: AgentMemory, llm: Optional[LLMBackend] = None):
         super().__init__(
             role="Data Analyst",
             goal="Analyze data patterns and generate actionable insights",
             backstory="Expert in data analysis with focus on business intelligence",
-            memory=memory
+            memory=memory,
+            llm=llm,
         )
-    
+
     def analyze_data(self, data: Dict) -> Dict:
-        """Analyze data and generate insights."""
+        """Analyze metric series (``data["metrics"]``, else numeric fields of ``data``)."""
         try:
+            computed = analyze_metrics(data.get("metrics", data))
+            statistics = {name: s.as_dict() for name, s in computed.stats.items()}
+            if computed.stats:
+                summary = (
+                    f"Analyzed {computed.samples:,} samples across {len(computed.stats)} metrics "
+                    f"({', '.join(computed.stats)})"
+                )
+            else:
+                summary = f"Analyzed {len(data)} data points; no numeric metrics found"
             analysis = {
-                "summary": f"Analyzed {len(data)} data points",
-                "trends": ["Trend 1: Increased activity", "Trend 2: Geographic clustering"],
-                "recommendations": ["Recommendation 1: Focus on high-activity regions"],
-                "confidence": 0.85
+                "summary": summary,
+                "trends": describe_trends(computed),
+                "recommendations": recommend(computed),
+                "confidence": computed.confidence,
+                "samples": computed.samples,
+                "statistics": statistics,
+                "correlations": computed.correlations,
             }
-            
+
+            if self.llm is not None and statistics:
+                # The model interprets the computed statistics, never the raw samples.
+                facts = {"statistics": statistics, "correlations": computed.correlations}
+                narrative = self.llm.ask_json(
+                    self.role,
+                    f"{self._persona()}\nInterpret these metric statistics; report trends and "
+                    f"recommendations:\n{json.dumps(facts)}",
+                    ANALYSIS_SCHEMA,
+                )
+                if narrative:
+                    # The confidence stays the computed one.
+                    analysis.update(
+                        {key: narrative[key] for key in ("summary", "trends", "recommendations")}
+                    )
+
             # Add insight to memory
             self.memory.add_insight(f"Data analysis revealed {len(analysis['trends'])} key trends")
-            
+
             return analysis
-            
+
         except Exception as e:
             logger.error(f"Error in data analysis: {e}")
             return {"error": str(e)}
@@ -169,87 +464,154 @@ class DataAnalystAgent(MockLLMAgent):
 
 class ReportGeneratorAgent(MockLLMAgent):
     """Agent for automated report generation."""
-    
-    def __init__(self, memory: AgentMemory):
+
+    keywords = (
+        "report",
+        "reports",
+        "reporting",
+        "summary",
+        "summarize",
+        "summarise",
+        "digest",
+        "briefing",
+        "generate",
+        "write up",
+        "executive summary",
+    )
+    examples = (
+        "Write up the weekly summary for leadership",
+        "Prepare an executive briefing on Q3",
+        "Draft a status update for stakeholders",
+        "Put together a digest of this month's results",
+        "Create a document I can send to the board",
+        "Compile the findings into a newsletter",
+        "Make a slide deck presenting the highlights",
+        "Write a memo recapping the project outcomes",
+        "Produce a quarterly review for management",
+        "Turn the results into an overview for the team",
+        "Draft an email describing what we achieved",
+        "Prepare a presentation for the investors meeting",
+    )
+
+    def __init__(self, memory: AgentMemory, llm: Optional[LLMBackend] = None):
         super().__init__(
             role="Report Generator",
             goal="Generate comprehensive reports from data analysis",
             backstory="Professional report writer with expertise in business communications",
-            memory=memory
+            memory=memory,
+            llm=llm,
         )
-    
+
     def generate_report(self, analysis: Dict, template: str = "standard") -> str:
         """Generate report from analysis."""
         try:
-            report = f"""
-# Automated Intelligence Report
-Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+            return self.build_report(analysis, formats=("markdown",)).markdown
 
-## Executive Summary
-{analysis.get('summary', 'No summary available')}
-
-## Key Findings
-"""
-            
-            trends = analysis.get('trends', [])
-            for i, trend in enumerate(trends, 1):
-                report += f"{i}. {trend}\n"
-            
-            report += "\n## Recommendations\n"
-            recommendations = analysis.get('recommendations', [])
-            for i, rec in enumerate(recommendations, 1):
-                report += f"{i}. {rec}\n"
-            
-            report += f"\n## Confidence Level: {analysis.get('confidence', 'N/A')}\n"
-            
-            # Add to memory
-            self.memory.add_insight(f"Generated report with {len(trends)} trends and {len(recommendations)} recommendations")
-            
-            return report
-            
         except Exception as e:
             logger.error(f"Error generating report: {e}")
             return f"Error generating report: {str(e)}"
 
+    def build_report(
+        self, analysis: Dict, formats=FORMATS, sinks: Optional[Dict[str, Callable]] = None
+    ) -> Report:
+        """Render the report in every format of ``formats`` in one pass.
+
+        ``sinks`` maps a format to a callable fed each section as it is rendered,
+        e.g. ``{"slack": SlackStream(slack_client.post).write}``.
+        """
+        report = ReportBuilder(analysis).build(formats, sinks)
+
+        # Add to memory
+        self.memory.add_insight(
+            f"Generated report with {len(analysis.get('trends', []))} trends and "
+            f"{len(analysis.get('recommendations', []))} recommendations"
+        )
+
+        return report
+
 
 class RootCauseAnalyzer(MockLLMAgent):
     """Agent for root cause analysis."""
-    
-    def __init__(self, memory: AgentMemory):
+
+    keywords = (
+        "problem",
+        "problems",
+        "issue",
+        "issues",
+        "error",
+        "errors",
+        "failure",
+        "failing",
+        "broken",
+        "outage",
+        "incident",
+        "bug",
+        "crash",
+        "root cause",
+        "diagnose",
+    )
+    examples = (
+        "Why did the checkout service go down last night?",
+        "Figure out what caused the latency spike",
+        "The dashboard stopped loading after the deploy",
+        "Investigate the drop in successful payments",
+        "Something is wrong with the nightly ETL job",
+        "Find out why the API workers keep running out of memory",
+        "Requests time out and pages are slow since the release",
+        "Users cannot log in, what went wrong?",
+        "The job failed and records are missing",
+        "Track down why the service keeps restarting",
+        "Duplicate messages appear after the config change",
+        "Why are some users seeing stale or wrong results?",
+    )
+
+    def __init__(self, memory: AgentMemory, llm: Optional[LLMBackend] = None):
         super().__init__(
             role="Root Cause Analyzer",
             goal="Identify root causes of problems and anomalies",
             backstory="Expert in system analysis and problem-solving methodologies",
-            memory=memory
+            memory=memory,
+            llm=llm,
         )
-    
+
     def analyze_issue(self, issue: str, symptoms: List[str], context: Dict) -> Dict:
         """Perform root cause analysis."""
         try:
-            # Simulate root cause analysis
-            analysis = {
+            analysis = None
+            if self.llm is not None:
+                found = self.llm.ask_json(
+                    self.role,
+                    f"{self._persona()}\nFind the root cause of: {issue}\n"
+                    f"Symptoms: {json.dumps(symptoms, default=str)}\n"
+                    f"Context: {json.dumps(context, default=str)[:4000]}",
+                    ROOT_CAUSE_SCHEMA,
+                )
+                if found:
+                    analysis = {"issue": issue, "symptoms": symptoms, **found}
+            # Offline / failed LLM: simulated root cause analysis
+            analysis = analysis or {
                 "issue": issue,
                 "symptoms": symptoms,
                 "potential_causes": [
                     "Configuration drift",
                     "Resource constraints",
-                    "External dependencies"
+                    "External dependencies",
                 ],
                 "root_cause": "Most likely: Configuration drift",
                 "solution_steps": [
                     "1. Verify current configuration",
                     "2. Compare with known good state",
                     "3. Implement configuration rollback",
-                    "4. Monitor for resolution"
+                    "4. Monitor for resolution",
                 ],
-                "confidence": 0.78
+                "confidence": 0.78,
             }
-            
+
             # Add insight to memory
             self.memory.add_insight(f"Root cause analysis completed for: {issue}")
-            
+
             return analysis
-            
+
         except Exception as e:
             logger.error(f"Error in root cause analysis: {e}")
             return {"error": str(e)}
@@ -257,121 +619,233 @@ class RootCauseAnalyzer(MockLLMAgent):
 
 class CrewOrchestrator:
     """Orchestrates multiple agents working together."""
-    
-    def __init__(self):
-        self.memory = AgentMemory()
-        self.data_analyst = DataAnalystAgent(self.memory)
-        self.report_generator = ReportGeneratorAgent(self.memory)
-        self.root_cause_analyzer = RootCauseAnalyzer(self.memory)
+
+    def __init__(self, memory: Optional[AgentMemory] = None, llm: Optional[LLMBackend] = None):
+        self.memory = memory or AgentMemory()
+        # One backend (client pool, batcher, budgets, cache) for every orchestrator.
+        self.llm = llm or shared_llm()
+        self.data_analyst = DataAnalystAgent(self.memory, self.llm)
+        self.report_generator = ReportGeneratorAgent(self.memory, self.llm)
+        self.root_cause_analyzer = RootCauseAnalyzer(self.memory, self.llm)
+        self.agents = {
+            agent.role: agent
+            for agent in (self.data_analyst, self.report_generator, self.root_cause_analyzer)
+        }
+        self.router = AgentRouter.from_agents(self.agents.values(), default=self.data_analyst.role)
         logger.info("CrewAI Orchestrator initialized")
-    
-    def automated_analysis_workflow(self, data: Dict) -> Dict:
-        """Complete automated analysis workflow."""
+
+    def analysis_workflow(self, data: Dict, step_timeout: float = STEP_TIMEOUT) -> Workflow:
+        """The analysis DAG: report needs the analysis; root cause only needs the anomalies."""
+        steps = [
+            Step("analysis", lambda _: self.data_analyst.analyze_data(data), timeout=step_timeout),
+            Step(
+                "report",
+                lambda deps: self.report_generator.generate_report(deps["analysis"]),
+                deps=("analysis",),
+                timeout=step_timeout,
+            ),
+        ]
+        anomalies = data.get("anomalies", [])
+        if anomalies:
+            steps.append(
+                Step(
+                    "root_cause",
+                    lambda _: self.root_cause_analyzer.analyze_issue(
+                        issue="Data anomalies detected",
+                        symptoms=anomalies,
+                        context={"data_size": len(data)},
+                    ),
+                    timeout=step_timeout,
+                )
+            )
+        return Workflow(steps)
+
+    def automated_analysis_workflow(self, data: Dict, timeout: float = WORKFLOW_TIMEOUT) -> Dict:
+        """Complete automated analysis workflow; independent steps run concurrently."""
         try:
             logger.info("Starting automated analysis workflow")
-            
-            # Step 1: Analyze data
-            analysis = self.data_analyst.analyze_data(data)
-            
-            # Step 2: Generate report
-            report = self.report_generator.generate_report(analysis)
-            
-            # Step 3: Check for anomalies and analyze if needed
-            anomalies = data.get('anomalies', [])
-            root_cause_analysis = None
-            
-            if anomalies:
-                root_cause_analysis = self.root_cause_analyzer.analyze_issue(
-                    issue="Data anomalies detected",
-                    symptoms=anomalies,
-                    context={"data_size": len(data)}
-                )
-            
+            run = self.analysis_workflow(data).run_sync(timeout)
+            trace = run.timeline()
+
+            failed = run.failed()
+            if failed:
+                errors = "; ".join(f"{t.name}: {t.error}" for t in failed)
+                logger.error(f"Automated workflow failed ({errors})")
+                return {"error": errors, "workflow_status": "failed", "trace": trace}
+
+            analysis = run.results["analysis"]
             result = {
                 "analysis": analysis,
-                "report": report,
-                "root_cause_analysis": root_cause_analysis,
+                "report": run.results["report"],
+                "root_cause_analysis": run.results.get("root_cause"),
                 "workflow_status": "completed",
-                "timestamp": datetime.now().isoformat()
+                "timestamp": datetime.now().isoformat(),
+                "trace": trace,
+                "wall_seconds": run.wall_seconds,
             }
-            
-            logger.info("Automated analysis workflow completed")
+
+            self.memory.add_conversation(
+                {
+                    "agent": "Crew Orchestrator",
+                    "task": "automated_analysis_workflow",
+                    "response": analysis.get("summary", ""),
+                }
+            )
+
+            logger.info(f"Automated analysis workflow completed in {run.wall_seconds:.2f}s")
             return result
-            
+
         except Exception as e:
             logger.error(f"Error in automated workflow: {e}")
             return {"error": str(e)}
-    
+
     def interactive_session(self, user_query: str) -> str:
         """Interactive session with context awareness."""
         try:
             # Determine which agent is best suited for the query
-            if "analyze" in user_query.lower() or "data" in user_query.lower():
-                agent = self.data_analyst
-            elif "report" in user_query.lower() or "generate" in user_query.lower():
-                agent = self.report_generator
-            elif "problem" in user_query.lower() or "issue" in user_query.lower():
-                agent = self.root_cause_analyzer
-            else:
-                agent = self.data_analyst  # Default
-            
+            route = self.router.route(user_query)
+            agent = self.agents[route.agent]
+
             # Process with context
             context = {
                 "user_query": user_query,
                 "session_type": "interactive",
-                "agent_selected": agent.role
+                "agent_selected": agent.role,
+                "routing": {"method": route.method, "confidence": round(route.confidence, 3)},
             }
-            
+
             response = agent.process_task(user_query, context)
             return response
-            
+
         except Exception as e:
             logger.error(f"Error in interactive session: {e}")
             return f"Error: {str(e)}"
 
 
+class CrewSessions:
+    """Serves concurrent interactive sessions for many tenants.
+
+    Each (tenant, session) gets its own orchestrator over its own memory
+    namespace, created on first use; the least recently used are evicted once
+    more than ``max_sessions`` are open. Safe to call from many threads, and
+    several processes may serve the same sessions (memory writes are locked).
+
+    ``checkout`` leases a crew for the duration of a ``with`` block. An evicted
+    crew that is still leased is closed when its last lease ends, not while a
+    request is using it.
+    """
+
+    def __init__(
+        self, root: Optional[Path] = None, max_sessions: int = MAX_SESSIONS, **memory_options
+    ):
+        self.root = root
+        self.max_sessions = max_sessions
+        self.memory_options = memory_options
+        self._sessions: "OrderedDict[Tuple[str, str], CrewOrchestrator]" = OrderedDict()
+        self._leases: Dict[CrewOrchestrator, int] = {}
+        self._evicted: set = set()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _open(self, tenant: str, session: str) -> CrewOrchestrator:
+        key = (tenant, session)
+        crew = self._sessions.get(key)
+        if crew is None:
+            memory = AgentMemory.for_namespace(tenant, session, self.root, **self.memory_options)
+            crew = self._sessions[key] = CrewOrchestrator(memory)
+        self._sessions.move_to_end(key)
+        while len(self._sessions) > self.max_sessions:
+            _, evicted = self._sessions.popitem(last=False)
+            self._retire(evicted)
+        return crew
+
+    def _retire(self, crew: CrewOrchestrator) -> None:
+        if self._leases.get(crew):
+            self._evicted.add(crew)  # closed by the last release
+        else:
+            crew.memory.close()
+
+    def get(self, tenant: str, session: str) -> CrewOrchestrator:
+        """The session's crew, unleased: use ``checkout`` to hold it across calls."""
+        with self._lock:
+            return self._open(tenant, session)
+
+    @contextmanager
+    def checkout(self, tenant: str, session: str) -> Iterator[CrewOrchestrator]:
+        """Lease the session's crew; eviction will not close it before the block ends."""
+        with self._lock:
+            crew = self._open(tenant, session)
+            self._leases[crew] = self._leases.get(crew, 0) + 1
+        try:
+            yield crew
+        finally:
+            with self._lock:
+                self._leases[crew] -= 1
+                if not self._leases[crew]:
+                    del self._leases[crew]
+                    if crew in self._evicted:
+                        self._evicted.discard(crew)
+                        crew.memory.close()
+
+    def ask(self, tenant: str, session: str, user_query: str) -> str:
+        with self.checkout(tenant, session) as crew:
+            return crew.interactive_session(user_query)
+
+    async def aask(self, tenant: str, session: str, user_query: str) -> str:
+        return await asyncio.to_thread(self.ask, tenant, session, user_query)
+
+    def close(self) -> None:
+        """Close every session; those still leased close when released."""
+        with self._lock:
+            for crew in self._sessions.values():
+                self._retire(crew)
+            self._sessions.clear()
+
+
 def main():
     """Main function to demonstrate CrewAI capabilities."""
     try:
         # Initialize orchestrator
         crew = CrewOrchestrator()
-        
+
         # Example 1: Automated analysis workflow
         print("=== Automated Analysis Workflow ===")
         sample_data = {
             "metrics": [{"cpu": 85, "memory": 76}, {"cpu": 90, "memory": 82}],
             "anomalies": ["High CPU usage", "Memory spike"],
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now().isoformat(),
         }
-        
+
         workflow_result = crew.automated_analysis_workflow(sample_data)
         print(f"Workflow Status: {workflow_result.get('workflow_status', 'unknown')}")
         print(f"Analysis: {workflow_result.get('analysis', {}).get('summary', 'No analysis')}")
-        
+
         # Example 2: Interactive session
         print("\n=== Interactive Session ===")
         user_queries = [
             "Can you analyze the recent performance data?",
             "Generate a report on system health",
-            "There's a problem with the API response times"
+            "There's a problem with the API response times",
         ]
-        
+
         for query in user_queries:
             response = crew.interactive_session(query)
             print(f"Query: {query}")
             print(f"Response: {response[:100]}...")
             print()
-        
+
         # Example 3: Memory and context demonstration
         print("=== Memory & Context Demonstration ===")
         recent_conversations = crew.memory.get_recent_conversations()
         print(f"Recent conversations: {len(recent_conversations)}")
-        
+
         insights = crew.memory.get_insights()
         print(f"Accumulated insights: {len(insights)}")
-        
+
         return workflow_result
-        
+
     except Exception as e:
         logger.error(f"Error in main: {e}")
         return {"error": str(e)}
@@ -379,4 +853,4 @@ def main():
 
 if __name__ == "__main__":
     result = main()
-    print(f"\nFinal result: {result.get('workflow_status', 'unknown')}") 
\ No newline at end of file
+    print(f"\nFinal result: {result.get('workflow_status', 'unknown')}")
@@ -0,0 +1,477 @@
+"""LLM backend for the crew agents.
+
+One ``LLMBackend`` is shared by every agent of an orchestrator (or by the whole
+process). It owns:
+
+- a single async client (``OpenAIClient`` / ``VertexClient``) running on a
+  private event-loop thread, so all agents and worker threads share one HTTP
+  connection pool
+- a micro-batcher: prompts submitted within ``batch_window`` seconds of each
+  other (e.g. the concurrent branches of one workflow step) are packed into
+  one request of up to ``batch_size`` numbered sub-prompts; a reply that cannot
+  be split back is retried prompt by prompt
+- per-agent ``TokenBudget``s: an estimate is deducted before each call and
+  settled against the provider's reported usage afterwards
+- a ``ResponseCache`` keyed by a hash of model, full prompt and parameters
+
+Agents call ``ask`` / ``ask_json`` and get ``None`` on any failure (no
+provider configured, budget spent, timeout, unparseable output), which is
+their cue to fall back to the offline mock response. ``CREW_LLM_PROVIDER``
+defaults to ``mock``, so tests and demos never touch the network.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+PROVIDER = os.getenv("CREW_LLM_PROVIDER", "mock")  # mock | openai | vertex
+OPENAI_MODEL = os.getenv("CREW_OPENAI_MODEL", "gpt-4o-mini")
+VERTEX_MODEL = os.getenv("CREW_VERTEX_MODEL", "gemini-2.5-flash")
+VERTEX_LOCATION = os.getenv("VERTEX_LOCATION", "us-central1")
+AGENT_TOKEN_BUDGET = int(os.getenv("CREW_AGENT_TOKEN_BUDGET", "200000"))
+TIMEOUT = float(os.getenv("CREW_LLM_TIMEOUT", "60"))
+CACHE_PATH = os.getenv("CREW_LLM_CACHE")  # SQLite file; unset keeps the cache in memory
+MAX_OUTPUT_TOKENS = 800
+MAX_CONNECTIONS = 8
+BATCH_SIZE = 4
+BATCH_WINDOW = 0.02  # seconds to wait for more prompts before sending a batch
+
+_PACK_HEADER = "You will answer {n} independent requests."
+
+
+def approx_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token)."""
+    return (len(text) + 3) // 4
+
+
+@dataclass
+class Completion:
+    text: str
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+
+    @property
+    def tokens(self) -> int:
+        return self.prompt_tokens + self.output_tokens
+
+
+class BudgetExceeded(RuntimeError):
+    pass
+
+
+class TokenBudget:
+    """Tokens one agent may spend.
+
+    ``reserve`` deducts an estimate under the lock, so concurrent calls cannot
+    overrun the limit together; ``settle`` swaps it for the reported usage.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    @property
+    def remaining(self) -> int:
+        return max(self.limit - self.used, 0)
+
+    def reserve(self, estimate: int) -> int:
+        """Deduct ``estimate`` or raise ``BudgetExceeded``; returns the amount reserved."""
+        with self._lock:
+            if self.used + estimate > self.limit:
+                raise BudgetExceeded(
+                    f"needs ~{estimate} tokens, {self.remaining} of {self.limit} left"
+                )
+            self.used += estimate
+            return estimate
+
+    def settle(self, reserved: int, actual: int) -> None:
+        """Replace a reservation with the tokens actually spent (0 for a call never made)."""
+        with self._lock:
+            self.used += actual - reserved
+
+
+class ResponseCache:
+    """LLM replies by (model, prompt, parameters) hash in SQLite (in memory without a path)."""
+
+    def __init__(self, path: Optional[Path | str] = None):
+        self.path = Path(path) if path else None
+        self.conn = sqlite3.connect(str(self.path) if path else ":memory:", check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, text TEXT NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model: str, prompt: str, max_tokens: int) -> str:
+        """Everything that shapes the reply: the model, the full rendered prompt and its parameters."""
+        canonical = json.dumps(
+            {"model": model, "prompt": prompt, "max_tokens": max_tokens}, sort_keys=True
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self.conn.execute("SELECT text FROM responses WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, text: str) -> None:
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?)", (key, text))
+
+    def delete(self, key: str) -> None:
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class LLMClient:
+    """One provider connection; ``complete`` is awaited on the backend's loop."""
+
+    model = "unknown"
+
+    async def complete(self, prompt: str, max_tokens: int) -> Completion:
+        raise NotImplementedError
+
+    async def aclose(self) -> None:
+        pass
+
+
+class OpenAIClient(LLMClient):
+    def __init__(
+        self,
+        model: str = OPENAI_MODEL,
+        api_key: Optional[str] = None,
+        max_connections: int = MAX_CONNECTIONS,
+        timeout: float = TIMEOUT,
+    ):
+        import httpx
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+        self.model = model
+        self.client = AsyncOpenAI(
+            api_key=api_key or os.getenv("OPENAI_API_KEY"),
+            timeout=timeout,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=max_connections, max_keepalive_connections=max_connections
+                )
+            ),
+        )
+
+    async def complete(self, prompt: str, max_tokens: int) -> Completion:
+        resp = await self.client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=max_tokens,
+        )
+        usage = resp.usage
+        return Completion(
+            resp.choices[0].message.content.strip(),
+            getattr(usage, "prompt_tokens", 0) or 0,
+            getattr(usage, "completion_tokens", 0) or 0,
+        )
+
+    async def aclose(self) -> None:
+        await self.client.close()
+
+
+class VertexClient(LLMClient):
+    def __init__(
+        self,
+        model: str = VERTEX_MODEL,
+        project: Optional[str] = None,
+        location: str = VERTEX_LOCATION,
+    ):
+        import vertexai
+        from vertexai.generative_models import GenerativeModel
+
+        vertexai.init(project=project or os.getenv("VERTEX_PROJECT"), location=location)
+        self.model = model
+        self.client = GenerativeModel(model)
+
+    async def complete(self, prompt: str, max_tokens: int) -> Completion:
+        resp = await self.client.generate_content_async(
+            prompt, generation_config={"max_output_tokens": max_tokens}
+        )
+        usage = getattr(resp, "usage_metadata", None)
+        return Completion(
+            str(resp.text).strip(),
+            int(getattr(usage, "prompt_token_count", 0) or 0),
+            int(getattr(usage, "candidates_token_count", 0) or 0),
+        )
+
+
+def pack_prompts(prompts: Sequence[str]) -> str:
+    sections = "\n\n".join(f"### Request {i}\n{p}" for i, p in enumerate(prompts, 1))
+    return (
+        f"{_PACK_HEADER.format(n=len(prompts))} Reply with only a JSON array of "
+        f"{len(prompts)} strings; element i is the complete answer to request i.\n\n{sections}"
+    )
+
+
+def unpack_reply(text: str, n: int) -> Optional[List[str]]:
+    parsed = parse_json(text, array=True)
+    if not isinstance(parsed, list) or len(parsed) != n:
+        return None
+    return [item if isinstance(item, str) else json.dumps(item) for item in parsed]
+
+
+def parse_json(text: str, array: bool = False) -> Any:
+    """The first JSON object (or array) in ``text``, ignoring code fences and chatter."""
+    start = text.find("[" if array else "{")
+    if start < 0:
+        return None
+    try:
+        value, _ = json.JSONDecoder().raw_decode(text[start:])
+    except ValueError:
+        return None
+    return value
+
+
+def coerce(data: Any, schema: Dict[str, type]) -> Optional[Dict[str, Any]]:
+    """``data`` with every ``schema`` key cast to its type, or ``None`` if it does not fit."""
+    if not isinstance(data, dict):
+        return None
+    result = {}
+    try:
+        for key, kind in schema.items():
+            value = data[key]
+            if kind is list:
+                if not isinstance(value, list):
+                    return None
+                result[key] = [str(item) for item in value]
+            elif kind is float:
+                result[key] = min(max(float(value), 0.0), 1.0)
+            else:
+                result[key] = kind(value)
+    except (KeyError, TypeError, ValueError):
+        return None
+    return result
+
+
+class LLMBackend:
+    """Shared client, batching, budgets and cache; see the module docstring."""
+
+    def __init__(
+        self,
+        client: LLMClient,
+        cache: Optional[ResponseCache] = None,
+        token_budget: int = AGENT_TOKEN_BUDGET,
+        batch_size: int = BATCH_SIZE,
+        batch_window: float = BATCH_WINDOW,
+        max_concurrency: int = MAX_CONNECTIONS,
+        timeout: float = TIMEOUT,
+    ):
+        self.client = client
+        self.cache = cache or ResponseCache()
+        self.token_budget = token_budget
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.budgets: Dict[str, TokenBudget] = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._pending: List[tuple] = []
+        self._flush_handle: Optional[asyncio.Handle] = None
+
+    @classmethod
+    def from_env(
+        cls, provider: str = PROVIDER, cache_path: Optional[str] = CACHE_PATH, **options
+    ) -> Optional["LLMBackend"]:
+        """The configured backend, or ``None`` (mock agents) if it cannot be set up."""
+        if provider == "mock":
+            return None
+        try:
+            if provider == "openai":
+                client = OpenAIClient()
+            elif provider == "vertex":
+                client = VertexClient()
+            else:
+                raise ValueError(f"Unknown LLM provider {provider!r}")
+        except Exception as e:
+            logger.warning(f"LLM provider {provider} unavailable ({e}); using mock agents")
+            return None
+        logger.info(f"Agents use {provider} model {client.model}")
+        return cls(client, cache=ResponseCache(cache_path), **options)
+
+    def budget(self, role: str) -> TokenBudget:
+        with self._lock:
+            if role not in self.budgets:
+                self.budgets[role] = TokenBudget(self.token_budget)
+            return self.budgets[role]
+
+    # --- event loop ------------------------------------------------------------
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=loop.run_forever, name="crew-llm", daemon=True
+                )
+                self._thread.start()
+                self._loop = loop
+            return self._loop
+
+    def close(self) -> None:
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(self.client.aclose(), loop).result(self.timeout)
+            finally:
+                loop.call_soon_threadsafe(loop.stop)
+                self._thread.join(self.timeout)
+                loop.close()
+        self.cache.close()
+
+    # --- batching (runs on the backend loop) -------------------------------------
+
+    async def _submit(self, prompt: str, max_tokens: int) -> Completion:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((prompt, max_tokens, future))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                self.batch_window, self._flush
+            )
+        return await future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._dispatch(batch))
+
+    async def _dispatch(self, batch: List[tuple]) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        try:
+            results = await self._complete_packed(batch) if len(batch) > 1 else None
+            if results is None:
+                results = await asyncio.gather(
+                    *(self._call(prompt, max_tokens) for prompt, max_tokens, _ in batch),
+                    return_exceptions=True,
+                )
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def _call(self, prompt: str, max_tokens: int) -> Completion:
+        async with self._semaphore:
+            self.requests += 1
+            return await self.client.complete(prompt, max_tokens)
+
+    async def _complete_packed(self, batch: List[tuple]) -> Optional[List[Completion]]:
+        prompts = [prompt for prompt, _, _ in batch]
+        try:
+            packed = await self._call(pack_prompts(prompts), sum(m for _, m, _ in batch))
+        except Exception as e:
+            logger.warning(
+                f"Batched LLM call failed ({e}); sending {len(batch)} prompts separately"
+            )
+            return None
+        answers = unpack_reply(packed.text, len(batch))
+        if answers is None:
+            logger.warning(
+                f"Could not split batched reply; sending {len(batch)} prompts separately"
+            )
+            return None
+        # Attribute usage to each prompt in proportion to its length.
+        total = sum(len(p) for p in prompts) or 1
+        return [
+            Completion(
+                answer,
+                round(packed.prompt_tokens * len(p) / total),
+                round(packed.output_tokens * len(answer) / max(sum(map(len, answers)), 1)),
+            )
+            for p, answer in zip(prompts, answers)
+        ]
+
+    # --- agent API -----------------------------------------------------------------
+
+    def complete(self, prompt: str, max_tokens: int = MAX_OUTPUT_TOKENS) -> Completion:
+        """Blocking call from any thread; joins whatever batch is currently forming."""
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(self._submit(prompt, max_tokens), loop)
+        return future.result(self.timeout)
+
+    def ask(self, role: str, prompt: str, max_tokens: int = MAX_OUTPUT_TOKENS) -> Optional[str]:
+        """Cached, budgeted completion for ``role``; ``None`` means use the mock."""
+        key = ResponseCache.key(self.client.model, prompt, max_tokens)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        budget = self.budget(role)
+        try:
+            reserved = budget.reserve(approx_tokens(prompt) + max_tokens)
+        except BudgetExceeded as e:
+            logger.warning(f"{role} token budget exhausted: {e}")
+            return None
+        try:
+            completion = self.complete(prompt, max_tokens)
+        except Exception as e:
+            # A timed-out request may still be billed, so it keeps its reservation.
+            budget.settle(reserved, reserved if isinstance(e, TimeoutError) else 0)
+            logger.error(f"LLM call for {role} failed: {e}")
+            return None
+        budget.settle(reserved, completion.tokens or approx_tokens(prompt + completion.text))
+        self.cache.put(key, completion.text)
+        return completion.text
+
+    def ask_json(
+        self, role: str, prompt: str, schema: Dict[str, type], max_tokens: int = MAX_OUTPUT_TOKENS
+    ) -> Optional[Dict[str, Any]]:
+        """``ask`` for a JSON object with ``schema``'s keys; ``None`` if the reply does not fit."""
+        fields = ", ".join(f'"{key}": {kind.__name__}' for key, kind in schema.items())
+        prompt = (
+            f"{prompt}\n\nRespond with only a JSON object: {{{fields}}}. "
+            "Confidence is a number between 0 and 1."
+        )
+        text = self.ask(role, prompt, max_tokens)
+        if text is None:
+            return None
+        result = coerce(parse_json(text), schema)
+        if result is None:
+            logger.warning(f"{role} returned output that does not match {sorted(schema)}")
+            self.cache.delete(ResponseCache.key(self.client.model, prompt, max_tokens))
+        return result
+
+
+_shared: Dict[str, Optional[LLMBackend]] = {}
+_shared_lock = threading.Lock()
+
+
+def shared_llm() -> Optional[LLMBackend]:
+    """The process-wide backend from the environment (``None`` for mock agents)."""
+    with _shared_lock:
+        if "backend" not in _shared:
+            _shared["backend"] = LLMBackend.from_env()
+        return _shared["backend"]
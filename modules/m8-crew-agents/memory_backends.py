@@ -0,0 +1,272 @@
+"""Storage backends for agent memory.
+
+``MemoryBackend`` is the interface ``AgentMemory`` talks to. Two implementations:
+
+- ``memory_log.LogStore`` – JSON snapshot + append-only log, whole state in RAM
+- ``SQLiteMemory`` – indexed SQLite table with retention; counts and "latest N"
+  queries cost the same at a hundred rows or a few million
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import json
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+KINDS = ("conversations", "insights", "patterns", "summaries")
+PRUNE_EVERY = 256  # appends between TTL sweeps
+BUSY_TIMEOUT = 30.0  # seconds to wait for another writer's lock
+
+
+def empty_memory() -> Dict[str, Any]:
+    return {kind: [] for kind in KINDS}
+
+
+class MemoryBackend:
+    """Record-level storage for the conversations / insights / patterns / summaries lists."""
+
+    def load(self) -> None:
+        """Open existing data (called once by ``AgentMemory``)."""
+
+    def append(self, kind: str, data: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def recent(self, kind: str, limit: int, agent: Optional[str] = None) -> List[Dict[str, Any]]:
+        """The ``limit`` newest records of ``kind``, oldest first."""
+        raise NotImplementedError
+
+    def count(self, kind: str, agent: Optional[str] = None) -> int:
+        raise NotImplementedError
+
+    def snapshot(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Every record, grouped by kind (the legacy ``AgentMemory.memory`` shape)."""
+        raise NotImplementedError
+
+    def rewrite(
+        self,
+        kinds: Sequence[str],
+        transform: Callable[[Dict[str, List[Dict[str, Any]]]], Dict[str, List[Dict[str, Any]]]],
+    ) -> None:
+        """Replace the records of ``kinds`` with ``transform({kind: records})`` in one step.
+
+        Appends from other threads and processes wait until it is done, so none
+        is lost; a crash leaves either the old or the new records.
+        """
+        raise NotImplementedError
+
+    def tail(
+        self, kinds: Sequence[str], cursor: Any = None
+    ) -> Tuple[List[Tuple[str, Dict[str, Any]]], Any, bool]:
+        """``(kind, record)`` pairs added after ``cursor``, the next cursor, and a reset flag.
+
+        Appends from other threads and processes are included. With no cursor,
+        or one a rewrite or deletion has invalidated, every record is returned
+        and the flag is set: the caller drops what it built from older results.
+        """
+        state = self.snapshot()
+        return [(kind, record) for kind in kinds for record in state.get(kind, [])], None, True
+
+    def sync(self) -> None:
+        """Make every record written so far durable."""
+
+    def compact(self) -> None:
+        """Reclaim space / apply retention."""
+
+    def close(self) -> None:
+        pass
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS memories (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind       TEXT NOT NULL,
+    agent      TEXT NOT NULL DEFAULT '',
+    created_at TEXT NOT NULL,
+    payload    TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS memories_by_kind ON memories (kind, id);
+CREATE INDEX IF NOT EXISTS memories_by_agent ON memories (agent, kind, id);
+CREATE INDEX IF NOT EXISTS memories_by_time ON memories (created_at);
+CREATE TABLE IF NOT EXISTS memory_counts (
+    kind  TEXT    NOT NULL,
+    agent TEXT    NOT NULL,
+    n     INTEGER NOT NULL,
+    PRIMARY KEY (kind, agent)
+);
+CREATE TRIGGER IF NOT EXISTS memories_counted AFTER INSERT ON memories BEGIN
+    INSERT INTO memory_counts (kind, agent, n) VALUES (new.kind, new.agent, 1)
+    ON CONFLICT (kind, agent) DO UPDATE SET n = n + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS memories_uncounted AFTER DELETE ON memories BEGIN
+    UPDATE memory_counts SET n = n - 1 WHERE kind = old.kind AND agent = old.agent;
+END;
+CREATE TABLE IF NOT EXISTS memory_deletions (n INTEGER NOT NULL);
+INSERT INTO memory_deletions SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM memory_deletions);
+CREATE TRIGGER IF NOT EXISTS memories_deleted AFTER DELETE ON memories BEGIN
+    UPDATE memory_deletions SET n = n + 1;
+END;
+"""
+
+
+class SQLiteMemory(MemoryBackend):
+    """Memory rows in SQLite, indexed by kind, agent and timestamp.
+
+    Per-(kind, agent) row counts are kept by triggers, so ``count`` is a primary
+    key lookup and ``recent`` an index range scan. Retention: rows older than
+    ``ttl`` are swept every ``PRUNE_EVERY`` appends (and on ``compact``), and
+    ``max_per_agent`` caps each (kind, agent) pair by dropping its oldest rows.
+    """
+
+    def __init__(
+        self,
+        path: Path | str,
+        ttl: Optional[dt.timedelta] = None,
+        max_per_agent: Optional[int] = None,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_per_agent = max_per_agent
+        # Other processes may hold the write lock; wait for it rather than fail.
+        self.conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._appends = 0
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def append(self, kind: str, data: Dict[str, Any]) -> None:
+        agent = str(data.get("agent") or "")
+        created_at = str(data.get("timestamp") or dt.datetime.now().isoformat())
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO memories (kind, agent, created_at, payload) VALUES (?, ?, ?, ?)",
+                (kind, agent, created_at, json.dumps(data, default=str)),
+            )
+            if self.max_per_agent is not None:
+                self._trim(kind, agent)
+            self._appends += 1
+            if self.ttl is not None and self._appends % PRUNE_EVERY == 0:
+                self._expire()
+
+    def _trim(self, kind: str, agent: str) -> None:
+        excess = self._count(kind, agent) - self.max_per_agent
+        if excess > 0:
+            self.conn.execute(
+                "DELETE FROM memories WHERE id IN (SELECT id FROM memories "
+                "WHERE agent = ? AND kind = ? ORDER BY id LIMIT ?)",
+                (agent, kind, excess),
+            )
+
+    def _expire(self) -> int:
+        cutoff = (dt.datetime.now() - self.ttl).isoformat()
+        deleted = self.conn.execute("DELETE FROM memories WHERE created_at < ?", (cutoff,)).rowcount
+        if deleted:
+            logger.info(f"Expired {deleted} memory rows older than {cutoff}")
+        return deleted
+
+    def prune(self) -> int:
+        """Apply the TTL now; returns the number of rows removed."""
+        if self.ttl is None:
+            return 0
+        with self._lock, self.conn:
+            return self._expire()
+
+    def compact(self) -> None:
+        self.prune()
+
+    def rewrite(self, kinds, transform) -> None:
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")  # blocks other writers, other processes too
+            try:
+                current = {kind: [] for kind in kinds}
+                marks = ",".join("?" * len(kinds))
+                for kind, payload in self.conn.execute(
+                    f"SELECT kind, payload FROM memories WHERE kind IN ({marks}) ORDER BY id",
+                    tuple(kinds),
+                ):
+                    current[kind].append(json.loads(payload))
+                replaced = transform(current)
+                self.conn.execute(f"DELETE FROM memories WHERE kind IN ({marks})", tuple(kinds))
+                self.conn.executemany(
+                    "INSERT INTO memories (kind, agent, created_at, payload) VALUES (?, ?, ?, ?)",
+                    [
+                        (
+                            kind,
+                            str(data.get("agent") or ""),
+                            str(data.get("timestamp") or dt.datetime.now().isoformat()),
+                            json.dumps(data, default=str),
+                        )
+                        for kind in kinds
+                        for data in replaced.get(kind, [])
+                    ],
+                )
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+
+    def _count(self, kind: str, agent: Optional[str]) -> int:
+        if agent is None:
+            row = self.conn.execute(
+                "SELECT COALESCE(SUM(n), 0) FROM memory_counts WHERE kind = ?", (kind,)
+            ).fetchone()
+        else:
+            row = self.conn.execute(
+                "SELECT n FROM memory_counts WHERE kind = ? AND agent = ?", (kind, agent)
+            ).fetchone()
+        return int(row[0]) if row else 0
+
+    def count(self, kind: str, agent: Optional[str] = None) -> int:
+        with self._lock:
+            return self._count(kind, agent)
+
+    def recent(self, kind: str, limit: int, agent: Optional[str] = None) -> List[Dict[str, Any]]:
+        if agent is None:
+            sql, params = "SELECT payload FROM memories WHERE kind = ? ORDER BY id DESC LIMIT ?", (
+                kind,
+                limit,
+            )
+        else:
+            sql = (
+                "SELECT payload FROM memories WHERE agent = ? AND kind = ? ORDER BY id DESC LIMIT ?"
+            )
+            params = (agent, kind, limit)
+        with self._lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [json.loads(payload) for (payload,) in reversed(rows)]
+
+    def tail(
+        self, kinds: Sequence[str], cursor: Any = None
+    ) -> Tuple[List[Tuple[str, Dict[str, Any]]], Any, bool]:
+        """Rows after the cursor's id; any deletion since (retention, rewrite) resets it."""
+        marks = ",".join("?" * len(kinds))
+        with self._lock:
+            # Read the deletion count first: a delete racing the scan shows up next time.
+            (deletions,) = self.conn.execute("SELECT n FROM memory_deletions").fetchone()
+            reset = cursor is None or cursor[1] != deletions
+            after = 0 if reset else cursor[0]
+            rows = self.conn.execute(
+                f"SELECT id, kind, payload FROM memories WHERE kind IN ({marks}) AND id > ? ORDER BY id",
+                (*kinds, after),
+            ).fetchall()
+        last = rows[-1][0] if rows else after
+        return [(kind, json.loads(payload)) for _, kind, payload in rows], (last, deletions), reset
+
+    def snapshot(self) -> Dict[str, List[Dict[str, Any]]]:
+        state = empty_memory()
+        with self._lock:
+            for kind, payload in self.conn.execute(
+                "SELECT kind, payload FROM memories ORDER BY id"
+            ):
+                state.setdefault(kind, []).append(json.loads(payload))
+        return state
@@ -0,0 +1,477 @@
+"""Background compaction of agent memory.
+
+Every agent run appends a conversation and, often, an insight that repeats an
+earlier one ("CPU high on api-3" / "CPU high on api-7"). Left alone the memory
+file, its load time and recall's index grow without bound. A compaction pass
+rewrites the store in one atomic step (``MemoryBackend.rewrite``):
+
+1. Insights are deduplicated. Exact repeats are found by hashing the
+   normalised text (lower case, digits folded to ``#``); near repeats by
+   MinHash signatures over words and word pairs, bucketed with LSH and merged when
+   their estimated Jaccard similarity reaches ``DEDUPE_THRESHOLD``. The newest
+   record of a group survives with ``occurrences``, ``first_seen`` and the ids
+   it absorbed (``merged_ids``).
+2. Conversations beyond the newest ``keep_conversations`` and older than
+   ``rollup_age`` are rolled into one summary per agent and day (per month
+   once older than ``monthly_after``). Summaries merge incrementally, so each
+   pass only touches what is new.
+
+Nothing is thrown away: every removed record goes, with the id of the record
+that replaced it as ``parent``, to ``<memory file>.archive/<YYYY-MM>.jsonl``.
+Replacements list those files in ``archive``; ``MemoryArchive.sources`` follows
+the link back. The archive is append-only and never loaded at start-up.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEDUPE_THRESHOLD = 0.75  # estimated Jaccard similarity at which insights merge
+NUM_PERM = 64  # MinHash permutations
+BANDS = 16  # LSH bands (NUM_PERM / BANDS rows each)
+KEEP_CONVERSATIONS = int(os.getenv("AGENT_MEMORY_KEEP_CONVERSATIONS", "500"))
+ROLLUP_AGE = timedelta(days=1)
+MONTHLY_AFTER = timedelta(days=30)
+COMPACT_INTERVAL = float(os.getenv("AGENT_MEMORY_COMPACT_INTERVAL", "3600"))
+# Records appended before AgentMemory starts compacting on its own; 0 turns that off.
+AUTO_COMPACT_AFTER = int(os.getenv("AGENT_MEMORY_AUTO_COMPACT_AFTER", "5000"))
+TOP_TASKS = 5
+COMPACT_KINDS = ("insights", "conversations", "summaries")
+MAX_MERGED_IDS = 20
+
+_WORD = re.compile(r"[a-z#]+")
+_DIGITS = re.compile(r"\d+(?:\.\d+)?")
+
+
+def record_id(record: Dict[str, Any]) -> str:
+    """The record's ``id``; records written before ids existed get a content hash."""
+    if record.get("id"):
+        return str(record["id"])
+    digest = hashlib.blake2b(
+        json.dumps(record, sort_keys=True, default=str).encode(), digest_size=8
+    )
+    return digest.hexdigest()
+
+
+def normalise(text: str) -> str:
+    """Lower case, numbers folded to ``#``: "CPU at 91%" and "cpu at 87%" collide."""
+    return " ".join(_WORD.findall(_DIGITS.sub("#", str(text).lower())))
+
+
+def _text(record: Dict[str, Any]) -> str:
+    return str(record.get("content") or record.get("task") or "")
+
+
+def _timestamp(record: Dict[str, Any], key: str = "timestamp") -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(str(record[key]))
+    except (KeyError, ValueError):
+        return None
+
+
+class MinHasher:
+    """MinHash signatures of word shingles; equal slots estimate Jaccard similarity.
+
+    Shingles are the words plus adjacent word pairs, so an inserted "the" still
+    scores ~0.8 while "CPU high" vs "CPU low" stays near 0.5.
+    """
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.salts = rng.integers(
+            0, np.iinfo(np.uint64).max, num_perm, dtype=np.uint64, endpoint=True
+        )
+
+    def shingles(self, text: str) -> List[str]:
+        words = normalise(text).split()
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])] or [""]
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = np.fromiter(
+            (
+                int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "little")
+                for s in set(self.shingles(text))
+            ),
+            np.uint64,
+        )
+        # One salted splitmix64 mix per permutation (uint64 arithmetic wraps).
+        x = hashes[None, :] ^ self.salts[:, None]
+        x ^= x >> np.uint64(30)
+        x *= np.uint64(0xBF58476D1CE4E5B9)
+        x ^= x >> np.uint64(27)
+        x *= np.uint64(0x94D049BB133111EB)
+        x ^= x >> np.uint64(31)
+        return x.min(axis=1)
+
+    @staticmethod
+    def similarity(a: np.ndarray, b: np.ndarray) -> float:
+        return float(np.count_nonzero(a == b)) / a.size
+
+
+class _UnionFind:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int) -> None:
+        self.parent[self.find(i)] = self.find(j)
+
+
+def duplicate_groups(
+    texts: List[str],
+    hasher: Optional[MinHasher] = None,
+    threshold: float = DEDUPE_THRESHOLD,
+    bands: int = BANDS,
+) -> List[List[int]]:
+    """Indexes of ``texts`` grouped by exact (normalised) or near duplication."""
+    groups = _UnionFind(len(texts))
+    first: Dict[str, int] = {}
+    for i, text in enumerate(texts):
+        key = normalise(text)
+        if key in first:
+            groups.union(i, first[key])
+        else:
+            first[key] = i
+    # Near duplicates: one signature per distinct text, candidates from LSH buckets.
+    hasher = hasher or MinHasher()
+    distinct = list(first.values())
+    signatures = {i: hasher.signature(texts[i]) for i in distinct}
+    rows = hasher.salts.size // bands
+    buckets: Dict[Tuple[int, bytes], List[int]] = defaultdict(list)
+    for i in distinct:
+        for band in range(bands):
+            buckets[band, signatures[i][band * rows : (band + 1) * rows].tobytes()].append(i)
+    checked = set()
+    for members in buckets.values():
+        for x, i in enumerate(members):
+            for j in members[x + 1 :]:
+                if (i, j) in checked or groups.find(i) == groups.find(j):
+                    continue
+                checked.add((i, j))
+                if hasher.similarity(signatures[i], signatures[j]) >= threshold:
+                    groups.union(i, j)
+    clusters: Dict[int, List[int]] = defaultdict(list)
+    for i in range(len(texts)):
+        clusters[groups.find(i)].append(i)
+    return list(clusters.values())
+
+
+class MemoryArchive:
+    """Append-only JSONL files holding the records compaction removed."""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+
+    @classmethod
+    def for_memory(cls, memory_file: Path) -> "MemoryArchive":
+        memory_file = Path(memory_file)
+        return cls(memory_file.with_name(memory_file.name + ".archive"))
+
+    @staticmethod
+    def file_name(now: datetime) -> str:
+        return f"{now:%Y-%m}.jsonl"
+
+    def write(self, name: str, entries: List[Dict[str, Any]]) -> None:
+        """Append ``entries`` to archive file ``name`` and fsync it."""
+        if not entries:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / name, "a") as f:
+            f.writelines(json.dumps(entry, default=str) + "\n" for entry in entries)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def sources(self, record: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """The archived records ``record`` replaced, oldest first."""
+        parent = record_id(record)
+        found = []
+        for name in record.get("archive", []):
+            try:
+                with open(self.directory / name) as f:
+                    for line in f:
+                        entry = json.loads(line)
+                        if entry.get("parent") == parent:
+                            found.append(entry["record"])
+            except FileNotFoundError:
+                logger.warning(f"Memory archive {name} is missing")
+        return found
+
+
+@dataclass
+class CompactionStats:
+    insights_before: int = 0
+    insights_after: int = 0
+    conversations_rolled: int = 0
+    summaries: int = 0
+    archived: int = 0
+    seconds: float = 0.0
+
+
+def _link(merged: Dict[str, Any], archive_name: str, sources: Iterable[Dict[str, Any]]) -> None:
+    archive = list(merged.get("archive", []))
+    for source in sources:
+        archive.extend(source.get("archive", []))
+    if archive_name not in archive:
+        archive.append(archive_name)
+    merged["archive"] = list(dict.fromkeys(archive))
+
+
+def dedupe_insights(
+    insights: List[Dict[str, Any]],
+    archive_name: str,
+    hasher: Optional[MinHasher] = None,
+    threshold: float = DEDUPE_THRESHOLD,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """(kept insights in their original order, archive entries for the merged-away ones)."""
+    kept: Dict[int, Dict[str, Any]] = {}
+    archived = []
+    for group in duplicate_groups([_text(r) for r in insights], hasher, threshold):
+        newest = group[-1]
+        if len(group) == 1:
+            kept[newest] = insights[newest]
+            continue
+        members = [insights[i] for i in group]
+        merged = dict(members[-1])
+        merged["id"] = record_id(members[-1])
+        merged["occurrences"] = sum(int(m.get("occurrences", 1)) for m in members)
+        merged["first_seen"] = min(
+            str(m.get("first_seen") or m.get("timestamp", "")) for m in members
+        )
+        absorbed = [record_id(m) for m in members[:-1]]
+        merged["merged_ids"] = (
+            list(merged.get("merged_ids", []))
+            + [x for m in members[:-1] for x in m.get("merged_ids", [])]
+            + absorbed
+        )[-MAX_MERGED_IDS:]
+        _link(merged, archive_name, members[:-1])
+        archived.extend(
+            {"kind": "insights", "parent": merged["id"], "record": m} for m in members[:-1]
+        )
+        kept[newest] = merged
+    return [kept[i] for i in sorted(kept)], archived
+
+
+def _period(when: datetime, now: datetime, monthly_after: timedelta) -> str:
+    return f"{when:%Y-%m}" if now - when >= monthly_after else f"{when:%Y-%m-%d}"
+
+
+def _summary_id(agent: str, period: str) -> str:
+    return hashlib.blake2b(f"summary:{agent}:{period}".encode(), digest_size=8).hexdigest()
+
+
+def _merge_summary(summary: Dict[str, Any], other: Dict[str, Any]) -> None:
+    tasks = Counter(dict(summary.get("tasks", [])))
+    tasks.update(dict(other.get("tasks", [])))
+    summary["tasks"] = [list(t) for t in tasks.most_common(TOP_TASKS)]
+    summary["conversations"] = summary.get("conversations", 0) + other.get("conversations", 0)
+    summary["first_seen"] = min(filter(None, (summary.get("first_seen"), other.get("first_seen"))))
+    summary["timestamp"] = max(filter(None, (summary.get("timestamp"), other.get("timestamp"))))
+    summary["archive"] = list(
+        dict.fromkeys([*summary.get("archive", []), *other.get("archive", [])])
+    )
+    top = ", ".join(f"{task} ({count})" for task, count in summary["tasks"])
+    summary["content"] = (
+        f"{summary['agent']}: {summary['conversations']} conversations in "
+        f"{summary['period']}; top tasks: {top}"
+    )
+
+
+def rollup_conversations(
+    conversations: List[Dict[str, Any]],
+    summaries: List[Dict[str, Any]],
+    archive_name: str,
+    now: datetime,
+    keep: int = KEEP_CONVERSATIONS,
+    age: timedelta = ROLLUP_AGE,
+    monthly_after: timedelta = MONTHLY_AFTER,
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """(kept conversations, summaries, archive entries for the rolled-up conversations)."""
+    cutoff = max(len(conversations) - keep, 0)
+    young, archived = [], []
+    by_period: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    def bucket(agent: str, period: str) -> Dict[str, Any]:
+        key = (agent, period)
+        if key not in by_period:
+            by_period[key] = {
+                "id": _summary_id(agent, period),
+                "agent": agent,
+                "period": period,
+                "conversations": 0,
+                "tasks": [],
+                "archive": [],
+            }
+        return by_period[key]
+
+    # Existing summaries first: daily ones that have aged out fold into their month.
+    for summary in summaries:
+        when = _timestamp(summary, "first_seen") or _timestamp(summary)
+        period = summary.get("period", "")
+        if when is not None and len(period) > 7:
+            period = _period(when, now, monthly_after)
+        target = bucket(summary.get("agent", ""), period)
+        _merge_summary(target, summary)
+        if target["id"] != summary.get("id"):
+            archived.append({"kind": "summaries", "parent": target["id"], "record": summary})
+            _link(target, archive_name, ())
+
+    for conversation in conversations[:cutoff]:
+        when = _timestamp(conversation)
+        if when is None or now - when < age:
+            young.append(conversation)
+            continue
+        agent = str(conversation.get("agent") or "")
+        summary = bucket(agent, _period(when, now, monthly_after))
+        stamp = when.isoformat()
+        _merge_summary(
+            summary,
+            {
+                "conversations": 1,
+                "tasks": [[normalise(conversation.get("task", ""))[:120], 1]],
+                "first_seen": stamp,
+                "timestamp": stamp,
+                "archive": [archive_name],
+            },
+        )
+        archived.append({"kind": "conversations", "parent": summary["id"], "record": conversation})
+    rolled = sorted(by_period.values(), key=lambda s: s.get("timestamp") or "")
+    return young + conversations[cutoff:], rolled, archived
+
+
+class MemoryCompactor:
+    """Runs ``compact_once`` on ``memory`` every ``interval`` seconds on a daemon thread.
+
+    ``request`` wakes the thread for a pass now, without waiting for the interval.
+    """
+
+    def __init__(self, memory: Any, interval: float = COMPACT_INTERVAL, **options):
+        self.memory = memory
+        self.interval = interval
+        self.options = options
+        self.last: Optional[CompactionStats] = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_once(self) -> CompactionStats:
+        self.last = compact_once(self.memory, **self.options)
+        return self.last
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Memory compaction failed: {e}")
+
+    def start(self) -> "MemoryCompactor":
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="memory-compactor", daemon=True)
+            self._thread.start()
+        return self
+
+    def request(self) -> None:
+        """Compact as soon as the thread is free."""
+        self._wake.set()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+def compact_once(
+    memory: Any,
+    now: Optional[datetime] = None,
+    keep_conversations: int = KEEP_CONVERSATIONS,
+    rollup_age: timedelta = ROLLUP_AGE,
+    monthly_after: timedelta = MONTHLY_AFTER,
+    threshold: float = DEDUPE_THRESHOLD,
+    hasher: Optional[MinHasher] = None,
+) -> CompactionStats:
+    """One compaction pass over an ``AgentMemory``'s store.
+
+    Deduplication and rollup run on a snapshot, without holding any lock. The
+    locked rewrite (``AgentMemory.rewrite``) then only carries over what was
+    appended meanwhile. If the store was rewritten or trimmed in between, so
+    its records no longer continue the snapshot, the pass is redone there.
+    """
+    started = time.perf_counter()
+    now = now or datetime.now()
+    archive = MemoryArchive.for_memory(memory.memory_file)
+    name = archive.file_name(now)
+
+    def compute(current: Dict[str, List[Dict[str, Any]]]):
+        stats = CompactionStats(insights_before=len(current["insights"]))
+        insights, archived = dedupe_insights(current["insights"], name, hasher, threshold)
+        conversations, summaries, rolled = rollup_conversations(
+            current["conversations"],
+            current["summaries"],
+            name,
+            now,
+            keep_conversations,
+            rollup_age,
+            monthly_after,
+        )
+        archived.extend(rolled)
+        stats.insights_after = len(insights)
+        stats.conversations_rolled = len(current["conversations"]) - len(conversations)
+        stats.summaries = len(summaries)
+        stats.archived = len(archived)
+        return (
+            {"insights": insights, "conversations": conversations, "summaries": summaries},
+            archived,
+            stats,
+        )
+
+    snapshot = memory.store.snapshot()
+    base = {kind: snapshot.get(kind, []) for kind in COMPACT_KINDS}
+    compacted, archived, stats = compute(base)
+
+    def transform(current: Dict[str, List[Dict[str, Any]]]) -> Dict[str, List[Dict[str, Any]]]:
+        nonlocal compacted, archived, stats
+        if any(current[kind][: len(base[kind])] != base[kind] for kind in COMPACT_KINDS):
+            compacted, archived, stats = compute(current)
+            appended = {kind: [] for kind in COMPACT_KINDS}
+        else:
+            appended = {kind: current[kind][len(base[kind]) :] for kind in COMPACT_KINDS}
+        # Originals are durable in the archive before the store drops them.
+        archive.write(name, archived)
+        return {kind: compacted[kind] + appended[kind] for kind in COMPACT_KINDS}
+
+    # The rewrite resets the store's tail cursor; the next recall rebuilds its index.
+    memory.rewrite(COMPACT_KINDS, transform)
+    stats.seconds = time.perf_counter() - started
+    logger.info(
+        f"Compacted memory: {stats.insights_before} -> {stats.insights_after} insights, "
+        f"{stats.conversations_rolled} conversations into {stats.summaries} summaries, "
+        f"{stats.archived} records archived in {stats.seconds:.2f}s"
+    )
+    return stats
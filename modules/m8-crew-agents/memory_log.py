@@ -0,0 +1,350 @@
+"""Append-only log storage for agent memory.
+
+Layout next to the snapshot file ``agent_memory.json``::
+
+    agent_memory.json              snapshot (same JSON as before) + "_seq" of the last record in it
+    agent_memory.json.log/
+        LOCK                       flock(2) target shared by every process using this memory
+        000000000042.jsonl         log segment, named after the sequence number before its first record
+
+Every record is one JSON line written straight to the OS, so other readers see
+it immediately; ``fsync`` is group-committed every ``flush_every`` records or
+``flush_interval`` seconds, whichever comes first – a timer syncs the last
+records of a burst even if nothing is appended after them. Compaction writes a new snapshot atomically
+(temp file + rename) and drops the segments it covers, so startup reads the
+snapshot and replays only the tail. A torn line from a crash is skipped.
+
+Several threads and processes may share one memory: writers hold an exclusive
+file lock, first read whatever other writers appended since they last looked,
+and only then take the next sequence number, so no update is lost or
+duplicated. Readers take a shared lock and catch up the same way.
+"""
+
+from __future__ import annotations
+
+import atexit
+import copy
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from memory_backends import MemoryBackend, empty_memory
+
+try:
+    import fcntl
+except ImportError:  # Windows: writes are serialised per process only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+FLUSH_EVERY = 32  # records per fsync
+FLUSH_INTERVAL = 1.0  # seconds between fsyncs at most
+SEGMENT_BYTES = 1 << 20  # roll over to a new segment after ~1 MiB
+COMPACT_EVERY = 1000  # records in the log before a snapshot is written
+
+SEQ_KEY = "_seq"
+GENERATION_KEY = "_generation"  # bumped by rewrite(): positions in older states are void
+
+
+def _close_on_exit(ref: "weakref.ref[LogStore]") -> None:
+    store = ref()
+    if store is not None:
+        store.close()
+
+
+class LogStore(MemoryBackend):
+    """Snapshot + write-ahead log segments holding the agent memory dict."""
+
+    def __init__(
+        self,
+        snapshot: Path,
+        flush_every: int = FLUSH_EVERY,
+        flush_interval: float = FLUSH_INTERVAL,
+        segment_bytes: int = SEGMENT_BYTES,
+        compact_every: int = COMPACT_EVERY,
+    ):
+        self.snapshot_path = Path(snapshot)
+        self.log_dir = self.snapshot_path.with_name(self.snapshot_path.name + ".log")
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        self.compact_every = compact_every
+        self.state: Dict[str, Any] = empty_memory()
+        self.seq = 0
+        self.snapshot_seq = 0
+        self.generation = 0
+        self._snapshot_id: Optional[Tuple[int, int]] = None
+        self._position: Tuple[Optional[str], int] = (None, 0)  # (segment name, bytes read)
+        self._segment = None
+        self._segment_name: Optional[str] = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._flush_timer: Optional[threading.Timer] = None
+        self._lock = threading.RLock()
+        self._lock_fd: Optional[int] = None
+        self._lock_pid = 0
+        self._lock_depth = 0
+        atexit.register(_close_on_exit, weakref.ref(self))
+
+    # --- locking ------------------------------------------------------------
+
+    @contextmanager
+    def _locked(self, exclusive: bool = True) -> Iterator[None]:
+        """Thread lock plus, outermost only, a process-wide flock on ``LOCK``."""
+        with self._lock:
+            if self._lock_depth == 0 and fcntl is not None:
+                if self._lock_fd is None or self._lock_pid != os.getpid():
+                    # A forked child must not share the parent's open file description.
+                    self._lock_fd = os.open(self.log_dir / "LOCK", os.O_RDWR | os.O_CREAT, 0o644)
+                    self._lock_pid = os.getpid()
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and fcntl is not None:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    # --- loading ------------------------------------------------------------
+
+    def load(self) -> Dict[str, Any]:
+        """Read the snapshot, then replay log records newer than it."""
+        with self._locked(exclusive=False):
+            self._reload()
+            return copy.deepcopy(self.state)
+
+    def _snapshot_identity(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = self.snapshot_path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _reload(self) -> None:
+        self._snapshot_id = self._snapshot_identity()
+        self.state = self._read_snapshot()
+        self.snapshot_seq = self.seq = int(self.state.pop(SEQ_KEY, 0))
+        self.generation = int(self.state.pop(GENERATION_KEY, 0))
+        self._position = (None, 0)
+        replayed = self._catch_up()
+        if replayed:
+            logger.info(
+                f"Replayed {replayed} memory records after snapshot seq {self.snapshot_seq}"
+            )
+
+    def _read_snapshot(self) -> Dict[str, Any]:
+        state = empty_memory()
+        try:
+            if self.snapshot_path.exists() and self.snapshot_path.stat().st_size:
+                with open(self.snapshot_path) as f:
+                    state.update(json.load(f))
+        except Exception as e:
+            logger.error(f"Error loading memory: {e}")
+        return state
+
+    def _segments(self) -> List[Path]:
+        return sorted(self.log_dir.glob("*.jsonl"))
+
+    def _catch_up(self) -> int:
+        """Apply records appended (by anyone) since the last read; returns how many."""
+        if self._snapshot_identity() != self._snapshot_id:
+            # Another process compacted: everything we had is in the new snapshot.
+            self._reload()
+            return 0
+        segments = self._segments()
+        names = [segment.name for segment in segments]
+        current, offset = self._position
+        if current is not None and current not in names:
+            self._reload()
+            return 0
+        start = names.index(current) if current is not None else 0
+        applied = 0
+        for segment in segments[start:]:
+            begin = offset if segment.name == current else 0
+            with open(segment, "rb") as f:
+                f.seek(begin)
+                data = f.read()
+            for line in data.splitlines():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Ignoring damaged record in {segment.name} after byte {begin}")
+                    continue
+                if record["seq"] <= self.seq:
+                    continue  # already folded into the snapshot
+                self._apply(record)
+                self.seq = record["seq"]
+                applied += 1
+            self._position = (segment.name, begin + len(data))
+        return applied
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        self.state.setdefault(record["kind"], []).append(record["data"])
+
+    # --- writing ------------------------------------------------------------
+
+    def append(self, kind: str, data: Dict[str, Any]) -> None:
+        """Apply ``data`` to ``state[kind]`` and append it to the log."""
+        with self._locked():
+            self._catch_up()
+            segment = self._writable_segment()
+            self.seq += 1
+            record = {"seq": self.seq, "kind": kind, "data": data}
+            segment.write(json.dumps(record, default=str).encode("utf-8") + b"\n")
+            segment.flush()
+            self._apply(record)
+            self._position = (self._segment_name, segment.tell())
+            self._unsynced += 1
+            if (
+                self._unsynced >= self.flush_every
+                or time.monotonic() - self._last_sync >= self.flush_interval
+            ):
+                self.sync()
+            elif self._flush_timer is None or not self._flush_timer.is_alive():
+                self._schedule_flush()
+            if self.seq - self.snapshot_seq >= self.compact_every:
+                self.compact()
+
+    def _writable_segment(self):
+        """The newest segment (just caught up to its end), or a fresh one once it is full."""
+        name, offset = self._position
+        if name is None or offset >= self.segment_bytes:
+            name, offset = f"{self.seq:012d}.jsonl", 0
+        if self._segment_name != name:
+            self._close_segment()
+            self._segment = open(self.log_dir / name, "a+b")
+            self._segment_name = name
+        if offset and os.pread(self._segment.fileno(), 1, offset - 1) != b"\n":
+            self._segment.write(b"\n")  # terminate a torn line so the next record parses
+        return self._segment
+
+    def _close_segment(self) -> None:
+        if self._segment is not None:
+            self.sync()
+            self._segment.close()
+            self._segment = None
+            self._segment_name = None
+
+    def _schedule_flush(self) -> None:
+        """Sync whatever is still pending ``flush_interval`` seconds from now."""
+        timer = threading.Timer(self.flush_interval, self.sync)
+        timer.daemon = True
+        self._flush_timer = timer
+        timer.start()
+
+    def sync(self) -> None:
+        """Group commit: make every record written so far durable."""
+        with self._lock:
+            if self._segment is not None and self._unsynced:
+                os.fsync(self._segment.fileno())
+            self._unsynced = 0
+            self._last_sync = time.monotonic()
+
+    def compact(self) -> None:
+        """Write a snapshot of the current state and delete the segments it covers."""
+        with self._locked():
+            self._catch_up()
+            self._close_segment()
+            covered = self._segments()
+            tmp = self.snapshot_path.with_name(f"{self.snapshot_path.name}.{os.getpid()}.tmp")
+            with open(tmp, "w") as f:
+                json.dump(
+                    {**self.state, SEQ_KEY: self.seq, GENERATION_KEY: self.generation},
+                    f,
+                    default=str,
+                )
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.snapshot_path)
+            self._snapshot_id = self._snapshot_identity()
+            self.snapshot_seq = self.seq
+            # A crash before this point leaves segments whose records the snapshot
+            # already has; loading skips them by sequence number.
+            for segment in covered:
+                segment.unlink(missing_ok=True)
+            self._position = (None, 0)
+            logger.debug(f"Compacted memory into snapshot at seq {self.seq}")
+
+    def rewrite(self, kinds, transform) -> None:
+        """Transform the current records and commit them as a new snapshot."""
+        with self._locked():
+            self._catch_up()
+            replaced = transform({kind: list(self.state.get(kind, [])) for kind in kinds})
+            for kind in kinds:
+                self.state[kind] = list(replaced.get(kind, []))
+            self.generation += 1
+            self.compact()
+
+    # --- queries -------------------------------------------------------------
+
+    def recent(self, kind: str, limit: int, agent: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._locked(exclusive=False):
+            self._catch_up()
+            records = self.state.get(kind, [])
+            if agent is None:
+                matched = records[-limit:] if limit > 0 else []
+            else:
+                matched = []
+                for record in reversed(records):
+                    if len(matched) >= limit:
+                        break
+                    if record.get("agent") == agent:
+                        matched.append(record)
+                matched.reverse()
+            # Copies: editing a result must not change state that no log record describes.
+            return copy.deepcopy(matched)
+
+    def count(self, kind: str, agent: Optional[str] = None) -> int:
+        with self._locked(exclusive=False):
+            self._catch_up()
+            records = self.state.get(kind, [])
+            if agent is None:
+                return len(records)
+            return sum(1 for record in records if record.get("agent") == agent)
+
+    def tail(self, kinds, cursor=None):
+        """Records past the cursor's per-kind lengths (after catching up with other writers).
+
+        Compaction keeps every record in order, so positions survive it; a
+        rewrite bumps the generation and resets the cursor.
+        """
+        with self._locked(exclusive=False):
+            self._catch_up()
+            reset = cursor is None or cursor[0] != self.generation
+            seen = {} if reset else cursor[1]
+            records = [
+                (kind, record)
+                for kind in kinds
+                for record in self.state.get(kind, [])[seen.get(kind, 0) :]
+            ]
+            lengths = {kind: len(self.state.get(kind, [])) for kind in kinds}
+            return copy.deepcopy(records), (self.generation, lengths), reset
+
+    def snapshot(self) -> Dict[str, Any]:
+        """A deep copy of the state; changing it never touches the store."""
+        with self._locked(exclusive=False):
+            self._catch_up()
+            return copy.deepcopy(self.state)
+
+    @property
+    def tail_length(self) -> int:
+        """Records in the log that are not yet in the snapshot."""
+        return self.seq - self.snapshot_seq
+
+    def close(self) -> None:
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            self._close_segment()
+            if self._lock_fd is not None and self._lock_pid == os.getpid():
+                os.close(self._lock_fd)
+            self._lock_fd = None
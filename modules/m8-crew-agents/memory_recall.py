@@ -0,0 +1,298 @@
+"""Semantic recall over agent memory.
+
+``RecallIndex`` keeps one normalised embedding per conversation, insight and
+compaction summary in a growable NumPy matrix. Small indexes are searched exactly (one matrix-vector
+product plus a partial sort). From ``ANN_MIN`` entries on, the vectors are
+clustered (spherical k-means over a sample, about sqrt(n) clusters) and a
+query scores only the members of its ``PROBES`` nearest clusters, so its cost
+grows with sqrt(n) instead of n. New vectors join their nearest cluster; the
+clusters are retrained whenever the index has doubled.
+Embedders follow the LangChain interface (``embed_documents`` /
+``embed_query``), so ``OpenAIEmbeddings`` drops in; the default
+``HashingEmbeddings`` is deterministic and offline. Vectors are cached in
+SQLite by text hash, so rebuilding the index after a restart embeds only
+text it has never seen.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import itertools
+import logging
+import re
+import sqlite3
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DIMENSIONS = 256
+INITIAL_CAPACITY = 1024
+EMBED_BATCH = 512
+ANN_MIN = 20_000  # below this, exact search is already fast
+PROBES = 16  # clusters scanned per query
+TRAIN_PER_CLUSTER = 32  # k-means sample size per cluster
+KMEANS_ITERATIONS = 6
+ASSIGN_BATCH = 8192
+RECALL_KINDS = ("conversations", "insights", "summaries")
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def memory_text(kind: str, record: Dict[str, Any]) -> str:
+    """The text a memory record is embedded by."""
+    if kind in ("insights", "summaries"):
+        return str(record.get("content", ""))
+    return "\n".join(str(record[key]) for key in ("task", "response") if record.get(key))
+
+
+@lru_cache(maxsize=1 << 16)
+def _feature_slot(feature: str, dimensions: int) -> Tuple[int, float]:
+    h = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+    return h % dimensions, 1.0 if (h >> 63) & 1 else -1.0
+
+
+_STOPWORDS = frozenset(
+    "a an and are as at be can could do does for from have how i in is it its me my of on or our "
+    "please should so that the their there this to us was we what when which who will with "
+    "would you your".split()
+)
+_SUFFIXES = ("ations", "ation", "ings", "ing", "ures", "ure", "ies", "es", "ed", "ly", "s")
+
+
+def _stem(word: str) -> str:
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[: -len(suffix)]
+            break
+    return word[:5]
+
+
+class HashingEmbeddings:
+    """Signed feature hashing of word unigrams and bigrams; no model, no network.
+
+    With ``stem=True`` stopwords are dropped, a common suffix is stripped and
+    words are cut to five letters, so "analyze", "analysis" and "analytics"
+    (or "failed", "failing" and "failure") share a feature.
+    """
+
+    def __init__(self, dimensions: int = DIMENSIONS, stem: bool = False):
+        self.dimensions = dimensions
+        self.stem = stem
+        self.model = f"hashing-{dimensions}" + ("-stem" if stem else "")
+
+    def tokens(self, text: str) -> List[str]:
+        tokens = _TOKEN.findall(text.lower())
+        if self.stem:
+            tokens = [_stem(t) for t in tokens if t not in _STOPWORDS]
+        return tokens
+
+    def features(self, text: str) -> Dict[int, float]:
+        """The non-zero entries of the embedding, as ``{slot: value}``."""
+        weights: Dict[int, float] = {}
+        tokens = self.tokens(text)
+        for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+            slot, sign = _feature_slot(feature, self.dimensions)
+            weights[slot] = weights.get(slot, 0.0) + sign
+        return weights
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for slot, value in self.features(text).items():
+            vector[slot] = value
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text).tolist() for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text).tolist()
+
+
+def _text_key(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Vectors by (model, text hash) in SQLite."""
+
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, key TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, key))"
+        )
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def get_many(self, model: str, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start : start + 500]
+            rows = self.conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE model = ? AND key IN ({','.join('?' * len(chunk))})",
+                (model, *chunk),
+            )
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, model: str, items: Iterable[Tuple[str, np.ndarray]]) -> None:
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                ((model, key, vector.astype(np.float32).tobytes()) for key, vector in items),
+            )
+
+
+class RecallIndex:
+    """Cosine index that grows as memories are added; see the module docstring."""
+
+    def __init__(self, embedder: Any = None, cache: Optional[EmbeddingCache] = None):
+        self.embedder = embedder or HashingEmbeddings()
+        self.model = str(getattr(self.embedder, "model", None) or type(self.embedder).__name__)
+        self.cache = cache
+        self.vectors: Optional[np.ndarray] = None
+        self.kind_codes = np.zeros(0, np.int8)
+        self.kinds: List[str] = []
+        self.entries: List[Tuple[str, Dict[str, Any]]] = []
+        self.centroids: Optional[np.ndarray] = None
+        self.cells: List[List[int]] = []
+        self._trained_on = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @staticmethod
+    def _normalise(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1.0, norms)
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        keys = [_text_key(text) for text in texts]
+        cached = self.cache.get_many(self.model, list(set(keys))) if self.cache else {}
+        missing = sorted({key: text for key, text in zip(keys, texts) if key not in cached}.items())
+        for start in range(0, len(missing), EMBED_BATCH):
+            batch = missing[start : start + EMBED_BATCH]
+            vectors = np.asarray(
+                self.embedder.embed_documents([text for _, text in batch]), dtype=np.float32
+            )
+            fresh = {key: vector for (key, _), vector in zip(batch, vectors)}
+            cached.update(fresh)
+            if self.cache:
+                self.cache.put_many(self.model, fresh.items())
+        if missing:
+            logger.debug(f"Embedded {len(missing)} new memory texts with {self.model}")
+        return np.stack([cached[key] for key in keys]) if keys else np.empty((0, 0), np.float32)
+
+    def add(self, items: Sequence[Tuple[str, Dict[str, Any]]]) -> None:
+        """Index ``(kind, record)`` pairs."""
+        if not items:
+            return
+        vectors = self._normalise(
+            self._embed([memory_text(kind, record) for kind, record in items])
+        )
+        with self._lock:
+            for kind, _ in items:
+                if kind not in self.kinds:
+                    self.kinds.append(kind)
+            codes = np.array([self.kinds.index(kind) for kind, _ in items], np.int8)
+            n = len(self.entries)
+            if self.vectors is None or n + len(items) > len(self.vectors):
+                capacity = max(INITIAL_CAPACITY, 2 * len(self.kind_codes), n + len(items))
+                self.vectors = _grow(self.vectors, n, (capacity, vectors.shape[1]), np.float32)
+                self.kind_codes = _grow(self.kind_codes, n, (capacity,), np.int8)
+            self.vectors[n : n + len(items)] = vectors
+            self.kind_codes[n : n + len(items)] = codes
+            self.entries.extend(items)
+            total = n + len(items)
+            if total >= ANN_MIN and total >= 2 * self._trained_on:
+                self._train(total)
+            elif self.centroids is not None:
+                self._assign(n, vectors)
+
+    def _train(self, n: int) -> None:
+        """Cluster the first ``n`` vectors and file every one under its nearest centroid."""
+        clusters = int(np.sqrt(n))
+        rng = np.random.default_rng(0)
+        sample = self.vectors[
+            np.sort(rng.choice(n, min(n, clusters * TRAIN_PER_CLUSTER), replace=False))
+        ]
+        centroids = sample[rng.choice(len(sample), clusters, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]  # keep a centroid that lost all its members
+            centroids = self._normalise(sums)
+        self.centroids = centroids
+        self.cells = [[] for _ in range(clusters)]
+        self._trained_on = n
+        self._assign(0, self.vectors[:n])
+        logger.debug(f"Clustered {n} recall vectors into {clusters} cells")
+
+    def _assign(self, start: int, vectors: np.ndarray) -> None:
+        for offset in range(0, len(vectors), ASSIGN_BATCH):
+            labels = np.argmax(vectors[offset : offset + ASSIGN_BATCH] @ self.centroids.T, axis=1)
+            for i, label in enumerate(labels.tolist(), start + offset):
+                self.cells[label].append(i)
+
+    def candidates(self, q: np.ndarray) -> np.ndarray:
+        """Positions scored for the normalised query ``q``: all of them, or its nearest cells."""
+        n = len(self.entries)
+        if self.centroids is None:
+            return np.arange(n)
+        probes = min(PROBES, len(self.cells))
+        nearest = np.argpartition(-(self.centroids @ q), probes - 1)[:probes]
+        return np.fromiter(itertools.chain.from_iterable(self.cells[c] for c in nearest), np.int64)
+
+    def search(
+        self, query: str, k: int = 5, kinds: Optional[Iterable[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """The ``k`` most similar records, best first, each with ``kind`` and ``score``."""
+        if not self.entries or k <= 0:
+            return []
+        q = np.asarray(self.embedder.embed_query(query), dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if norm == 0:
+            return []
+        q = q / norm
+        with self._lock:
+            candidates = self.candidates(q)
+            if not len(candidates):
+                return []
+            scores = self.vectors[candidates] @ q
+            if kinds is not None:
+                scores[~self._kind_mask(kinds, candidates)] = -np.inf
+            top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+            top = top[np.argsort(-scores[top], kind="stable")]
+            hits = [
+                (self.entries[candidates[i]], float(scores[i]))
+                for i in top
+                if np.isfinite(scores[i])
+            ]
+        return [{**record, "kind": kind, "score": score} for (kind, record), score in hits]
+
+    def _kind_mask(self, kinds: Iterable[str], candidates: np.ndarray) -> np.ndarray:
+        codes = self.kind_codes[candidates]
+        mask = np.zeros(len(candidates), dtype=bool)
+        for kind in kinds:
+            if kind in self.kinds:
+                mask |= codes == self.kinds.index(kind)
+        return mask
+
+
+def _grow(array: Optional[np.ndarray], n: int, shape: Tuple[int, ...], dtype) -> np.ndarray:
+    grown = np.zeros(shape, dtype)
+    if array is not None:
+        grown[:n] = array[:n]
+    return grown
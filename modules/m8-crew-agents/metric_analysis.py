@@ -0,0 +1,206 @@
+"""Vectorized analysis of metric series for the Data Analyst agent.
+
+``to_columns`` turns the payload callers pass (``[{"cpu": 85, "memory": 76}, ...]``,
+``{"cpu": [...], ...}`` or plain scalars) into one float64 NumPy array per
+metric, missing values as NaN. ``analyze_metrics`` then describes every column
+with whole-array operations only: percentiles (one partition pass), a
+least-squares trend over the sample index, outliers by robust z-score
+(median / MAD) and pairwise Pearson correlations. Cost is linear in the
+number of samples, about 0.15 s per million (see ``bench_analysis.py``).
+
+The confidence is computed, not asserted: it grows with the number of samples,
+and shrinks with missing values and with the share of outliers.
+"""
+
+from __future__ import annotations
+
+import math
+from dataclasses import asdict, dataclass, field
+from itertools import chain
+from numbers import Real
+from typing import Any, Dict, List, Mapping, Optional
+
+import numpy as np
+
+OUTLIER_Z = 3.5  # robust z-score above which a sample is an outlier
+TREND_MIN_CHANGE = 0.05  # relative change over the series that counts as a trend
+STRONG_CORRELATION = 0.8
+CONFIDENCE_SAMPLES = 30  # samples at which the size factor reaches 0.5
+
+
+@dataclass
+class MetricStats:
+    name: str
+    count: int = 0
+    missing: int = 0
+    mean: float = math.nan
+    std: float = math.nan
+    min: float = math.nan
+    p50: float = math.nan
+    p95: float = math.nan
+    p99: float = math.nan
+    max: float = math.nan
+    slope: float = 0.0  # change per sample, least squares
+    change: float = 0.0  # fitted change over the whole series, relative to |mean|
+    outliers: int = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {k: (round(v, 4) if isinstance(v, float) else v) for k, v in asdict(self).items()}
+
+
+@dataclass
+class MetricAnalysis:
+    stats: Dict[str, MetricStats] = field(default_factory=dict)
+    correlations: List[Dict[str, Any]] = field(default_factory=list)
+    samples: int = 0
+    confidence: float = 0.0
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (Real, np.number)) and not isinstance(value, bool)
+
+
+def _column(values: Any) -> Optional[np.ndarray]:
+    try:
+        array = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return None
+    return array.ravel() if array.ndim <= 1 else None
+
+
+def to_columns(metrics: Any) -> Dict[str, np.ndarray]:
+    """One float64 array per numeric metric; non-numeric fields are dropped."""
+    if isinstance(metrics, np.ndarray):
+        return {"value": metrics.astype(np.float64).ravel()}
+    if isinstance(metrics, Mapping):
+        columns = {}
+        for name, values in metrics.items():
+            if _is_number(values) or (
+                isinstance(values, (list, tuple, np.ndarray)) and len(values)
+            ):
+                column = _column(values)
+                if column is not None:
+                    columns[str(name)] = column
+        return columns
+    if not isinstance(metrics, (list, tuple)) or not metrics:
+        return {}
+    if all(_is_number(v) for v in metrics[:1]):
+        column = _column(metrics)
+        return {"value": column} if column is not None else {}
+    rows = [
+        row for row in metrics if isinstance(row, dict)
+    ]  # not Mapping: ABC checks are slow per row
+    names = list(dict.fromkeys(chain.from_iterable(rows)))
+    columns = {}
+    nan = math.nan
+    for name in names:
+        try:
+            column = np.fromiter((row.get(name, nan) for row in rows), np.float64, len(rows))
+        except (TypeError, ValueError):
+            continue  # text, nested values, ...
+        columns[str(name)] = column
+    return columns
+
+
+def describe(name: str, values: np.ndarray) -> MetricStats:
+    """Summary statistics of one column with whole-array operations."""
+    finite = np.isfinite(values)
+    dense = bool(finite.all())
+    x = values if dense else values[finite]
+    stats = MetricStats(name, count=int(x.size), missing=int(values.size - x.size))
+    if not x.size:
+        return stats
+    stats.min, stats.p50, stats.p95, stats.p99, stats.max = (
+        float(v) for v in np.percentile(x, [0, 50, 95, 99, 100])
+    )
+    stats.mean = float(x.mean())
+    stats.std = float(x.std())
+    if x.size > 1:
+        t = (
+            np.arange(x.size, dtype=np.float64)
+            if dense
+            else np.flatnonzero(finite).astype(np.float64)
+        )
+        t -= t.mean()
+        stats.slope = float(t @ (x - stats.mean) / (t @ t))
+        span = t[-1] - t[0]
+        stats.change = stats.slope * span / abs(stats.mean) if stats.mean else 0.0
+    scale = 1.4826 * float(np.median(np.abs(x - stats.p50)))  # MAD, as a std estimate
+    if scale == 0:
+        scale = stats.std
+    if scale > 0:
+        stats.outliers = int(np.count_nonzero(np.abs(x - stats.p50) > OUTLIER_Z * scale))
+    return stats
+
+
+def correlations(
+    columns: Dict[str, np.ndarray], stats: Dict[str, MetricStats]
+) -> List[Dict[str, Any]]:
+    """Pearson r for every pair of aligned, non-constant columns (NaN filled with the mean)."""
+    length = max((c.size for c in columns.values()), default=0)
+    names = [n for n, c in columns.items() if c.size == length > 1 and stats[n].std > 0]
+    if len(names) < 2:
+        return []
+    matrix = np.stack([columns[n] for n in names])
+    if not np.isfinite(matrix).all():
+        means = np.array([stats[n].mean for n in names])[:, None]
+        matrix = np.where(np.isfinite(matrix), matrix, means)
+    r = np.corrcoef(matrix)
+    i, j = np.triu_indices(len(names), k=1)
+    return [{"metrics": [names[a], names[b]], "r": round(float(r[a, b]), 4)} for a, b in zip(i, j)]
+
+
+def analyze_metrics(metrics: Any) -> MetricAnalysis:
+    columns = to_columns(metrics)
+    stats = {name: describe(name, column) for name, column in columns.items()}
+    analysis = MetricAnalysis(stats=stats, correlations=correlations(columns, stats))
+    analysis.samples = max((c.size for c in columns.values()), default=0)
+    total = sum(c.size for c in columns.values())
+    valid = sum(s.count for s in stats.values())
+    if valid:
+        size = analysis.samples / (analysis.samples + CONFIDENCE_SAMPLES)
+        coverage = valid / total
+        clean = 1 - sum(s.outliers for s in stats.values()) / valid
+        analysis.confidence = round(size * coverage * clean, 2)
+    return analysis
+
+
+def describe_trends(analysis: MetricAnalysis) -> List[str]:
+    trends = []
+    for s in analysis.stats.values():
+        if not s.count:
+            continue
+        if abs(s.change) >= TREND_MIN_CHANGE:
+            direction = "rising" if s.change > 0 else "falling"
+            trends.append(
+                f"{s.name} {direction} {abs(s.change):.1%} over {s.count:,} samples "
+                f"(mean {s.mean:.4g}, p95 {s.p95:.4g})"
+            )
+        else:
+            trends.append(f"{s.name} stable around {s.mean:.4g} (p95 {s.p95:.4g})")
+        if s.outliers:
+            trends.append(f"{s.name}: {s.outliers:,} outlier samples (max {s.max:.4g})")
+    for pair in analysis.correlations:
+        if abs(pair["r"]) >= STRONG_CORRELATION:
+            a, b = pair["metrics"]
+            relation = "move together" if pair["r"] > 0 else "move in opposite directions"
+            trends.append(f"{a} and {b} {relation} (r={pair['r']:.2f})")
+    return trends
+
+
+def recommend(analysis: MetricAnalysis) -> List[str]:
+    recommendations = []
+    for s in analysis.stats.values():
+        if s.change >= TREND_MIN_CHANGE:
+            recommendations.append(f"Investigate the rise in {s.name} (p99 {s.p99:.4g})")
+        if s.outliers:
+            recommendations.append(f"Review the {s.outliers:,} outlier samples in {s.name}")
+        if s.missing:
+            recommendations.append(
+                f"Fix collection gaps in {s.name} ({s.missing:,} missing values)"
+            )
+    if analysis.samples < CONFIDENCE_SAMPLES:
+        recommendations.append(
+            f"Collect more samples: {analysis.samples} is too few for firm conclusions"
+        )
+    return recommendations or ["No action needed: metrics are stable"]
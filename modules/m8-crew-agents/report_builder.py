@@ -0,0 +1,292 @@
+"""Streaming, multi-format report assembly.
+
+``ReportBuilder.sections`` walks an analysis once and yields ``Section``s
+(summary, findings, metrics, recommendations, confidence) as it goes. Every
+section is rendered to each requested format right away:
+
+- ``markdown`` – the text ``generate_report`` has always returned
+- ``slack``    – block-kit blocks, long lists packed into blocks of at most
+  ``MAX_BLOCK_CHARS``; ``SlackStream`` posts a message every ``MAX_BLOCKS``
+- ``json``     – one ``(key, value)`` pair of the report object
+
+Sinks receive each rendered chunk as soon as its section exists, so a Slack
+channel or an HTTP response starts filling before the last finding has been
+formatted, and nothing is built by repeated string concatenation.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+TITLE = "Automated Intelligence Report"
+FORMATS = ("markdown", "slack", "json")
+MAX_BLOCK_CHARS = 3000  # Slack limit for a section block's text
+MAX_BLOCKS = 50  # Slack limit for blocks per message
+METRIC_COLUMNS = ("Metric", "Samples", "Mean", "p50", "p95", "p99", "Max", "Trend", "Outliers")
+
+
+@dataclass
+class Section:
+    key: str
+    title: str
+    text: Optional[str] = None
+    items: Optional[List[str]] = None
+    rows: Optional[List[Tuple[str, ...]]] = None
+    value: Any = None  # what the JSON report stores under ``key``
+
+
+@dataclass
+class Report:
+    markdown: str = ""
+    slack: List[Dict[str, Any]] = field(default_factory=list)  # message payloads
+    json: Dict[str, Any] = field(default_factory=dict)
+
+
+def _metric_row(name: str, s: Dict[str, Any]) -> Tuple[str, ...]:
+    return (
+        name,
+        f"{s['count']:,}",
+        f"{s['mean']:.4g}",
+        f"{s['p50']:.4g}",
+        f"{s['p95']:.4g}",
+        f"{s['p99']:.4g}",
+        f"{s['max']:.4g}",
+        f"{s['change']:+.1%}",
+        f"{s['outliers']:,}",
+    )
+
+
+# --- renderers: one section in, one chunk out --------------------------------------
+
+
+def render_markdown(section: Section) -> str:
+    if section.key == "header":
+        return f"\n# {section.title}\n{section.text}\n"
+    if section.key == "confidence":
+        return f"\n## {section.title}: {section.text}\n"
+    lines = [f"\n## {section.title}"]
+    if section.text is not None:
+        lines.append(section.text)
+    if section.items is not None:
+        lines.extend(f"{i}. {item}" for i, item in enumerate(section.items, 1))
+    if section.rows is not None:
+        lines.append("| " + " | ".join(METRIC_COLUMNS) + " |")
+        lines.append("|" + "---|" * len(METRIC_COLUMNS))
+        lines.extend("| " + " | ".join(row) + " |" for row in section.rows)
+    return "\n".join(lines) + "\n"
+
+
+def _escape(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _packed_blocks(lines: Iterable[str], heading: str, fence: bool = False) -> List[Dict[str, Any]]:
+    """``lines`` under ``heading``, greedily packed into mrkdwn blocks within Slack's limit."""
+    wrap = 8 if fence else 0  # two ``` fences and their newlines
+    blocks, current, size = [], [heading], len(heading)
+    for line in lines:
+        line = line[: MAX_BLOCK_CHARS - wrap - 1]
+        if size + 1 + len(line) + wrap > MAX_BLOCK_CHARS:
+            blocks.append(current)
+            current, size = [], -1
+        current.append(line)
+        size += 1 + len(line)
+    blocks.append(current)
+
+    def text(chunk: List[str]) -> str:
+        if not fence:
+            return "\n".join(chunk)
+        head = [chunk[0]] if chunk and chunk[0] == heading else []
+        body = chunk[len(head) :]
+        return "\n".join(head + ["```" + "\n".join(body) + "```"]) if body else "\n".join(head)
+
+    return [{"type": "section", "text": {"type": "mrkdwn", "text": text(c)}} for c in blocks if c]
+
+
+def render_slack(section: Section) -> List[Dict[str, Any]]:
+    if section.key == "header":
+        return [
+            {"type": "header", "text": {"type": "plain_text", "text": section.title[:150]}},
+            {"type": "context", "elements": [{"type": "mrkdwn", "text": _escape(section.text)}]},
+        ]
+    heading = f"*{_escape(section.title)}*"
+    if section.key == "confidence":
+        return [
+            {
+                "type": "context",
+                "elements": [{"type": "mrkdwn", "text": f"{heading}: {section.text}"}],
+            }
+        ]
+    if section.items is not None:
+        return _packed_blocks(
+            (f"{i}. {_escape(item)}" for i, item in enumerate(section.items, 1)), heading
+        )
+    if section.rows is not None:
+        widths = [
+            max(len(METRIC_COLUMNS[c]), *(len(r[c]) for r in section.rows))
+            for c in range(len(METRIC_COLUMNS))
+        ]
+        table = (
+            " ".join(cell.ljust(w) for cell, w in zip(row, widths))
+            for row in [METRIC_COLUMNS, *section.rows]
+        )
+        return _packed_blocks(table, heading, fence=True)
+    return _packed_blocks(_escape(section.text or "").split("\n"), heading)
+
+
+def render_json(section: Section) -> Tuple[str, Any]:
+    return section.key, section.value
+
+
+RENDERERS: Dict[str, Callable[[Section], Any]] = {
+    "markdown": render_markdown,
+    "slack": render_slack,
+    "json": render_json,
+}
+
+
+def slack_messages(
+    blocks: Sequence[Dict[str, Any]],
+    fallback: str = TITLE,
+    channel: Optional[str] = None,
+    max_blocks: int = MAX_BLOCKS,
+) -> List[Dict[str, Any]]:
+    messages = []
+    for start in range(0, len(blocks), max_blocks):
+        payload = {"text": fallback, "blocks": list(blocks[start : start + max_blocks])}
+        if channel:
+            payload["channel"] = channel
+        messages.append(payload)
+    return messages
+
+
+class SlackStream:
+    """Slack sink: posts a message whenever ``max_blocks`` blocks are waiting.
+
+    ``post`` sends one payload, e.g. the M3 reporter's ``SlackClient.post``.
+    """
+
+    def __init__(
+        self,
+        post: Callable[[Dict[str, Any]], Any],
+        channel: Optional[str] = None,
+        fallback: str = TITLE,
+        max_blocks: int = MAX_BLOCKS,
+    ):
+        self.post = post
+        self.channel = channel
+        self.fallback = fallback
+        self.max_blocks = max_blocks
+        self.pending: List[Dict[str, Any]] = []
+        self.sent = 0
+
+    def write(self, blocks: List[Dict[str, Any]]) -> None:
+        self.pending.extend(blocks)
+        while len(self.pending) >= self.max_blocks:
+            self._send(self.pending[: self.max_blocks])
+            self.pending = self.pending[self.max_blocks :]
+
+    def _send(self, blocks: List[Dict[str, Any]]) -> None:
+        (payload,) = slack_messages(blocks, self.fallback, self.channel, self.max_blocks)
+        self.post(payload)
+        self.sent += 1
+
+    def close(self) -> None:
+        if self.pending:
+            self._send(self.pending)
+            self.pending = []
+
+    def __enter__(self) -> "SlackStream":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class ReportBuilder:
+    """Builds one report from an analysis dict in every format, in a single pass."""
+
+    def __init__(
+        self, analysis: Dict[str, Any], title: str = TITLE, generated: Optional[datetime] = None
+    ):
+        self.analysis = analysis
+        self.title = title
+        self.generated = generated or datetime.now()
+
+    def sections(self) -> Iterator[Section]:
+        a = self.analysis
+        stamp = self.generated.strftime("%Y-%m-%d %H:%M:%S")
+        yield Section(
+            "header",
+            self.title,
+            text=f"Generated: {stamp}",
+            value={"title": self.title, "generated": self.generated.isoformat()},
+        )
+        summary = a.get("summary", "No summary available")
+        yield Section("summary", "Executive Summary", text=summary, value=summary)
+        trends = list(a.get("trends", []))
+        yield Section("findings", "Key Findings", items=trends, value=trends)
+        statistics = a.get("statistics") or {}
+        if statistics:
+            yield Section(
+                "metrics",
+                "Metrics",
+                rows=[_metric_row(n, s) for n, s in statistics.items()],
+                value=statistics,
+            )
+        recommendations = list(a.get("recommendations", []))
+        yield Section(
+            "recommendations", "Recommendations", items=recommendations, value=recommendations
+        )
+        confidence = a.get("confidence", "N/A")
+        yield Section("confidence", "Confidence Level", text=str(confidence), value=confidence)
+
+    def stream(self, formats: Sequence[str] = FORMATS) -> Iterator[Dict[str, Any]]:
+        """Each section rendered to every format in ``formats``, as soon as it is built."""
+        renderers = [(fmt, RENDERERS[fmt]) for fmt in formats]
+        for section in self.sections():
+            yield {fmt: render(section) for fmt, render in renderers}
+
+    def iter_markdown(self) -> Iterator[str]:
+        """Markdown chunks, e.g. for a streaming HTTP response."""
+        for chunk in self.stream(("markdown",)):
+            yield chunk["markdown"]
+
+    def iter_json(self) -> Iterator[str]:
+        """One JSON object, written key by key."""
+        yield "{"
+        for i, chunk in enumerate(self.stream(("json",))):
+            key, value = chunk["json"]
+            yield f"{', ' if i else ''}{json.dumps(key)}: {json.dumps(value, default=str)}"
+        yield "}"
+
+    def build(
+        self,
+        formats: Sequence[str] = FORMATS,
+        sinks: Optional[Dict[str, Callable[[Any], Any]]] = None,
+    ) -> Report:
+        """Render every format in one pass; ``sinks[fmt]`` gets each chunk as it is produced."""
+        sinks = sinks or {}
+        markdown: List[str] = []
+        blocks: List[Dict[str, Any]] = []
+        report = Report()
+        for chunk in self.stream(formats):
+            for fmt, rendered in chunk.items():
+                if fmt in sinks:
+                    sinks[fmt](rendered)
+            if "markdown" in chunk:
+                markdown.append(chunk["markdown"])
+            if "slack" in chunk:
+                blocks.extend(chunk["slack"])
+            if "json" in chunk:
+                key, value = chunk["json"]
+                report.json[key] = value
+        report.markdown = "".join(markdown)
+        report.slack = slack_messages(blocks, self.title)
+        return report
@@ -0,0 +1,170 @@
+"""Small DAG workflow engine for the agent crew.
+
+Each ``Step`` names the steps it depends on. A step starts as soon as all of
+its dependencies have finished, runs in a worker thread (the agents are
+synchronous), and gets ``{dep name: result}`` as its only argument. Wall time
+is therefore the critical path, not the sum of all steps.
+
+A step that fails, times out or is cancelled causes its dependents to be
+skipped; independent branches keep going. Every step leaves a ``StepTrace``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_WORKERS = 4
+
+
+@dataclass
+class Step:
+    name: str
+    fn: Callable[[Dict[str, Any]], Any]
+    deps: tuple = ()
+    timeout: Optional[float] = None
+
+
+@dataclass
+class StepTrace:
+    name: str
+    status: str = "pending"  # running | ok | error | timeout | cancelled | skipped
+    start: float = 0.0  # seconds since the workflow started
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {**asdict(self), "start": round(self.start, 4), "seconds": round(self.seconds, 4)}
+
+
+@dataclass
+class WorkflowRun:
+    results: Dict[str, Any] = field(default_factory=dict)
+    trace: Dict[str, StepTrace] = field(default_factory=dict)
+    wall_seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return all(t.status == "ok" for t in self.trace.values())
+
+    def failed(self) -> List[StepTrace]:
+        return [t for t in self.trace.values() if t.status in ("error", "timeout", "cancelled")]
+
+    def timeline(self) -> List[Dict[str, Any]]:
+        return [t.as_dict() for t in sorted(self.trace.values(), key=lambda t: t.start)]
+
+
+class Workflow:
+    """A validated DAG of steps, runnable any number of times."""
+
+    def __init__(self, steps: Iterable[Step], max_workers: int = MAX_WORKERS):
+        self.steps = {step.name: step for step in steps}
+        self.max_workers = max_workers
+        self._cancelled = threading.Event()
+        for step in self.steps.values():
+            missing = [d for d in step.deps if d not in self.steps]
+            if missing:
+                raise ValueError(f"Step {step.name!r} depends on unknown steps {missing}")
+        self.order = self._topological_order()
+
+    def _topological_order(self) -> List[str]:
+        order: List[str] = []
+        state: Dict[str, str] = {}
+
+        def visit(name: str, path: tuple) -> None:
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"Workflow has a cycle: {' -> '.join(path + (name,))}")
+            state[name] = "visiting"
+            for dep in self.steps[name].deps:
+                visit(dep, path + (name,))
+            state[name] = "done"
+            order.append(name)
+
+        for name in self.steps:
+            visit(name, ())
+        return order
+
+    def cancel(self) -> None:
+        """Stop a run from another thread: running steps are abandoned, pending ones skipped."""
+        self._cancelled.set()
+
+    async def run(self, timeout: Optional[float] = None) -> WorkflowRun:
+        self._cancelled.clear()
+        run = WorkflowRun(trace={name: StepTrace(name) for name in self.order})
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        # Own executor so an abandoned step does not block asyncio.run() on exit.
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="crew-step")
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def execute(step: Step) -> None:
+            trace = run.trace[step.name]
+            await asyncio.gather(*(tasks[d] for d in step.deps), return_exceptions=True)
+            blocked = [d for d in step.deps if run.trace[d].status != "ok"]
+            if blocked or self._cancelled.is_set():
+                trace.status = "skipped" if blocked else "cancelled"
+                trace.error = (
+                    f"blocked by {', '.join(blocked)}" if blocked else "workflow cancelled"
+                )
+                return
+            inputs = {d: run.results[d] for d in step.deps}
+            trace.start = time.perf_counter() - started
+            trace.status = "running"
+            try:
+                future = loop.run_in_executor(executor, step.fn, inputs)
+                run.results[step.name] = await asyncio.wait_for(future, step.timeout)
+                trace.status = "ok"
+            except asyncio.TimeoutError:
+                # The worker thread cannot be killed; its result is dropped.
+                trace.status, trace.error = "timeout", f"exceeded {step.timeout:.1f}s"
+            except asyncio.CancelledError:
+                trace.status, trace.error = "cancelled", "workflow cancelled"
+                raise
+            except Exception as e:
+                trace.status, trace.error = "error", str(e)
+            finally:
+                trace.seconds = time.perf_counter() - started - trace.start
+            logger.debug(f"Step {step.name}: {trace.status} in {trace.seconds:.3f}s")
+
+        async def watch_cancel() -> None:
+            while not self._cancelled.is_set():
+                await asyncio.sleep(0.01)
+            for task in tasks.values():
+                task.cancel()
+
+        for name in self.order:
+            tasks[name] = asyncio.create_task(execute(self.steps[name]))
+        watcher = asyncio.create_task(watch_cancel())
+        try:
+            _, pending = await asyncio.wait(tasks.values(), timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+        finally:
+            watcher.cancel()
+            for task in tasks.values():
+                task.cancel()  # no-op unless run() itself was cancelled
+            executor.shutdown(wait=False, cancel_futures=True)
+            for trace in run.trace.values():
+                if trace.status in ("pending", "running"):
+                    trace.status, trace.error = "cancelled", "workflow cancelled"
+        run.wall_seconds = time.perf_counter() - started
+        return run
+
+    def run_sync(self, timeout: Optional[float] = None) -> WorkflowRun:
+        """``run`` for synchronous callers, including ones already inside an event loop."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.run(timeout))
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            return pool.submit(asyncio.run, self.run(timeout)).result()
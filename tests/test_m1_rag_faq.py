@@ -12,26 +12,27 @@ from rag_demo import ingest_docs, load_vectordb, single_query
 class TestRAGDemo:
     def test_ingest_docs_mock(self):
         """Test document ingestion with mocked components."""
-        with patch('rag_demo.TextLoader') as mock_loader, \
-             patch('rag_demo.RecursiveCharacterTextSplitter') as mock_splitter, \
-             patch('rag_demo.Chroma') as mock_chroma, \
-             patch('rag_demo.OpenAIEmbeddings'):
-            
+        with patch("rag_demo.TextLoader") as mock_loader, patch(
+            "rag_demo.RecursiveCharacterTextSplitter"
+        ) as mock_splitter, patch("rag_demo.Chroma") as mock_chroma, patch(
+            "rag_demo.OpenAIEmbeddings"
+        ):
+
             # Mock the loader
             mock_doc = MagicMock()
             mock_loader.return_value.load.return_value = [mock_doc]
-            
+
             # Mock the splitter
             mock_chunks = [MagicMock(), MagicMock()]
             mock_splitter.return_value.split_documents.return_value = mock_chunks
-            
+
             # Mock Chroma
             mock_vectordb = MagicMock()
             mock_chroma.from_documents.return_value = mock_vectordb
-            
+
             # Test function
             result = ingest_docs(Path("test.md"))
-            
+
             # Assertions
             mock_loader.assert_called_once_with("test.md", encoding="utf-8")
             mock_splitter.assert_called_once_with(chunk_size=1_000, chunk_overlap=200)
@@ -40,55 +41,251 @@ class TestRAGDemo:
 
     def test_load_vectordb_mock(self):
         """Test loading existing vector database."""
-        with patch('rag_demo.Chroma') as mock_chroma, \
-             patch('rag_demo.OpenAIEmbeddings'):
-            
+        with patch("rag_demo.Chroma") as mock_chroma, patch("rag_demo.OpenAIEmbeddings"):
+
             mock_vectordb = MagicMock()
             mock_chroma.return_value = mock_vectordb
-            
+
             result = load_vectordb()
-            
+
             mock_chroma.assert_called_once()
             assert result == mock_vectordb
 
     def test_single_query_mock(self):
         """Test single query execution."""
-        with patch('rag_demo.ConversationalRetrievalChain') as mock_chain:
+        with patch("rag_demo.ConversationalRetrievalChain") as mock_chain:
             mock_vectordb = MagicMock()
             mock_chain_instance = MagicMock()
             mock_chain.from_llm.return_value = mock_chain_instance
             mock_chain_instance.invoke.return_value = {"answer": "Test response"}
-            
+
             result = single_query("test query", mock_vectordb)
-            
+
             mock_chain.from_llm.assert_called_once()
-            mock_chain_instance.invoke.assert_called_once_with({
-                "question": "test query",
-                "chat_history": []
-            })
+            mock_chain_instance.invoke.assert_called_once_with(
+                {"question": "test query", "chat_history": []}
+            )
             assert result == "Test response"
 
     def test_single_query_with_history(self):
         """Test single query with chat history."""
-        with patch('rag_demo.ConversationalRetrievalChain') as mock_chain:
+        with patch("rag_demo.ConversationalRetrievalChain") as mock_chain:
             mock_vectordb = MagicMock()
             mock_chain_instance = MagicMock()
             mock_chain.from_llm.return_value = mock_chain_instance
             mock_chain_instance.invoke.return_value = {"answer": "Test response"}
-            
+
             history = [("prev q", "prev a")]
             result = single_query("test query", mock_vectordb, history)
-            
-            mock_chain_instance.invoke.assert_called_once_with({
-                "question": "test query",
-                "chat_history": history
-            })
+
+            mock_chain_instance.invoke.assert_called_once_with(
+                {"question": "test query", "chat_history": history}
+            )
             assert result == "Test response"
 
     def test_file_paths(self):
         """Test file path handling."""
         from rag_demo import COLLECTION, DEFAULT_SOURCE, PERSIST_DIR
-        
+
         assert DEFAULT_SOURCE == Path("data/faq.md")
         assert PERSIST_DIR == "vector_store"
-        assert COLLECTION == "company_faq_demo" 
\ No newline at end of file
+        assert COLLECTION == "company_faq_demo"
+
+
+class TestRewriteSkipping:
+    def test_first_turn_never_rewrites(self):
+        """No history means there is nothing to condense."""
+        from rag_chain import needs_rewrite
+
+        assert needs_rewrite("What products does the company build?", []) is False
+        assert needs_rewrite("Pricing?", None) is False
+
+    def test_follow_up_questions_rewrite(self):
+        """Pronouns, conjunction openers and short questions need the history."""
+        from rag_chain import needs_rewrite
+
+        history = [("Where is the head office?", "In Gibraltar.")]
+        assert needs_rewrite("How many people work there in it?", history) is True
+        assert needs_rewrite("And what about the London team?", history) is True
+        assert needs_rewrite("Opening hours?", history) is True
+
+    def test_standalone_question_skips_rewrite(self):
+        """A self-contained question is sent without chat history."""
+        from rag_chain import RewriteStats, invoke_chain
+
+        chain = MagicMock()
+        chain.invoke.return_value = {"answer": "ok"}
+        stats = RewriteStats()
+        history = [("Where is the head office?", "In Gibraltar.")]
+
+        invoke_chain(chain, "What benefits do new employees receive?", history, stats)
+        invoke_chain(chain, "Does it include dental?", history, stats)
+
+        first, second = chain.invoke.call_args_list
+        assert first.args[0]["chat_history"] == []
+        assert second.args[0]["chat_history"] == history
+        assert stats.as_dict() == {"total": 2, "skipped": 1, "skip_rate": 0.5}
+
+
+class _FakeEmbeddings:
+    """Deterministic embedder that records each batch it is asked to embed."""
+
+    def __init__(self):
+        self.batches = []
+
+    async def aembed_documents(self, texts):
+        self.batches.append(list(texts))
+        return [[float(len(t)), 1.0] for t in texts]
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+
+class _FakeVectorStore:
+    """Minimal vector store exposing the by-vector search used by AsyncRAG."""
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.searches = 0
+
+    def similarity_search_by_vector(self, vector, k=4):
+        from langchain.schema import Document
+
+        self.searches += 1
+        return [Document(page_content=f"chunk {i}") for i in range(k)]
+
+
+class TestAsyncRAG:
+    def test_abatch_embeds_once_and_answers_all(self):
+        """All questions share one embedding call; every question gets an answer."""
+        import asyncio
+
+        from langchain_core.language_models import FakeListChatModel
+        from rag_chain import AsyncRAG
+
+        embeddings = _FakeEmbeddings()
+        store = _FakeVectorStore(embeddings)
+        llm = FakeListChatModel(responses=["answer"])
+        rag = AsyncRAG(store, llm, k=2, max_concurrency=2)
+        questions = [f"question {i}" for i in range(5)]
+
+        answers = asyncio.run(rag.abatch(questions))
+
+        assert embeddings.batches == [questions]
+        assert store.searches == 5
+        assert answers == ["answer"] * 5
+
+    def test_abatch_isolates_retrieval_failures(self):
+        """A failed vector search turns into an error for its question only."""
+        import asyncio
+
+        from langchain_core.language_models import FakeListChatModel
+        from rag_chain import AsyncRAG
+
+        class FlakyStore(_FakeVectorStore):
+            def similarity_search_by_vector(self, vector, k=4):
+                if vector[0] == len("broken question"):
+                    raise ConnectionError("index unavailable")
+                return super().similarity_search_by_vector(vector, k)
+
+        rag = AsyncRAG(FlakyStore(_FakeEmbeddings()), FakeListChatModel(responses=["answer"]))
+
+        answers = asyncio.run(rag.abatch(["q1", "broken question", "q3"]))
+
+        assert answers == ["answer", "Error: index unavailable", "answer"]
+
+    def test_answer_questions_file_writes_jsonl(self, tmp_path):
+        """The --questions-file mode writes one JSON line per non-empty question."""
+        import json
+
+        from langchain_core.language_models import FakeListChatModel
+        from rag_chain import answer_questions_file
+
+        questions = tmp_path / "questions.txt"
+        questions.write_text("Where is the office?\n\nWhat are the hours?\n")
+        output = tmp_path / "answers.jsonl"
+        store = _FakeVectorStore(_FakeEmbeddings())
+
+        count = answer_questions_file(questions, store, FakeListChatModel(responses=["ok"]), output)
+
+        rows = [json.loads(line) for line in output.read_text().splitlines()]
+        assert count == 2
+        assert [r["question"] for r in rows] == ["Where is the office?", "What are the hours?"]
+        assert all(r["answer"] == "ok" for r in rows)
+
+
+class TestStreaming:
+    def test_stream_answer_reports_sources_before_tokens(self):
+        """Sources are emitted right after retrieval, then tokens as they arrive."""
+        from langchain.schema import Document
+        from langchain_core.language_models import FakeListChatModel
+        from rag_chain import RewriteStats, stream_answer
+
+        retriever = MagicMock()
+        retriever.invoke.return_value = [Document(page_content="Office hours are 9-5.")]
+        llm = FakeListChatModel(responses=["9 to 5"])
+        events = []
+
+        result = stream_answer(
+            "What are the office hours?",
+            [],
+            retriever,
+            llm,
+            on_sources=lambda docs: events.append(("sources", len(docs))),
+            on_token=lambda tok: events.append(("token", tok)),
+            stats=RewriteStats(),
+        )
+
+        assert events[0] == ("sources", 1)
+        assert "".join(tok for kind, tok in events[1:]) == "9 to 5"
+        assert len(events) > 2  # streamed in more than one chunk
+        assert result.answer == "9 to 5"
+        assert result.ttft is not None and result.ttft >= 0
+        retriever.invoke.assert_called_once_with("What are the office hours?")
+
+
+class TestBoundedChatHistory:
+    def test_history_stays_within_budget(self):
+        """Prompt history size stays flat however long the session gets."""
+        from chat_history import BoundedChatHistory, approx_tokens
+
+        history = BoundedChatHistory(max_tokens=200, keep_recent=2)
+        for i in range(500):
+            history.append(f"Question number {i} about holidays?", "An answer " * 10)
+
+        sent = history.for_question("How many holidays do I get?")
+        assert sum(approx_tokens(q) + approx_tokens(a) for q, a in sent) <= 200
+        assert sent[-1][0] == "Question number 499 about holidays?"
+
+    def test_irrelevant_old_turns_are_dropped(self):
+        """Older turns without shared keywords are left out; recent ones always stay."""
+        from chat_history import BoundedChatHistory
+
+        history = BoundedChatHistory(max_tokens=10_000, keep_recent=1)
+        history.append("What is the parking policy?", "Parking is free for staff.")
+        history.append("Where is the canteen?", "On the second floor.")
+        history.append("Does the office have showers?", "Yes, next to the gym.")
+
+        sent = history.for_question("Can visitors use the parking too?")
+
+        assert [q for q, _ in sent] == [
+            "What is the parking policy?",
+            "Does the office have showers?",
+        ]
+
+    def test_evicted_turns_are_summarised_in_background(self):
+        """Evicted turns are folded into a summary that leads the history."""
+        from chat_history import SUMMARY_LABEL, BoundedChatHistory
+        from langchain_core.language_models import FakeListChatModel
+
+        llm = FakeListChatModel(responses=["User asked about parking and canteen."])
+        history = BoundedChatHistory(llm, max_tokens=20, keep_recent=1)
+        history.append("What is the parking policy?", "Parking is free for staff.")
+        history.append("Where is the canteen?", "On the second floor.")
+        history.flush(timeout=5)
+
+        sent = history.for_question("Anything else?")
+        history.close()
+
+        assert sent[0] == (SUMMARY_LABEL, "User asked about parking and canteen.")
+        assert sent[-1][0] == "Where is the canteen?"
@@ -10,125 +10,203 @@ sys.path.insert(0, str(Path(__file__).parent.parent / "modules" / "m3-auto-repor
 from reporter import build_prompt, fetch_events, generate_summary, main, send_to_slack
 
 
+class StubWebhook:
+    """Local HTTP server standing in for a Slack webhook.
+
+    ``responses`` is a list of (status, headers) served in order before falling
+    back to 200; every JSON body received is recorded in ``received``, and the
+    most requests ever handled at once in ``peak_in_flight``.
+    """
+
+    def __init__(self, responses=(), delay=0.0):
+        import threading
+
+        self.responses = list(responses)
+        self.delay = delay
+        self.received = []
+        self.connections = set()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        import json
+        import threading
+        import time
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with stub.lock:
+                    stub.in_flight += 1
+                    stub.peak_in_flight = max(stub.peak_in_flight, stub.in_flight)
+                time.sleep(stub.delay)
+                with stub.lock:
+                    stub.in_flight -= 1
+                    stub.connections.add(self.client_address)
+                    status, headers = stub.responses.pop(0) if stub.responses else (200, {})
+                    if status == 200:
+                        stub.received.append(body)
+                reply = b"ok" if status == 200 else b"error"
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(reply)))
+                self.end_headers()
+                self.wfile.write(reply)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/hook"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
 class TestAutoReporter:
     def test_fetch_events_csv_mode(self):
         """Test fetching events from CSV file."""
-        with patch('reporter.os.getenv') as mock_getenv, \
-             patch('reporter.pd.read_csv') as mock_read_csv:
-            
+        with patch("reporter.os.getenv") as mock_getenv, patch(
+            "reporter.pd.read_csv"
+        ) as mock_read_csv:
+
             # Setup mocks
             mock_getenv.side_effect = lambda key: None if key == "USE_BIGQUERY" else "test.csv"
-            mock_df = pd.DataFrame({
-                'user_id': [1, 2, 3],
-                'event_name': ['login', 'purchase', 'logout'],
-                'created_at': ['2023-01-01', '2023-01-02', '2023-01-03']
-            })
+            mock_df = pd.DataFrame(
+                {
+                    "user_id": [1, 2, 3],
+                    "event_name": ["login", "purchase", "logout"],
+                    "created_at": ["2023-01-01", "2023-01-02", "2023-01-03"],
+                }
+            )
             mock_read_csv.return_value = mock_df
-            
+
             result = fetch_events()
-            
+
             mock_read_csv.assert_called_once_with("test.csv")
             assert result.equals(mock_df)
 
-    @patch('reporter.os.getenv')
-    @patch('reporter.bigquery')
+    @patch("reporter.os.getenv")
+    @patch("reporter.bigquery")
     def test_fetch_events_bigquery_mode(self, mock_bigquery, mock_getenv):
         """Test fetching events from BigQuery."""
         # Setup environment variables
         mock_getenv.side_effect = lambda key: {
             "USE_BIGQUERY": "true",
-            "VERTEX_PROJECT": "test-project"
+            "VERTEX_PROJECT": "test-project",
         }.get(key)
-        
+
         # Mock BigQuery client
         mock_client = MagicMock()
         mock_bigquery.Client.return_value = mock_client
-        
-        mock_df = pd.DataFrame({
-            'user_id': [1, 2],
-            'event_name': ['login', 'purchase'],
-            'created_at': ['2023-01-01', '2023-01-02']
-        })
+
+        mock_df = pd.DataFrame(
+            {
+                "user_id": [1, 2],
+                "event_name": ["login", "purchase"],
+                "created_at": ["2023-01-01", "2023-01-02"],
+            }
+        )
         mock_client.query.return_value.to_dataframe.return_value = mock_df
-        
+
         result = fetch_events()
-        
+
         mock_bigquery.Client.assert_called_once_with(project="test-project")
         mock_client.query.assert_called_once()
         assert result.equals(mock_df)
 
-    def test_build_prompt(self):
+    def test_build_prompt(self, tmp_path):
         """Test building prompt from DataFrame."""
+        from templates import PromptTemplates
+
         # Create test DataFrame
-        df = pd.DataFrame({
-            'user_id': [1, 2, 3],
-            'event_name': ['login', 'purchase', 'logout'],
-            'created_at': ['2023-01-01', '2023-01-02', '2023-01-03']
-        })
-        
-        # Mock the template file
-        with patch('reporter.Path') as mock_path:
-            mock_template = "Events found: {n}\n\nData:\n{table}"
-            mock_path_chain = mock_path.return_value.with_name.return_value.joinpath.return_value
-            mock_path_chain.read_text.return_value = mock_template
-            
+        df = pd.DataFrame(
+            {
+                "user_id": [1, 2, 3],
+                "event_name": ["login", "purchase", "logout"],
+                "created_at": ["2023-01-01", "2023-01-02", "2023-01-03"],
+            }
+        )
+
+        # Jinja template in a temporary template root
+        (tmp_path / "prompts").mkdir()
+        (tmp_path / "prompts" / "daily_summary.jinja").write_text(
+            "Events found: {{ n }}\n\nData:\n{% for line in table %}\n{{ line }}\n{% endfor %}"
+        )
+        with patch("reporter.TEMPLATES", PromptTemplates(tmp_path)):
             result = build_prompt(df)
-            
+
             assert "Events found: 3" in result
             assert "user_id" in result
             assert "event_name" in result
             assert "created_at" in result
 
-    @patch('reporter.MODEL')
-    def test_generate_summary(self, mock_model):
+    def test_generate_summary(self, tmp_path):
         """Test generating summary from prompt."""
+        from summarizer import SummaryEngine
+
+        mock_model = MagicMock()
         mock_chat = MagicMock()
         mock_model.start_chat.return_value = mock_chat
         mock_chat.send_message.return_value.text = "  Summary response  "
-        
-        result = generate_summary("Test prompt")
-        
+        engine = SummaryEngine(cache_dir=tmp_path, model_factory=lambda name: mock_model)
+
+        with patch("reporter.SUMMARIES", engine):
+            result = generate_summary("Test prompt")
+
         mock_model.start_chat.assert_called_once()
         mock_chat.send_message.assert_called_once_with("Test prompt")
         assert result == "Summary response"
 
-    @patch('reporter.SLACK_URL', 'https://hooks.slack.com/test')
-    @patch('reporter.requests.post')
-    def test_send_to_slack_with_webhook(self, mock_post):
+    def test_send_to_slack_with_webhook(self):
         """Test sending to Slack with webhook URL."""
-        mock_response = MagicMock()
-        mock_post.return_value = mock_response
-        
-        send_to_slack("Test message")
-        
-        mock_post.assert_called_once_with(
-            'https://hooks.slack.com/test',
-            json={"text": "Test message"}
-        )
-        mock_response.raise_for_status.assert_called_once()
+        with StubWebhook() as hook, patch("reporter.SLACK_URL", hook.url):
+            send_to_slack("Test message")
 
-    @patch('reporter.SLACK_URL', None)
-    @patch('builtins.print')
+        assert len(hook.received) == 1
+        assert hook.received[0]["text"] == "Test message"
+        assert hook.received[0]["blocks"][0]["text"]["text"] == "Test message"
+
+    @patch("reporter.SLACK_URL", None)
+    @patch("builtins.print")
     def test_send_to_slack_no_webhook(self, mock_print):
         """Test sending to Slack without webhook URL (prints instead)."""
         send_to_slack("Test message")
-        
+
         mock_print.assert_called_with("=== SUMMARY ===\n", "Test message")
 
-    @patch('reporter.fetch_events')
-    @patch('reporter.build_prompt')
-    @patch('reporter.generate_summary')
-    @patch('reporter.send_to_slack')
-    def test_main_function(self, mock_send_slack, mock_generate, mock_build, mock_fetch):
+    @patch("reporter.fetch_events")
+    @patch("reporter.build_prompt")
+    @patch("reporter.summarize_prompt")
+    @patch("reporter.send_to_slack")
+    def test_main_function(
+        self, mock_send_slack, mock_generate, mock_build, mock_fetch, tmp_path, monkeypatch
+    ):
         """Test the main function integration."""
+        from summarizer import Summary
+
+        # The ledger and run metadata go under reports/; keep them out of the checkout.
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr("reporter.LEDGER_DB", tmp_path / "reports" / "ledger.db")
+
         # Setup mocks
-        mock_df = pd.DataFrame({'test': [1, 2, 3]})
+        mock_df = pd.DataFrame({"test": [1, 2, 3]})
         mock_fetch.return_value = mock_df
         mock_build.return_value = "Test prompt"
-        mock_generate.return_value = "Test summary"
-        
+        mock_generate.return_value = Summary("Test summary", None)
+
         main()
-        
+
         # Verify call chain
         mock_fetch.assert_called_once()
         mock_build.assert_called_once_with(mock_df)
@@ -137,21 +215,1055 @@ class TestAutoReporter:
 
     def test_environment_variables(self):
         """Test environment variable usage."""
-        with patch('reporter.os.getenv') as mock_getenv:
+        with patch("reporter.os.getenv") as mock_getenv:
             mock_getenv.side_effect = lambda key, default=None: {
                 "VERTEX_PROJECT": "test-project",
-                "VERTEX_LOCATION": "us-central1", 
+                "VERTEX_LOCATION": "us-central1",
                 "SLACK_WEBHOOK": "https://hooks.slack.com/test",
-                "CSV_PATH": "test.csv"
+                "CSV_PATH": "test.csv",
             }.get(key, default)
-            
+
             # Re-import to get updated environment variables
             import importlib
 
             import reporter
+
             importlib.reload(reporter)
-            
+
             assert reporter.PROJECT == "test-project"
             assert reporter.LOCATION == "us-central1"
             assert reporter.SLACK_URL == "https://hooks.slack.com/test"
-            assert reporter.LOCAL_CSV == "test.csv" 
\ No newline at end of file
+            assert reporter.LOCAL_CSV == "test.csv"
+
+
+class TestStreamingIngestion:
+    def _events(self):
+        return pd.DataFrame(
+            {
+                "user_id": [1, 2, 3, 1, 2, 4, 5],
+                "event_name": [
+                    "login",
+                    "purchase",
+                    "login",
+                    "logout",
+                    "login",
+                    "purchase",
+                    "login",
+                ],
+                "created_at": [
+                    "2023-01-01 08:00",
+                    "2023-01-01 09:00",
+                    "2023-01-01 10:00",
+                    "2023-01-01 11:00",
+                    "2023-01-01 12:00",
+                    "2023-01-01 13:00",
+                    "2023-01-01 14:00",
+                ],
+            }
+        )
+
+    def test_chunked_summary_matches_full_frame(self):
+        """Aggregating chunk by chunk gives the same answer as the whole frame."""
+        from ingest import summarize_events
+
+        df = self._events()
+        chunks = [df.iloc[i : i + 3] for i in range(0, len(df), 3)]
+
+        summary = summarize_events(chunks, sample_rows=4)
+
+        assert len(summary) == 7
+        counts = dict(zip(summary.by_event.event_name, summary.by_event.events))
+        assert counts == df.event_name.value_counts().to_dict()
+        login = summary.by_event.set_index("event_name").loc["login"]
+        assert login.first_seen == pd.Timestamp("2023-01-01 08:00")
+        assert login.last_seen == pd.Timestamp("2023-01-01 14:00")
+        assert summary.sample.equals(df.head(4))
+        assert summary.top_events(1).event_name.tolist() == ["login"]
+
+    def test_csv_is_read_in_chunks(self, tmp_path):
+        """The CSV reader yields bounded chunks that cover every row."""
+        from ingest import iter_csv_chunks
+
+        path = tmp_path / "events.csv"
+        self._events().to_csv(path, index=False)
+
+        chunks = list(iter_csv_chunks(str(path), chunk_rows=2))
+
+        assert sum(len(c) for c in chunks) == 7
+        assert all(len(c) <= 2 for c in chunks) or len(chunks) == 1  # pyarrow uses byte blocks
+
+    def test_unread_offset_chunks_hold_no_file(self, tmp_path):
+        """The file is only opened while the chunks are iterated."""
+        import ingest
+
+        path = tmp_path / "events.csv"
+        self._events().to_csv(path, index=False)
+        handles = []
+        real_open = open
+
+        def tracking_open(*args, **kwargs):
+            handles.append(real_open(*args, **kwargs))
+            return handles[-1]
+
+        with patch("builtins.open", tracking_open):
+            chunks, end = ingest.iter_csv_from(str(path), 0, chunk_rows=3)
+            assert all(f.closed for f in handles)
+            assert sum(len(c) for c in chunks) == 7
+        assert end == path.stat().st_size
+        assert all(f.closed for f in handles)
+
+    def test_build_prompt_from_summary(self):
+        """Streaming mode feeds per-event aggregates and the sample into the prompt."""
+        from ingest import summarize_events
+
+        summary = summarize_events([self._events()])
+        result = build_prompt(summary)
+
+        assert "We collected 7 events" in result
+        assert "purchase" in result
+        assert "Sample rows" in result
+
+
+class TestWarehouseAggregates:
+    def test_queries_are_parameterised(self):
+        """The day is a query parameter, so the SQL text is cacheable across runs."""
+        import datetime as dt
+
+        from aggregates import build_queries
+
+        day = dt.date(2024, 5, 1)
+        queries = build_queries(day, table="proj.ds.events")
+
+        assert {q.name for q in queries} == {
+            "counts_by_event",
+            "hourly",
+            "hourly_by_event",
+            "distinct_users",
+            "top_movers",
+        }
+        for query in queries:
+            assert "@day" in query.sql
+            assert "2024-05-01" not in query.sql
+            assert query.params[0].value == day
+        assert [q.sql for q in queries] == [
+            q.sql for q in build_queries(dt.date(2024, 5, 2), table="proj.ds.events")
+        ]
+
+    def test_table_name_is_validated(self):
+        """Identifiers that could inject SQL are rejected."""
+        import datetime as dt
+
+        import pytest
+        from aggregates import build_queries
+
+        with pytest.raises(ValueError):
+            build_queries(dt.date(2024, 5, 1), table="ds.events`; DROP TABLE x; --")
+
+    def test_fetch_aggregates_dry_runs_and_collects(self):
+        """Dry-run estimates are recorded and only small aggregate frames come back."""
+        import datetime as dt
+
+        from aggregates import fetch_aggregates
+
+        frames = {
+            "counts_by_event": pd.DataFrame(
+                {"event_name": ["login"], "events": [40], "users": [12]}
+            ),
+            "hourly": pd.DataFrame({"hour": [8], "events": [40]}),
+            "hourly_by_event": pd.DataFrame(
+                {
+                    "event_name": ["login"],
+                    "bucket": [pd.Timestamp("2024-05-01 08:00")],
+                    "events": [40],
+                }
+            ),
+            "distinct_users": pd.DataFrame({"users": [12]}),
+            "top_movers": pd.DataFrame(
+                {
+                    "event_name": ["login"],
+                    "today": [40],
+                    "previous_day": [30],
+                    "delta": [10],
+                    "pct_change": [0.33],
+                }
+            ),
+        }
+
+        names = iter(frames)  # real jobs are submitted in build_queries order
+
+        def query(sql, job_config):
+            job = MagicMock()
+            job.total_bytes_processed = 1_000
+            if not job_config.dry_run:
+                name = next(names)
+                job.cache_hit = name == "hourly"
+                job.result.return_value.to_dataframe.return_value = frames[name]
+            return job
+
+        client = MagicMock()
+        client.query.side_effect = query
+
+        result = fetch_aggregates(client, dt.date(2024, 5, 1), table="ds.events")
+
+        dry_runs = [c for c in client.query.call_args_list if c.kwargs["job_config"].dry_run]
+        assert len(dry_runs) == 5
+        assert sum(result.estimated_bytes.values()) == 5_000
+        assert len(result) == 40
+        assert result.distinct_users == 12
+        assert result.cache_hits == 1
+        assert "Top movers" in result.to_markdown()
+        assert result.hourly_by_event["events"].tolist() == [40]
+
+
+class TestScheduler:
+    def test_load_reports_expands_env(self, tmp_path, monkeypatch):
+        """Every [[report]] is loaded and ${VAR} placeholders are expanded."""
+        from scheduler import load_reports
+
+        monkeypatch.setenv("SLACK_WEBHOOK_URL", "https://hooks.slack.com/x")
+        monkeypatch.setenv("TEAM", "ops")
+        config = tmp_path / "config.toml"
+        config.write_text(
+            '[slack]\nwebhook_url = "${SLACK_WEBHOOK_URL}"\n\n'
+            '[[report]]\nname = "daily"\nchannel = "#${TEAM}"\nschedule = "0 8 * * *"\n\n'
+            '[[report]]\nname = "hourly"\nschedule = "*/15 * * * 1-5"\ntimeout = 30\n'
+        )
+
+        reports = load_reports(config)
+
+        assert [r.name for r in reports] == ["daily", "hourly"]
+        assert reports[0].channel == "#ops"
+        assert all(r.webhook == "https://hooks.slack.com/x" for r in reports)
+        assert reports[1].timeout == 30
+
+    def test_cron_schedule(self):
+        """Cron ranges, steps and weekdays resolve to the expected next run."""
+        import datetime as dt
+
+        from scheduler import cron_matches, next_run
+
+        friday_evening = dt.datetime(2024, 5, 3, 18, 7)  # a Friday
+        assert next_run("*/15 * * * 1-5", friday_evening) == dt.datetime(2024, 5, 3, 18, 15)
+        assert next_run("0 8 * * 1-5", friday_evening) == dt.datetime(2024, 5, 6, 8, 0)
+        assert next_run("30 6 1 * *", friday_evening) == dt.datetime(2024, 6, 1, 6, 30)
+        assert cron_matches("0 8 * * 0", dt.datetime(2024, 5, 5, 8, 0))  # Sunday
+        assert not cron_matches("0 8 * * 0", dt.datetime(2024, 5, 6, 8, 0))
+
+    def test_cron_step_from_a_start_value(self):
+        """ "5/15" is "from minute 5, every 15", as in standard cron."""
+        from scheduler import parse_cron
+
+        assert sorted(parse_cron("5/15 * * * *").minutes) == [5, 20, 35, 50]
+        assert sorted(parse_cron("0 1/6 * * *").hours) == [1, 7, 13, 19]
+        assert sorted(parse_cron("5 * * * *").minutes) == [5]
+
+    def test_reports_run_in_parallel_with_timeouts(self):
+        """Independent reports overlap; a slow one is cut off by its own timeout."""
+        import asyncio
+        import threading
+
+        from scheduler import ReportScheduler, ReportSpec
+
+        # Every query must be running at once to pass the barrier.
+        together, release = threading.Barrier(3, timeout=5), threading.Event()
+
+        def query(spec, value):
+            together.wait()
+            if spec.name == "stuck":
+                release.wait(5)
+            return spec.name
+
+        stages = {"query": query, "llm": lambda spec, value: value.upper()}
+        reports = [ReportSpec("a"), ReportSpec("b"), ReportSpec("stuck", timeout=0.3)]
+        scheduler = ReportScheduler(reports, stages=stages, max_parallel=3)
+
+        runs = asyncio.run(scheduler.run())
+        release.set()
+
+        assert [r.status for r in runs] == ["ok", "ok", "timeout"]
+        assert set(runs[0].timings) == {"query", "llm"}
+
+    def test_timed_out_stage_does_not_hold_a_slot(self):
+        """A stage still running after its report timed out does not delay the next report."""
+        import asyncio
+        import threading
+
+        from scheduler import ReportScheduler, ReportSpec
+
+        release = threading.Event()
+
+        def query(spec, value):
+            if spec.name == "stuck":
+                release.wait(10)
+            return spec.name
+
+        reports = [ReportSpec("stuck", timeout=0.1), ReportSpec("next", timeout=5)]
+        scheduler = ReportScheduler(reports, stages={"query": query}, max_parallel=1)
+
+        runs = asyncio.run(scheduler.run())
+        release.set()
+
+        assert [r.status for r in runs] == ["timeout", "ok"]
+
+    def test_timed_out_stage_stops_at_its_next_check(self):
+        """After a timeout the running stage is cancelled cooperatively and writes nothing."""
+        import asyncio
+        import threading
+
+        from scheduler import ReportScheduler, ReportSpec, StageCancelled, check_cancelled
+
+        written, stopped = [], threading.Event()
+
+        def slow_writer(spec, value):
+            try:
+                for i in range(100):
+                    threading.Event().wait(0.02)
+                    check_cancelled()
+                    written.append(i)
+            except StageCancelled:
+                stopped.set()
+                raise
+
+        scheduler = ReportScheduler(
+            [ReportSpec("slow", timeout=0.1)], stages={"query": slow_writer}
+        )
+        (run,) = asyncio.run(scheduler.run())
+
+        assert run.status == "timeout"
+        assert stopped.wait(2)
+        assert len(written) < 10
+
+    def test_dry_run_plan(self):
+        """The plan lists each report with its next run and timeout."""
+        import datetime as dt
+
+        from scheduler import ReportScheduler, ReportSpec
+
+        plan = ReportScheduler([ReportSpec("daily", channel="#ops")]).plan(
+            dt.datetime(2024, 5, 3, 9, 0)
+        )
+
+        assert "daily" in plan
+        assert "next 2024-05-04 08:00" in plan
+        assert "#ops" in plan
+
+
+class TestPromptTemplates:
+    def _root(self, tmp_path, body):
+        (tmp_path / "prompts").mkdir(exist_ok=True)
+        path = tmp_path / "prompts" / "t.jinja"
+        path.write_text(body)
+        return path
+
+    def test_bundled_template_renders_jinja(self):
+        """The shipped template's {{ n }} placeholder is actually substituted."""
+        from templates import PromptTemplates
+
+        df = pd.DataFrame({"event_name": ["login"], "events": [3]})
+        result = PromptTemplates().render(n=3, table=df)
+
+        assert "We collected 3 events" in result
+        assert "{{" not in result
+        assert "| event_name | events |" in result
+        assert "| login | 3 |" in result
+
+    def test_templates_are_cached_and_reloaded_on_change(self, tmp_path):
+        """Compiled once; recompiled only after the file's mtime changes."""
+        import os
+
+        from templates import PromptTemplates
+
+        path = self._root(tmp_path, "v1 {{ n }}")
+        templates = PromptTemplates(tmp_path)
+        assert templates.render("prompts/t.jinja", n=1) == "v1 1"
+        assert templates.env.get_template("prompts/t.jinja") is templates.env.get_template(
+            "prompts/t.jinja"
+        )
+
+        path.write_text("v2 {{ n }}")
+        stat = path.stat()
+        os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+
+        assert templates.render("prompts/t.jinja", n=1) == "v2 1"
+
+    def test_large_table_is_capped_to_token_budget(self, tmp_path):
+        """Rendering stops at the budget without formatting every row."""
+        from templates import TRUNCATION_NOTE, PromptTemplates, approx_tokens
+
+        self._root(tmp_path, "{% for line in table %}\n{{ line }}\n{% endfor %}")
+        formatted = []
+
+        def rows():
+            for i in range(100_000):
+                formatted.append(i)
+                yield f"| row {i} |"
+
+        result = PromptTemplates(tmp_path).render("prompts/t.jinja", max_tokens=50, table=rows())
+
+        assert result.endswith(TRUNCATION_NOTE)
+        assert approx_tokens(result) <= 50 + approx_tokens(TRUNCATION_NOTE)
+        assert len(formatted) < 100
+
+
+class TestStateStore:
+    def _events(self, stamps, names):
+        return pd.DataFrame(
+            {"user_id": range(len(stamps)), "event_name": names, "created_at": stamps}
+        )
+
+    def test_only_events_after_watermark_are_counted(self, tmp_path):
+        """A re-run over the same source adds nothing; new rows are folded in."""
+        from state_store import AggregateStore
+
+        store = AggregateStore(tmp_path / "state.db")
+        first = self._events(
+            ["2024-01-01 10:00", "2024-01-01 11:00", "2024-01-02 09:00"],
+            ["login", "login", "purchase"],
+        )
+        assert store.ingest([first]) == 3
+        assert store.ingest([first]) == 0
+        assert store.watermark() == pd.Timestamp("2024-01-02 09:00")
+
+        later = pd.concat([first, self._events(["2024-01-02 12:00"], ["purchase"])])
+        assert store.ingest([later.iloc[:2], later.iloc[2:]]) == 1
+
+        import datetime as dt
+
+        counts = store.day_counts(dt.date(2024, 1, 2))
+        assert counts.to_dict("records") == [{"event_name": "purchase", "events": 2}]
+        store.close()
+
+    def test_unsorted_and_tied_rows_across_chunks_are_counted(self, tmp_path):
+        """Rows out of order, or tied with an earlier chunk's maximum, are not dropped."""
+        import datetime as dt
+
+        from state_store import AggregateStore
+
+        store = AggregateStore(tmp_path / "state.db")
+        chunk1 = pd.DataFrame(
+            {
+                "user_id": [1, 2],
+                "event_name": ["a", "a"],
+                "created_at": ["2024-01-01 10:00", "2024-01-01 12:00"],
+            }
+        )
+        chunk2 = pd.DataFrame(
+            {
+                "user_id": [3, 4],
+                "event_name": ["a", "b"],
+                "created_at": ["2024-01-01 11:00", "2024-01-01 12:00"],
+            }
+        )
+        assert store.ingest([chunk1, chunk2]) == 4
+        assert store.watermark() == pd.Timestamp("2024-01-01 12:00")
+
+        # Next run re-reads the tie at the watermark plus one new row at it.
+        chunk3 = pd.DataFrame(
+            {
+                "user_id": [2, 4, 5],
+                "event_name": ["a", "b", "b"],
+                "created_at": ["2024-01-01 12:00"] * 3,
+            }
+        )
+        assert store.ingest([chunk3]) == 1
+        assert store.ingest([chunk1, chunk2, chunk3]) == 0
+
+        counts = store.day_counts(dt.date(2024, 1, 1)).set_index("event_name")["events"]
+        assert counts.to_dict() == {"a": 3, "b": 2}
+        store.close()
+
+    def test_csv_ingest_reads_only_appended_bytes(self, tmp_path):
+        """Each run resumes from the saved byte offset; a half-written line waits for the next run."""
+        from state_store import AggregateStore
+
+        csv = tmp_path / "events.csv"
+        csv.write_text("user_id,event_name,created_at\n1,login,2024-01-01 10:00\n")
+        store = AggregateStore(tmp_path / "state.db")
+        assert store.ingest_csv(csv) == 1
+        first_offset = store.offset()[1]
+        assert first_offset == csv.stat().st_size
+
+        with open(csv, "a") as f:
+            f.write("2,login,2024-01-01 11:00\n3,buy,2024-01-01 1")
+        assert store.ingest_csv(csv) == 1
+        assert store.offset()[1] == csv.read_bytes().rindex(b"\n") + 1
+
+        with open(csv, "a") as f:
+            f.write("2:00\n")
+        assert store.ingest_csv(csv) == 1
+        assert store.ingest_csv(csv) == 0
+        store.close()
+
+    def test_trends_use_stored_baselines(self, tmp_path):
+        """7/28-day averages come from the store, counting missing days as zero."""
+        import datetime as dt
+
+        from state_store import AggregateStore
+
+        store = AggregateStore(tmp_path / "state.db")
+        day = dt.date(2024, 2, 1)
+        stamps, names = [], []
+        for back in range(1, 8):  # one login per day for the previous week
+            stamps.append(f"{day - dt.timedelta(days=back)} 08:00")
+            names.append("login")
+        stamps += [f"{day} 08:00"] * 3
+        names += ["login"] * 3
+        store.ingest([self._events(stamps, names)])
+
+        trends = store.trends(day).set_index("event_name")
+        assert trends.loc["login", "today"] == 3
+        assert trends.loc["login", "avg_7d"] == 1.0
+        assert trends.loc["login", "avg_28d"] == 0.2
+        assert trends.loc["login", "pct_vs_7d"] == 2.0
+        store.close()
+
+    def test_build_prompt_includes_trends(self):
+        """Trends from the store are rendered into the bundled template."""
+        trends = pd.DataFrame({"event_name": ["login"], "today": [3], "avg_7d": [1.0]})
+        df = self._events(["2024-01-01"], ["login"])
+
+        assert "7- and 28-day" not in build_prompt(df)
+        prompt = build_prompt(df, trends=trends)
+        assert "7- and 28-day" in prompt
+        assert "| login | 3 | 1.0 |" in prompt
+
+
+class TestAnomalyDetection:
+    def test_spike_and_level_shift_are_flagged(self):
+        """Only the injected spike (event_00) and the tripled series (event_01) are flagged."""
+        from anomalies import find_anomalies
+        from bench_anomalies import synthetic_events
+
+        anomalies = find_anomalies(synthetic_events(200_000))
+
+        assert set(anomalies["event_name"]) == {"event_00", "event_01"}
+        top = anomalies.iloc[0]
+        assert (top["event_name"], top["kind"]) == ("event_00", "spike")
+        shifts = anomalies[anomalies["kind"] == "level shift up"]
+        assert list(shifts["event_name"]) == ["event_01"]
+
+    def test_daily_cycle_is_not_an_anomaly(self):
+        """A strong but regular daily peak matches its seasonal baseline."""
+        from anomalies import find_anomalies
+
+        hours = pd.date_range("2024-01-01", periods=14 * 24, freq="h")
+        counts = [200 if h.hour == 9 else 20 for h in hours]
+        events = pd.DataFrame(
+            {
+                "event_name": "login",
+                "created_at": hours.repeat(counts),
+            }
+        )
+
+        assert find_anomalies(events).empty
+
+    def test_warehouse_aggregates_are_scanned(self):
+        """The BigQuery path feeds its hourly series to the detector and reports the summarised day."""
+        import datetime as dt
+
+        from aggregates import WarehouseAggregates
+        from reporter import find_event_anomalies
+
+        hours = pd.date_range("2024-05-01", periods=8 * 24, freq="h", tz="UTC")
+        counts = pd.Series(20.0, index=hours)
+        counts[pd.Timestamp("2024-05-04 10:00", tz="UTC")] = 200  # history, already reported
+        counts[pd.Timestamp("2024-05-08 10:00", tz="UTC")] = 200  # the report day
+        hourly = pd.DataFrame({"event_name": "login", "bucket": hours, "events": counts.values})
+        empty = pd.DataFrame()
+        aggregates = WarehouseAggregates(dt.date(2024, 5, 8), empty, empty, 0, empty, hourly)
+
+        anomalies = find_event_anomalies(aggregates)
+
+        assert len(anomalies) == 1
+        assert (anomalies.loc[0, "kind"], anomalies.loc[0, "at"].hour) == ("spike", 10)
+
+    def test_categorical_and_streamed_inputs_match(self):
+        """Categorical codes and EventSummary.hourly give the same count matrix."""
+        import numpy as np
+        from anomalies import count_matrix, matrix_from_counts
+        from bench_anomalies import synthetic_events
+        from ingest import summarize_events
+
+        events = synthetic_events(20_000)
+        plain = count_matrix(events)
+        categorical = count_matrix(
+            events.assign(event_name=events["event_name"].astype("category"))
+        )
+        chunks = (events.iloc[i : i + 5_000] for i in range(0, len(events), 5_000))
+        streamed = matrix_from_counts(summarize_events(chunks).hourly)
+
+        order = np.argsort(plain.names)
+        for other in (categorical, streamed):
+            assert list(other.index) == list(plain.index)
+            assert np.array_equal(other.counts[np.argsort(other.names)], plain.counts[order])
+
+    def test_million_rows_flag_only_injected_series(self):
+        """Timing is checked by ``bench_anomalies.py --max-seconds``, not here."""
+        from bench_anomalies import bench
+
+        result = bench(1_000_000, repeat=1)
+
+        assert result["flagged"] == ["event_00", "event_01"]
+
+    def test_prompt_carries_only_flagged_series(self):
+        """The prompt lists the detector's findings instead of asking the model to hunt."""
+        from bench_anomalies import synthetic_events
+        from reporter import prompt_tables
+
+        events = synthetic_events(50_000)
+        with patch("reporter.STATE_DB", None):
+            tables = prompt_tables(events)
+        prompt = build_prompt(events, **tables)
+
+        flagged = prompt.split("anomaly detector", 1)[1]
+        assert "| event_00 |" in flagged
+        assert "| event_05 |" not in flagged
+        assert "do not look for others" in prompt
+
+        quiet = build_prompt(events, anomalies=tables["anomalies"].iloc[0:0])
+        assert "flagged no series" in quiet
+
+
+class TestSummaryEngine:
+    class _Model:
+        """Stands in for GenerativeModel: scripted failures, then a response with usage."""
+
+        def __init__(self, failures=0, delay=0.0):
+            self.failures = failures
+            self.delay = delay
+            self.calls = 0
+
+        def start_chat(self):
+            return self
+
+        def send_message(self, prompt):
+            import time
+
+            self.calls += 1
+            time.sleep(self.delay)
+            if self.calls <= self.failures:
+                raise RuntimeError("503 unavailable")
+            usage = MagicMock(prompt_token_count=len(prompt), candidates_token_count=7)
+            return MagicMock(text=f" summary of {prompt[:10]} ", usage_metadata=usage)
+
+    def _engine(self, tmp_path, fake, **kwargs):
+        from summarizer import SummaryEngine
+
+        created = []
+
+        def factory(name):
+            created.append(name)
+            return fake
+
+        engine = SummaryEngine(
+            cache_dir=tmp_path, model_factory=factory, sleep=lambda s: None, **kwargs
+        )
+        return engine, created
+
+    def test_import_does_not_initialise_vertex(self):
+        import reporter
+
+        assert not hasattr(reporter, "MODEL")
+        assert reporter.SUMMARIES._models == {}
+
+    def test_second_run_is_served_from_disk_cache(self, tmp_path):
+        model = self._Model()
+        engine, _ = self._engine(tmp_path, model)
+
+        first = engine.summarize("daily prompt")
+        again, _ = self._engine(tmp_path, model)
+        second = again.summarize("daily prompt")
+
+        assert model.calls == 1
+        assert second.text == first.text == "summary of daily prom"
+        assert (first.stats.cached, second.stats.cached) == (False, True)
+        assert second.stats.output_tokens == 7
+
+    def test_retries_with_backoff_then_succeeds(self, tmp_path):
+        model = self._Model(failures=2)
+        engine, _ = self._engine(tmp_path, model, retries=3)
+        delays = []
+        engine.sleep = delays.append
+
+        summary = engine.summarize("prompt")
+
+        assert summary.stats.attempts == 3
+        assert len(delays) == 2 and all(0 <= d <= 2 for d in delays)
+
+    def test_gives_up_after_retries_and_times_out(self, tmp_path):
+        import pytest
+
+        model = self._Model(failures=5)
+        engine, _ = self._engine(tmp_path, model, retries=2)
+        with pytest.raises(RuntimeError):
+            engine.summarize("prompt")
+        assert model.calls == 2
+        assert not list(tmp_path.iterdir())  # failures are not cached
+
+        slow, _ = self._engine(tmp_path, self._Model(delay=1.0), retries=1, timeout=0.05)
+        with pytest.raises(TimeoutError):
+            slow.summarize("prompt")
+
+    def test_hung_calls_are_bounded_by_the_pool(self, tmp_path):
+        import pytest
+
+        model = self._Model(delay=0.5)
+        engine, _ = self._engine(tmp_path, model, retries=4, timeout=0.02, workers=1)
+        with pytest.raises(TimeoutError):
+            engine.summarize("prompt")
+
+        # one worker: the retries queued behind the hung call were cancelled, not started
+        assert model.calls == 1
+
+    def test_small_prompts_use_cheaper_model(self, tmp_path):
+        engine, created = self._engine(
+            tmp_path, self._Model(), model="pro", small_model="flash", small_prompt_tokens=10
+        )
+
+        assert engine.summarize("short").stats.model == "flash"
+        assert engine.summarize("x" * 400).stats.model == "pro"
+        assert created == ["flash", "pro"]
+
+    @patch("reporter.fetch_events")
+    @patch("reporter.send_to_slack")
+    def test_stats_land_in_report_metadata(self, mock_send, mock_fetch, tmp_path, monkeypatch):
+        import json
+
+        import reporter
+
+        monkeypatch.chdir(tmp_path)
+        mock_fetch.return_value = pd.DataFrame({"test": [1, 2, 3]})
+        engine, _ = self._engine(tmp_path / "cache", self._Model())
+        with patch("reporter.SUMMARIES", engine):
+            reporter.main()
+
+        metadata = json.loads(next((tmp_path / "reports").glob("*_metadata.json")).read_text())
+        assert metadata["llm"]["model"] == engine.small_model
+        assert metadata["llm"]["output_tokens"] == 7
+        assert metadata["llm"]["cached"] is False
+
+
+class TestSlackClient:
+    def _client(self, **kwargs):
+        from slack_reporter import SlackClient
+
+        self.sleeps = []
+        return SlackClient(sleep=self.sleeps.append, **kwargs)
+
+    def test_importing_without_webhook_does_not_exit(self, monkeypatch):
+        import importlib
+
+        import slack_reporter
+
+        monkeypatch.delenv("SLACK_WEBHOOK", raising=False)
+        with patch("dotenv.load_dotenv"):
+            importlib.reload(slack_reporter)
+        assert slack_reporter.WEBHOOK is None
+
+    def test_honours_retry_after_on_429(self):
+        with StubWebhook(responses=[(429, {"Retry-After": "2"}), (503, {})]) as hook:
+            client = self._client(webhook=hook.url)
+            body = client.send("hello")
+
+        assert body == "ok"  # same return value as the original send()
+        assert [m["text"] for m in hook.received] == ["hello"]
+        assert self.sleeps[0] == 2.0
+        assert len(self.sleeps) == 2
+
+    def test_gives_up_after_retries(self):
+        import pytest
+        from slack_reporter import SlackError
+
+        with StubWebhook(responses=[(429, {"Retry-After": "0"})] * 3) as hook:
+            client = self._client(webhook=hook.url, retries=3)
+            with pytest.raises(SlackError):
+                client.send("hello")
+        assert hook.received == []
+
+    def test_client_errors_are_not_retried(self):
+        import pytest
+        import requests
+
+        with StubWebhook(responses=[(400, {})]) as hook:
+            with pytest.raises(requests.HTTPError):
+                self._client(webhook=hook.url).send("hello")
+        assert self.sleeps == []
+
+    def test_long_summary_is_split_into_block_kit_messages(self):
+        from slack_reporter import MAX_BLOCK_CHARS, MAX_BLOCKS, build_messages
+
+        paragraphs = [f"Paragraph {i}: " + "word " * 400 for i in range(60)]
+        text = "\n\n".join(paragraphs)
+        messages = build_messages(text, channel="#ops")
+
+        blocks = [b for m in messages for b in m["blocks"]]
+        assert len(messages) == 2
+        assert all(len(m["blocks"]) <= MAX_BLOCKS for m in messages)
+        assert all(len(b["text"]["text"]) <= MAX_BLOCK_CHARS for b in blocks)
+        assert all(m["channel"] == "#ops" and len(m["text"]) <= 300 for m in messages)
+        joined = " ".join(b["text"]["text"] for b in blocks)
+        assert joined.split() == text.split()
+
+    def test_fan_out_is_concurrent_and_pooled(self):
+        channels = [f"#c{i}" for i in range(6)]
+        with StubWebhook(delay=0.2) as hook:
+            client = self._client(webhook=hook.url)
+            results = client.fan_out("hello", channels)
+            client.fan_out("again", channels)
+
+        assert results == {c: None for c in channels}
+        assert sorted(m["channel"] for m in hook.received[:6]) == sorted(channels)
+        assert hook.peak_in_flight > 1  # sequential sends never overlap at the server
+        # The second round reuses the pooled keep-alive connections.
+        assert len(hook.connections) <= len(channels)
+
+    def test_shared_client_is_created_once(self):
+        """Reports asking for the client at the same moment all get the same one."""
+        import threading
+
+        import slack_reporter
+
+        start = threading.Barrier(8)
+        clients = []
+
+        def slow_client(url):
+            threading.Event().wait(0.05)  # widen the window a racing second call would hit
+            return object()
+
+        def get():
+            start.wait()
+            clients.append(slack_reporter.get_client())
+
+        with patch.object(slack_reporter, "_client", None), patch.object(
+            slack_reporter, "SlackClient", side_effect=slow_client
+        ) as factory:
+            threads = [threading.Thread(target=get) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        assert factory.call_count == 1
+        assert len({id(c) for c in clients}) == 1
+
+    def test_send_to_slack_fans_out_to_channel_list(self):
+        import slack_reporter
+
+        with StubWebhook(responses=[(500, {})]) as hook, patch(
+            "reporter.SLACK_URL", hook.url
+        ), patch.object(slack_reporter.get_client(), "sleep", lambda s: None):
+            send_to_slack("report", channel=["#a", "#b"])
+
+        assert sorted(m["channel"] for m in hook.received) == ["#a", "#b"]
+
+
+class TestFeedbackStore:
+    def _store(self, tmp_path):
+        from feedback_store import FeedbackStore
+
+        return FeedbackStore(tmp_path / "feedback.db")
+
+    def test_recent_comments_follow_time_not_file_order(self, tmp_path):
+        import datetime as dt
+
+        store = self._store(tmp_path)
+        base = dt.datetime(2024, 3, 1, 9)
+        for i in (3, 0, 6, 1, 5, 2, 4):
+            store.add(
+                f"report_{i}",
+                {"rating": i % 5 + 1, "comment": f"c{i}"},
+                at=base + dt.timedelta(hours=i),
+            )
+
+        summary = store.summary()
+        assert summary["recent_comments"] == ["c2", "c3", "c4", "c5", "c6"]
+        assert summary["total_feedback"] == 7
+        assert summary["average_rating"] == sum(i % 5 + 1 for i in range(7)) / 7
+        assert store.get("report_3") == [{"rating": 4, "comment": "c3"}]
+
+    def test_window_summary_reads_running_aggregates(self, tmp_path):
+        import datetime as dt
+
+        store = self._store(tmp_path)
+        today = dt.date(2024, 3, 31)
+        store.add("old", {"rating": 1, "comment": "old"}, at=dt.datetime(2024, 1, 1))
+        store.add("new", {"rating": 5, "comment": "new"}, at=dt.datetime(2024, 3, 30))
+        store.add("unrated", {"comment": "no rating"}, at=dt.datetime(2024, 3, 31))
+
+        recent = store.summary(days=7, today=today)
+        assert recent["average_rating"] == 5
+        assert recent["total_feedback"] == 2
+        assert recent["recent_comments"] == ["new", "no rating"]
+        assert store.summary()["average_rating"] == 3
+
+        plans = [
+            " ".join(row[-1] for row in store.conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+            for sql, params in [
+                ("SELECT SUM(entries) FROM feedback_daily WHERE day >= ?", ("2024-03-25",)),
+                (
+                    "SELECT comment FROM feedback WHERE comment IS NOT NULL AND created_at >= ? "
+                    "ORDER BY created_at DESC LIMIT 5",
+                    ("",),
+                ),
+            ]
+        ]
+        assert "SEARCH" in plans[0]
+        assert "feedback_comments" in plans[1] and "TEMP B-TREE" not in plans[1]
+
+    def test_reporter_migrates_legacy_files_and_analyzes(self, tmp_path):
+        import json
+
+        import reporter
+
+        legacy = tmp_path / "feedback"
+        legacy.mkdir()
+        (legacy / "report_a_feedback.json").write_text(json.dumps({"rating": 2, "comment": "meh"}))
+        (legacy / "broken_feedback.json").write_text("{not json")
+
+        with patch("reporter.FEEDBACK_DIR", legacy), patch(
+            "reporter.FEEDBACK_DB", legacy / "feedback.db"
+        ):
+            reporter.save_report_feedback("report_b", {"rating": 4, "comment": "better"})
+            analysis = reporter.analyze_feedback_trends()
+
+        assert analysis["total_feedback"] == 2
+        assert analysis["average_rating"] == 3
+        assert analysis["recent_comments"] == ["meh", "better"]
+
+    def test_no_feedback_does_not_mark_report_as_enhanced(self, tmp_path):
+        import reporter
+
+        with patch("reporter.FEEDBACK_DIR", tmp_path / "none"), patch(
+            "reporter.FEEDBACK_DB", tmp_path / "none" / "feedback.db"
+        ):
+            assert reporter.analyze_feedback_trends() == {"message": "No feedback data available"}
+            assert not (tmp_path / "none").exists()
+
+
+class TestRunLedger:
+    def _ledger(self, tmp_path):
+        from run_ledger import RunLedger
+
+        return RunLedger(tmp_path / "ledger.db")
+
+    def test_stage_percentiles_flag_regressions(self, tmp_path):
+        import datetime as dt
+
+        from run_ledger import RunRecord
+
+        ledger = self._ledger(tmp_path)
+        start = dt.datetime(2024, 5, 1, 8)
+        for i in range(20):
+            llm = 5.0 if i == 19 else 1.0 + i / 100  # the latest run's LLM call regressed
+            ledger.record(
+                RunRecord(
+                    f"run_{i}",
+                    started_at=start + dt.timedelta(days=i),
+                    status="ok",
+                    timings={"fetch": 0.5, "llm": llm, "slack": 0.1},
+                    rows=100 + i,
+                )
+            )
+        ledger.record(RunRecord("other", report="weekly", started_at=start, timings={"llm": 9.0}))
+
+        stages = ledger.stage_percentiles(10, report="daily_summary").set_index("stage")
+        assert list(stages.index) == ["fetch", "llm", "slack"]
+        assert stages.loc["llm", "runs"] == 10
+        assert round(stages.loc["llm", "p50"], 3) == 1.145
+        assert stages.loc["llm", "last"] == 5.0
+        assert stages["regressed"].to_dict() == {"fetch": False, "llm": True, "slack": False}
+        counters = ledger.counter_summary(10, report="daily_summary").set_index("counter")
+        assert counters.loc["rows", "last"] == 119
+
+    def test_reporter_main_records_each_stage(self, tmp_path, monkeypatch):
+        import reporter
+        from summarizer import Summary, SummaryStats
+
+        monkeypatch.chdir(tmp_path)
+        events = pd.DataFrame(
+            {
+                "user_id": [1, 2],
+                "event_name": ["a", "b"],
+                "created_at": ["2024-01-01", "2024-01-02"],
+            }
+        )
+        summary = Summary(
+            "summary", SummaryStats("flash", cached=True, prompt_tokens=12, output_tokens=3)
+        )
+
+        with patch("reporter.fetch_events", return_value=events), patch(
+            "reporter.summarize_prompt", return_value=summary
+        ), patch("reporter.send_to_slack"), patch("reporter.LEDGER_DB", tmp_path / "ledger.db"):
+            reporter.main()
+
+        run = self._ledger(tmp_path).recent_runs(1).iloc[0]
+        assert (run["status"], run["rows"], run["prompt_tokens"], run["cache_hits"]) == (
+            "ok",
+            2,
+            12,
+            1,
+        )
+        stages = self._ledger(tmp_path).stage_percentiles()["stage"].tolist()
+        assert stages == ["fetch", "aggregate", "prompt", "llm", "slack"]
+
+    def test_failed_run_is_recorded(self, tmp_path, monkeypatch):
+        import pytest
+        import reporter
+
+        monkeypatch.chdir(tmp_path)
+        with patch("reporter.load_events", side_effect=RuntimeError("warehouse down")), patch(
+            "reporter.LEDGER_DB", tmp_path / "ledger.db"
+        ):
+            with pytest.raises(RuntimeError):
+                reporter.main()
+
+        run = self._ledger(tmp_path).recent_runs(1).iloc[0]
+        assert (run["status"], run["error"]) == ("error", "warehouse down")
+
+    def test_scheduler_runs_land_in_ledger(self, tmp_path):
+        import asyncio
+
+        from scheduler import ReportScheduler, ReportSpec
+        from summarizer import Summary, SummaryStats
+
+        def query(spec, _):
+            frame = pd.DataFrame({"n": [1, 2, 3]})
+            frame.attrs.update(bytes_processed=4096, cache_hits=1)
+            return frame
+
+        posted = []
+        stages = {
+            "query": query,
+            "llm": lambda spec, value: Summary(
+                "ok", SummaryStats("flash", cached=True, prompt_tokens=12, output_tokens=3)
+            ),
+            "slack": lambda spec, text: posted.append(text),
+        }
+        ledger = self._ledger(tmp_path)
+        asyncio.run(
+            ReportScheduler([ReportSpec("a"), ReportSpec("b")], stages=stages, ledger=ledger).run()
+        )
+
+        runs = ledger.recent_runs()
+        assert sorted(runs["report"]) == ["a", "b"]
+        assert set(runs["rows"]) == {3}
+        assert set(runs["bytes_scanned"]) == {4096}
+        assert set(runs["prompt_tokens"]) == {12} and set(runs["output_tokens"]) == {3}
+        assert set(runs["cache_hits"]) == {2}  # query cache hit + summary cache hit
+        assert posted == ["ok", "ok"]
+        assert set(ledger.stage_percentiles()["stage"]) == {"query", "llm", "slack"}
+
+    def test_runs_started_in_the_same_second_are_kept(self, tmp_path):
+        import asyncio
+
+        from scheduler import ReportScheduler, ReportSpec
+
+        ledger = self._ledger(tmp_path)
+        scheduler = ReportScheduler(
+            [ReportSpec("a")], stages={"query": lambda spec, _: [1]}, ledger=ledger
+        )
+        for _ in range(3):
+            asyncio.run(scheduler.run())
+
+        runs = ledger.recent_runs()
+        assert len(runs) == 3 and runs["run_id"].is_unique
@@ -2,6 +2,8 @@ import sys
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 
+import pytest
+
 # Add modules to path
 sys.path.insert(0, str(Path(__file__).parent.parent / "modules" / "m7-vector-swap"))
 
@@ -17,120 +19,119 @@ from pinecone_demo import (
 class TestVectorSwap:
     def test_load_documents(self):
         """Test loading and splitting documents."""
-        with patch('pinecone_demo.Path') as mock_path:
+        with patch("pinecone_demo.Path") as mock_path:
             test_content = "# Header\n\nSome content\n\n## Another Header\n\nMore content"
             mock_path.return_value.read_text.return_value = test_content
-            
+
             result = load_documents(Path("test.md"))
-            
+
             assert isinstance(result, list)
             assert len(result) > 0
-            assert all(hasattr(doc, 'page_content') for doc in result)
-            assert all(hasattr(doc, 'metadata') for doc in result)
-            assert all(doc.metadata['src'] == 'test.md' for doc in result)
+            assert all(hasattr(doc, "page_content") for doc in result)
+            assert all(hasattr(doc, "metadata") for doc in result)
+            assert all(doc.metadata["src"] == "test.md" for doc in result)
 
     def test_build_pinecone_store_no_api_key(self):
         """Test Pinecone store building without API key."""
-        with patch('pinecone_demo.os.getenv') as mock_getenv:
+        with patch("pinecone_demo.os.getenv") as mock_getenv:
             mock_getenv.return_value = None
-            
+
             result, backend = build_pinecone_store([])
-            
+
             assert result is None
             assert backend is None
 
     def test_build_pinecone_store_import_error(self):
         """Test Pinecone store building with import error."""
-        with patch('pinecone_demo.os.getenv') as mock_getenv:
+        with patch("pinecone_demo.os.getenv") as mock_getenv:
             mock_getenv.return_value = "test-key"
-            
-            with patch('builtins.__import__', side_effect=ImportError):
+
+            with patch("builtins.__import__", side_effect=ImportError):
                 result, backend = build_pinecone_store([])
-                
+
                 assert result is None
                 assert backend is None
 
-    @patch('pinecone_demo.os.getenv')
-    @patch('pinecone_demo.OpenAIEmbeddings')
+    @patch("pinecone_demo.os.getenv")
+    @patch("pinecone_demo.OpenAIEmbeddings")
     def test_build_pinecone_store_success(self, mock_embeddings, mock_getenv):
         """Test successful Pinecone store building."""
         # Mock environment variables
         mock_getenv.side_effect = lambda key, default=None: {
-            'PINECONE_API_KEY': 'test-key',
-            'PINECONE_REGION': 'us-east-1',
-            'PINECONE_CLOUD': 'aws'
+            "PINECONE_API_KEY": "test-key",
+            "PINECONE_REGION": "us-east-1",
+            "PINECONE_CLOUD": "aws",
         }.get(key, default)
-        
+
         # Mock embedding dimension
         mock_embeddings.return_value.embed_query.return_value = [0.1] * 1536
-        
+
         # Mock Pinecone client
-        with patch('pinecone_demo.Pinecone') as mock_pinecone_class, \
-             patch('pinecone_demo.ServerlessSpec'), \
-             patch('pinecone_demo.PineconeVectorStore') as mock_vector_store:
-            
+        with patch("pinecone_demo.Pinecone") as mock_pinecone_class, patch(
+            "pinecone_demo.ServerlessSpec"
+        ), patch("pinecone_demo.PineconeVectorStore") as mock_vector_store:
+
             mock_pc = MagicMock()
             mock_pinecone_class.return_value = mock_pc
             mock_pc.list_indexes.return_value.names = []
-            
+
             mock_store = MagicMock()
             mock_vector_store.from_documents.return_value = mock_store
-            
+
             docs = [MagicMock()]
             result, backend = build_pinecone_store(docs)
-            
+
             mock_pc.create_index.assert_called_once()
             mock_vector_store.from_documents.assert_called_once()
             assert result == mock_store
             assert backend == "Pinecone v3"
 
-    @patch('pinecone_demo.os.getenv')
-    @patch('pinecone_demo.OpenAIEmbeddings')
+    @patch("pinecone_demo.os.getenv")
+    @patch("pinecone_demo.OpenAIEmbeddings")
     def test_build_pinecone_store_existing_index(self, mock_embeddings, mock_getenv):
         """Test Pinecone store building with existing index."""
         # Mock environment variables
         mock_getenv.side_effect = lambda key, default=None: {
-            'PINECONE_API_KEY': 'test-key',
-            'PINECONE_REGION': 'us-east-1',
-            'PINECONE_CLOUD': 'aws'
+            "PINECONE_API_KEY": "test-key",
+            "PINECONE_REGION": "us-east-1",
+            "PINECONE_CLOUD": "aws",
         }.get(key, default)
-        
+
         # Mock embedding dimension
         mock_embeddings.return_value.embed_query.return_value = [0.1] * 1536
-        
+
         # Mock Pinecone client
-        with patch('pinecone_demo.Pinecone') as mock_pinecone_class, \
-             patch('pinecone_demo.PineconeVectorStore') as mock_vector_store:
-            
+        with patch("pinecone_demo.Pinecone") as mock_pinecone_class, patch(
+            "pinecone_demo.PineconeVectorStore"
+        ) as mock_vector_store:
+
             mock_pc = MagicMock()
             mock_pinecone_class.return_value = mock_pc
             mock_pc.list_indexes.return_value.names = [STORE_NAME]
-            
+
             mock_store = MagicMock()
             mock_vector_store.from_documents.return_value = mock_store
-            
+
             docs = [MagicMock()]
             result, backend = build_pinecone_store(docs)
-            
+
             mock_pc.create_index.assert_not_called()
             mock_vector_store.from_documents.assert_called_once()
             assert result == mock_store
             assert backend == "Pinecone v3"
 
-    @patch('pinecone_demo.Chroma')
-    @patch('pinecone_demo.OpenAIEmbeddings')
+    @patch("pinecone_demo.Chroma")
+    @patch("pinecone_demo.OpenAIEmbeddings")
     def test_build_chroma_store(self, mock_embeddings, mock_chroma):
         """Test Chroma store building."""
         mock_store = MagicMock()
         mock_chroma.from_documents.return_value = mock_store
-        
+
         docs = [MagicMock()]
         result, backend = build_chroma_store(docs)
-        
+
         mock_chroma.from_documents.assert_called_once_with(
-            docs, 
-            embedding=mock_embeddings.return_value,
-            persist_directory=CHROMA_DIR
+            docs, embedding=mock_embeddings.return_value, persist_directory=CHROMA_DIR
         )
         assert result == mock_store
         assert backend == "Chroma (local)"
@@ -140,15 +141,23 @@ class TestVectorSwap:
         assert STORE_NAME == "faq-embeddings"
         assert CHROMA_DIR == "chroma_faq"
 
-    @patch('pinecone_demo.argparse.ArgumentParser')
-    @patch('pinecone_demo.Path')
-    @patch('pinecone_demo.load_documents')
-    @patch('pinecone_demo.build_pinecone_store')
-    @patch('pinecone_demo.build_chroma_store')
-    @patch('pinecone_demo.ConversationalRetrievalChain')
-    @patch('pinecone_demo.ChatOpenAI')
-    def test_main_function_structure(self, mock_chat, mock_chain, mock_build_chroma, 
-                                   mock_build_pinecone, mock_load_docs, mock_path, mock_parser):
+    @patch("pinecone_demo.argparse.ArgumentParser")
+    @patch("pinecone_demo.Path")
+    @patch("pinecone_demo.load_documents")
+    @patch("pinecone_demo.build_pinecone_store")
+    @patch("pinecone_demo.build_chroma_store")
+    @patch("pinecone_demo.ConversationalRetrievalChain")
+    @patch("pinecone_demo.ChatOpenAI")
+    def test_main_function_structure(
+        self,
+        mock_chat,
+        mock_chain,
+        mock_build_chroma,
+        mock_build_pinecone,
+        mock_load_docs,
+        mock_path,
+        mock_parser,
+    ):
         """Test main function argument parsing and flow."""
         # Mock argument parser
         mock_args = MagicMock()
@@ -156,46 +165,199 @@ class TestVectorSwap:
         mock_args.rebuild = True
         mock_args.query = "test query"
         mock_parser.return_value.parse_args.return_value = mock_args
-        
+
         # Mock path
         mock_path.return_value.expanduser.return_value.exists.return_value = True
-        
+
         # Mock document loading
         mock_docs = [MagicMock()]
         mock_load_docs.return_value = mock_docs
-        
+
         # Mock Pinecone store (successful)
         mock_store = MagicMock()
         mock_build_pinecone.return_value = (mock_store, "Pinecone v3")
-        
+
         # Mock chain
         mock_chain_instance = MagicMock()
         mock_chain.from_llm.return_value = mock_chain_instance
         mock_chain_instance.invoke.return_value = {"answer": "test answer"}
-        
+
         # Import and call main
         import pinecone_demo
-        
+
         # This test mainly checks that the main function doesn't crash
         # Full integration testing would require more complex mocking
-        assert hasattr(pinecone_demo, 'main')
+        assert hasattr(pinecone_demo, "main")
 
-    @patch('pinecone_demo.sys.exit')
-    @patch('pinecone_demo.argparse.ArgumentParser')
-    @patch('pinecone_demo.Path')
+    @patch("pinecone_demo.sys.exit")
+    @patch("pinecone_demo.argparse.ArgumentParser")
+    @patch("pinecone_demo.Path")
     def test_main_function_file_not_found(self, mock_path, mock_parser, mock_exit):
         """Test main function with non-existent source file."""
         # Mock argument parser
         mock_args = MagicMock()
         mock_args.source = "nonexistent.md"
         mock_parser.return_value.parse_args.return_value = mock_args
-        
+
         # Mock path to not exist
         mock_path.return_value.expanduser.return_value.exists.return_value = False
-        
+
         # Import and call main
         import pinecone_demo
-        
+
         # This would call sys.exit in the actual function
         # We just verify the structure exists
-        assert hasattr(pinecone_demo, 'main') 
\ No newline at end of file
+        assert hasattr(pinecone_demo, "main")
+
+
+class InMemoryPineconeIndex:
+    """Pinecone-compatible stand-in for the ``Index`` calls used during ingestion."""
+
+    def __init__(self, fail_upserts: int = 0, fail_deletes: bool = False):
+        self.namespaces = {}
+        self.upsert_calls = 0
+        self.fail_upserts = fail_upserts
+        self.fail_deletes = fail_deletes
+
+    def upsert(self, vectors, namespace=""):
+        self.upsert_calls += 1
+        if self.fail_upserts:
+            self.fail_upserts -= 1
+            raise ConnectionError("simulated upsert failure")
+        ns = self.namespaces.setdefault(namespace, {})
+        for v in vectors:
+            ns[v["id"]] = v
+        return {"upserted_count": len(vectors)}
+
+    def fetch(self, ids, namespace=""):
+        from types import SimpleNamespace
+
+        ns = self.namespaces.get(namespace, {})
+        found = {
+            i: SimpleNamespace(id=i, **{k: ns[i][k] for k in ("values", "metadata")})
+            for i in ids
+            if i in ns
+        }
+        return SimpleNamespace(vectors=found)
+
+    def describe_index_stats(self):
+        from types import SimpleNamespace
+
+        return SimpleNamespace(
+            namespaces={
+                name: SimpleNamespace(vector_count=len(ns)) for name, ns in self.namespaces.items()
+            }
+        )
+
+    def delete(self, delete_all=False, namespace=""):
+        if self.fail_deletes:
+            raise PermissionError("simulated auth failure")
+        if namespace not in self.namespaces:
+            raise KeyError(namespace)
+        if delete_all:
+            del self.namespaces[namespace]
+
+
+class _FakeEmbeddings:
+    def embed_documents(self, texts):
+        return [[float(len(t)), 1.0, 0.0] for t in texts]
+
+
+def _docs(n):
+    from langchain.schema import Document
+
+    return [Document(page_content=f"chunk {i}", metadata={"src": "faq.md"}) for i in range(n)]
+
+
+class TestPineconeBulkLoad:
+    def test_plan_batches_respects_limits(self):
+        """Batches stay under both the vector-count and byte limits."""
+        from pinecone_demo import plan_batches
+
+        batches = list(plan_batches(_docs(25), dimension=3, max_bytes=1_000, max_count=10))
+
+        assert sum(len(b) for b in batches) == 25
+        assert all(len(b) <= 10 for b in batches)
+        assert len(batches) > 3  # byte limit kicks in before the count limit
+
+    def test_rebuild_swaps_namespaces_without_duplicates(self, tmp_path):
+        """Each rebuild fills the idle namespace and then flips the pointer."""
+        import pinecone_demo
+
+        index = InMemoryPineconeIndex()
+        with patch.object(pinecone_demo, "CHECKPOINT_DIR", tmp_path):
+            first = pinecone_demo.bulk_load(index, _docs(5) + _docs(5), _FakeEmbeddings(), 3)
+            second = pinecone_demo.bulk_load(index, _docs(5), _FakeEmbeddings(), 3)
+            third = pinecone_demo.bulk_load(index, _docs(5), _FakeEmbeddings(), 3)
+
+        assert (first, second, third) == ("blue", "green", "blue")
+        assert pinecone_demo.get_active_namespace(index) == "blue"
+        assert len(index.namespaces["blue"]) == 5
+        assert len(index.namespaces["green"]) == 5
+        assert list(tmp_path.iterdir()) == []
+
+    def test_failed_load_resumes_without_flipping(self, tmp_path):
+        """A partial failure keeps readers on the old data; the rerun only sends what is missing."""
+        import pinecone_demo
+
+        index = InMemoryPineconeIndex(fail_upserts=1)
+        dimension = 40_000  # ~800 KB per vector -> two vectors per 2 MB request
+        with patch.object(pinecone_demo, "CHECKPOINT_DIR", tmp_path), patch.object(
+            pinecone_demo, "UPSERT_RETRIES", 1
+        ):
+            with pytest.raises(pinecone_demo.UpsertError):
+                pinecone_demo.bulk_load(index, _docs(6), _FakeEmbeddings(), dimension)
+            assert pinecone_demo.get_active_namespace(index) is None
+            assert len(index.namespaces["blue"]) == 4
+
+            calls_before = index.upsert_calls
+            assert pinecone_demo.bulk_load(index, _docs(6), _FakeEmbeddings(), dimension) == "blue"
+
+        assert len(index.namespaces["blue"]) == 6
+        assert index.upsert_calls - calls_before == 2  # one missing batch + pointer
+
+    def test_failed_cleanup_stops_the_load(self, tmp_path):
+        """An error clearing the idle namespace is raised, not skipped, and readers stay put."""
+        import pinecone_demo
+
+        index = InMemoryPineconeIndex()
+        with patch.object(pinecone_demo, "CHECKPOINT_DIR", tmp_path):
+            assert pinecone_demo.bulk_load(index, _docs(3), _FakeEmbeddings(), 3) == "blue"
+            assert pinecone_demo.bulk_load(index, _docs(3), _FakeEmbeddings(), 3) == "green"
+            index.fail_deletes = True
+            with pytest.raises(PermissionError):
+                pinecone_demo.bulk_load(index, _docs(4), _FakeEmbeddings(), 3)
+
+        assert pinecone_demo.get_active_namespace(index) == "green"
+        assert len(index.namespaces["blue"]) == 3
+
+    def test_namespace_env_only_bootstraps(self, tmp_path, monkeypatch):
+        """PINECONE_NAMESPACE seeds the first load; after a swap reads follow the pointer."""
+        import pinecone_demo
+
+        monkeypatch.setenv("PINECONE_NAMESPACE", "blue")
+        index = InMemoryPineconeIndex()
+        assert pinecone_demo.get_active_namespace(index) == "blue"
+        with patch.object(pinecone_demo, "CHECKPOINT_DIR", tmp_path):
+            assert pinecone_demo.bulk_load(index, _docs(3), _FakeEmbeddings(), 3) == "green"
+        assert pinecone_demo.get_active_namespace(index) == "green"
+
+    def test_checkpoint_of_another_corpus_is_not_resumed(self, tmp_path):
+        """An interrupted load of different documents is discarded, not mixed in."""
+        import pinecone_demo
+
+        index = InMemoryPineconeIndex(fail_upserts=1)
+        dimension = 40_000
+        with patch.object(pinecone_demo, "CHECKPOINT_DIR", tmp_path), patch.object(
+            pinecone_demo, "UPSERT_RETRIES", 1
+        ):
+            with pytest.raises(pinecone_demo.UpsertError):
+                pinecone_demo.bulk_load(index, _docs(6), _FakeEmbeddings(), dimension)
+            assert len(index.namespaces["blue"]) == 4
+
+            other = _docs(9)[6:]
+            assert pinecone_demo.bulk_load(index, other, _FakeEmbeddings(), dimension) == "blue"
+
+        loaded = {v["metadata"]["text"] for v in index.namespaces["blue"].values()}
+        assert loaded == {"chunk 6", "chunk 7", "chunk 8"}
+        assert list(tmp_path.iterdir()) == []
@@ -1,137 +1,1168 @@
-import pytest
-from unittest.mock import Mock, patch, MagicMock
-from pathlib import Path
 import json
-import tempfile
+import multiprocessing
 import sys
-import os
-from datetime import datetime
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+import pytest
 
 # Add modules to path
 sys.path.insert(0, str(Path(__file__).parent.parent / "modules" / "m8-crew-agents"))
 
+import memory_compaction
+from agent_router import AgentProfile, AgentRouter
+from bench_routing import load_benchmark
 from crew_agents import (
     AgentMemory,
-    MockLLMAgent,
+    CrewOrchestrator,
+    CrewSessions,
     DataAnalystAgent,
+    MockLLMAgent,
     ReportGeneratorAgent,
     RootCauseAnalyzer,
-    CrewOrchestrator
 )
+from llm_backend import BudgetExceeded, Completion, LLMBackend, LLMClient, TokenBudget, parse_json
+from memory_backends import SQLiteMemory
+from memory_compaction import MemoryCompactor, MinHasher, duplicate_groups
+from memory_recall import HashingEmbeddings, RecallIndex
+from metric_analysis import analyze_metrics, to_columns
+from report_builder import ReportBuilder, SlackStream
+from workflow import Step, Workflow
 
 
 class TestAgentMemory:
     def test_agent_memory_initialization(self):
         """Test AgentMemory initialization."""
-        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as tmp:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
             memory_file = Path(tmp.name)
-        
+
         memory = AgentMemory(memory_file)
-        
+
         assert memory.memory_file == memory_file
         assert isinstance(memory.memory, dict)
         assert "conversations" in memory.memory
         assert "insights" in memory.memory
         assert "patterns" in memory.memory
-        
+
         # Cleanup
         memory_file.unlink()
 
     def test_memory_persistence(self):
         """Test memory save and load functionality."""
-        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as tmp:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
             memory_file = Path(tmp.name)
-        
+
         memory = AgentMemory(memory_file)
-        
+
         # Add test data
         test_conversation = {"agent": "test", "task": "test task"}
         memory.add_conversation(test_conversation)
-        
+
         test_insight = "Test insight"
         memory.add_insight(test_insight)
-        
+
         # Create new instance to test loading
         memory2 = AgentMemory(memory_file)
-        
+
         assert len(memory2.memory["conversations"]) == 1
         assert len(memory2.memory["insights"]) == 1
         assert memory2.memory["conversations"][0]["agent"] == "test"
         assert memory2.memory["insights"][0]["content"] == test_insight
-        
+
         # Cleanup
         memory_file.unlink()
 
     def test_get_recent_conversations(self):
         """Test getting recent conversations."""
-        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as tmp:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
             memory_file = Path(tmp.name)
-        
+
         memory = AgentMemory(memory_file)
-        
+
         # Add multiple conversations
         for i in range(10):
             memory.add_conversation({"agent": f"agent{i}", "task": f"task{i}"})
-        
+
         recent = memory.get_recent_conversations(3)
         assert len(recent) == 3
         assert recent[0]["agent"] == "agent7"  # -3 from end
         assert recent[2]["agent"] == "agent9"  # last one
-        
+
         # Cleanup
         memory_file.unlink()
 
 
+class TestMemoryLog:
+    def test_events_are_appended_not_rewritten(self, tmp_path):
+        """Adding events leaves the snapshot alone until compaction."""
+        memory_file = tmp_path / "memory.json"
+        memory = AgentMemory(memory_file, compact_every=100)
+        for i in range(5):
+            memory.add_insight(f"insight {i}")
+
+        assert not memory_file.exists()
+        segments = list((tmp_path / "memory.json.log").glob("*.jsonl"))
+        assert len(segments) == 1
+        assert len(segments[0].read_text().splitlines()) == 5
+
+    def test_group_commit_by_count(self, tmp_path):
+        """fsync runs once per flush_every records."""
+        memory = AgentMemory(tmp_path / "memory.json", flush_every=4, flush_interval=3600)
+        with patch("memory_log.os.fsync") as fsync:
+            for i in range(10):
+                memory.add_insight(f"insight {i}")
+            assert fsync.call_count == 2
+            memory.flush()
+            assert fsync.call_count == 3
+
+    def test_idle_records_are_synced_by_the_timer(self, tmp_path):
+        """The last records of a burst become durable without a further append."""
+        import time
+
+        memory = AgentMemory(tmp_path / "memory.json", flush_every=1000, flush_interval=0.05)
+        with patch("memory_log.os.fsync") as fsync:
+            memory.add_insight("only one")
+            deadline = time.monotonic() + 2.0
+            while not fsync.called and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert fsync.call_count == 1
+        memory.close()
+
+    def test_snapshot_is_a_copy(self, tmp_path):
+        memory = AgentMemory(tmp_path / "memory.json")
+        memory.add_insight("kept")
+
+        memory.memory["insights"].clear()
+        memory.memory["insights"].append({"content": "injected"})
+
+        assert [i["content"] for i in memory.get_insights()] == ["kept"]
+        assert memory.store.count("insights") == 1
+
+    def test_recent_records_are_copies(self, tmp_path):
+        memory = AgentMemory(tmp_path / "memory.json")
+        memory.add_conversation({"agent": "a", "task": "kept", "response": "ok"})
+
+        memory.store.recent("conversations", 5)[0]["task"] = "edited"
+        memory.store.recent("conversations", 5, agent="a")[0]["response"] = "edited"
+
+        (record,) = memory.store.recent("conversations", 5)
+        assert (record["task"], record["response"]) == ("kept", "ok")
+
+    def test_compaction_replays_only_the_tail(self, tmp_path):
+        """A snapshot is written every compact_every records; startup replays the rest."""
+        memory_file = tmp_path / "memory.json"
+        memory = AgentMemory(memory_file, compact_every=10)
+        for i in range(25):
+            memory.add_conversation({"agent": "a", "task": f"task{i}"})
+
+        snapshot = json.loads(memory_file.read_text())
+        assert snapshot["_seq"] == 20
+        assert len(snapshot["conversations"]) == 20
+
+        reloaded = AgentMemory(memory_file)
+        assert reloaded.store.snapshot_seq == 20
+        assert reloaded.store.tail_length == 5
+        assert [c["task"] for c in reloaded.memory["conversations"]] == [
+            f"task{i}" for i in range(25)
+        ]
+
+    def test_torn_write_is_ignored(self, tmp_path):
+        """A half-written last record from a crash does not break loading."""
+        memory_file = tmp_path / "memory.json"
+        memory = AgentMemory(memory_file)
+        memory.add_insight("kept")
+        memory.close()
+        segment = next((tmp_path / "memory.json.log").glob("*.jsonl"))
+        with open(segment, "a") as f:
+            f.write('{"seq": 2, "kind": "insights", "da')
+
+        reloaded = AgentMemory(memory_file)
+        assert [i["content"] for i in reloaded.memory["insights"]] == ["kept"]
+        reloaded.add_insight("after crash")
+        assert len(AgentMemory(memory_file).memory["insights"]) == 2
+
+    def test_crash_between_snapshot_and_segment_cleanup(self, tmp_path):
+        """Records already in the snapshot are not applied twice."""
+        memory_file = tmp_path / "memory.json"
+        memory = AgentMemory(memory_file)
+        for i in range(3):
+            memory.add_insight(f"insight {i}")
+        memory.close()
+        log_dir = tmp_path / "memory.json.log"
+        kept = {p.name: p.read_bytes() for p in log_dir.glob("*.jsonl")}
+        memory.save_memory()
+        for name, data in kept.items():
+            (log_dir / name).write_bytes(data)
+
+        assert len(AgentMemory(memory_file).memory["insights"]) == 3
+
+    def test_legacy_snapshot_loads(self, tmp_path):
+        """A memory file written by the old full-rewrite code is read as the snapshot."""
+        memory_file = tmp_path / "memory.json"
+        memory_file.write_text(
+            json.dumps(
+                {"conversations": [{"agent": "old"}], "insights": [], "patterns": []}, indent=2
+            )
+        )
+
+        memory = AgentMemory(memory_file)
+        memory.add_conversation({"agent": "new"})
+        agents = [c["agent"] for c in AgentMemory(memory_file).memory["conversations"]]
+        assert agents == ["old", "new"]
+
+
+class TestSQLiteMemory:
+    def test_db_suffix_selects_sqlite(self, tmp_path):
+        """A .db memory file is stored in SQLite with the same AgentMemory API."""
+        memory = AgentMemory(tmp_path / "memory.db")
+        assert isinstance(memory.store, SQLiteMemory)
+
+        for i in range(6):
+            memory.add_conversation({"agent": f"agent{i % 2}", "task": f"task{i}"})
+        memory.add_insight("insight")
+
+        recent = memory.get_recent_conversations(3)
+        assert [c["task"] for c in recent] == ["task3", "task4", "task5"]
+        assert [c["task"] for c in memory.get_recent_conversations(2, agent="agent0")] == [
+            "task2",
+            "task4",
+        ]
+        assert memory.count_insights() == 1
+        assert len(memory.memory["conversations"]) == 6
+
+        reopened = AgentMemory(tmp_path / "memory.db")
+        assert reopened.store.count("conversations", agent="agent1") == 3
+
+    def test_max_rows_per_agent(self, tmp_path):
+        """Each (kind, agent) keeps only its newest max_per_agent rows."""
+        store = SQLiteMemory(tmp_path / "memory.db", max_per_agent=3)
+        for i in range(10):
+            store.append("conversations", {"agent": "a", "task": i})
+        store.append("conversations", {"agent": "b", "task": "b0"})
+
+        assert store.count("conversations", agent="a") == 3
+        assert store.count("conversations") == 4
+        assert [r["task"] for r in store.recent("conversations", 10, agent="a")] == [7, 8, 9]
+
+    def test_ttl_expiry(self, tmp_path):
+        """Rows older than the TTL are dropped by prune() and counts follow."""
+        store = SQLiteMemory(tmp_path / "memory.db", ttl=timedelta(days=7))
+        old = (datetime.now() - timedelta(days=30)).isoformat()
+        store.append("insights", {"content": "stale", "timestamp": old})
+        store.append("insights", {"content": "fresh", "timestamp": datetime.now().isoformat()})
+
+        assert store.prune() == 1
+        assert store.count("insights") == 1
+        assert [r["content"] for r in store.recent("insights", 5)] == ["fresh"]
+
+    def test_queries_use_indexes(self, tmp_path):
+        """recent() is an index range scan, not a table scan."""
+        store = SQLiteMemory(tmp_path / "memory.db")
+        for sql, params in [
+            (
+                "SELECT payload FROM memories WHERE kind = ? ORDER BY id DESC LIMIT ?",
+                ("insights", 3),
+            ),
+            (
+                "SELECT payload FROM memories WHERE agent = ? AND kind = ? ORDER BY id DESC LIMIT ?",
+                ("a", "conversations", 3),
+            ),
+        ]:
+            plan = " ".join(
+                row[-1] for row in store.conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            )
+            assert "USING INDEX" in plan or "USING COVERING INDEX" in plan
+            assert "TEMP B-TREE" not in plan
+
+    def test_process_task_does_not_load_insights(self, tmp_path):
+        """The per-task path counts insights instead of fetching them all."""
+        memory = AgentMemory(tmp_path / "memory.db")
+        memory.add_insight("one")
+        agent = MockLLMAgent("Test Agent", "Test goal", "Test backstory", memory)
+        memory.recall("warm up")  # the recall index is built once, then kept up to date
+
+        with patch.object(memory.store, "snapshot", side_effect=AssertionError("full load")):
+            response = agent.process_task("task")
+        assert "Previous insights: 1" in response
+
+
+class TestRecall:
+    def test_hashing_embeddings_are_deterministic(self):
+        """The default embedder needs no model and gives the same vector every time."""
+        a, b = HashingEmbeddings(), HashingEmbeddings()
+        assert a.embed_query("API latency spike") == b.embed_query("API latency spike")
+        assert a.embed_query("API latency spike") != a.embed_query("checkout conversion")
+
+    def test_recall_finds_related_memories(self, tmp_path):
+        """recall() ranks conversations and insights by similarity to the task."""
+        memory = AgentMemory(tmp_path / "memory.json")
+        memory.add_conversation(
+            {"agent": "a", "task": "Investigate API latency spike", "response": "cache miss storm"}
+        )
+        memory.add_conversation(
+            {"agent": "a", "task": "Summarise weekly signups", "response": "up 4%"}
+        )
+        memory.add_insight("Checkout conversion dropped on mobile")
+
+        hits = memory.recall("why is the API latency high", k=2)
+        assert hits[0]["kind"] == "conversations"
+        assert hits[0]["task"] == "Investigate API latency spike"
+        assert hits[0]["score"] >= hits[1]["score"]
+
+        # New memories are indexed incrementally
+        memory.add_insight("Mobile checkout errors traced to payment SDK")
+        hits = memory.recall("mobile checkout", k=2, kinds=["insights"])
+        assert {h["kind"] for h in hits} == {"insights"}
+        assert len(memory.recall_index) == 4
+
+    def test_embeddings_are_cached(self, tmp_path):
+        """Rebuilding the index only embeds text that has not been seen before."""
+        memory_file = tmp_path / "memory.json"
+        memory = AgentMemory(memory_file)
+        for i in range(5):
+            memory.add_insight(f"insight number {i}")
+        memory.recall("insight")
+
+        embedder = HashingEmbeddings()
+        with patch.object(embedder, "embed_documents", wraps=embedder.embed_documents) as embed:
+            reloaded = AgentMemory(memory_file, embedder=embedder)
+            reloaded.add_insight("a brand new insight")
+            assert len(reloaded.recall("insight", k=10)) == 6
+            embedded = [text for call in embed.call_args_list for text in call.args[0]]
+        assert embedded == ["a brand new insight"]
+
+    def test_recall_at_100k_scores_a_fraction_of_the_index(self):
+        """Past ANN_MIN a query scores only its nearest clusters and still finds the exact match."""
+
+        class RandomEmbeddings:
+            model = "random-256"
+
+            def __init__(self):
+                self.rng = np.random.default_rng(0)
+
+            def embed_documents(self, texts):
+                return self.rng.standard_normal((len(texts), 256)).astype(np.float32)
+
+            def embed_query(self, text):
+                return self.rng.standard_normal(256)
+
+        index = RecallIndex(RandomEmbeddings())
+        index.add([("insights", {"content": f"memory {i}"}) for i in range(100_000)])
+        target = index.vectors[123].copy()
+        with patch.object(index.embedder, "embed_query", return_value=target):
+            hits = index.search("near memory 123", k=5)
+        assert hits[0]["content"] == "memory 123"
+        assert len(index.candidates(target)) < len(index) // 10
+
+        # Later vectors join a cluster instead of being scanned linearly
+        index.add([("insights", {"content": "late memory"})])
+        late = index.vectors[len(index) - 1].copy()
+        with patch.object(index.embedder, "embed_query", return_value=late):
+            assert index.search("late", k=1)[0]["content"] == "late memory"
+
+    @pytest.mark.parametrize("name", ["memory.json", "memory.db"])
+    def test_recall_sees_appends_from_other_processes(self, tmp_path, name):
+        """Each recall indexes only the store's new tail, whoever appended it."""
+        memory, other = AgentMemory(tmp_path / name), AgentMemory(tmp_path / name)
+        memory.add_insight("Checkout conversion dropped on mobile")
+        memory.recall("checkout")
+
+        other.add_insight("API latency spike traced to cache misses")
+        hits = memory.recall("API latency spike", k=1)
+        assert hits[0]["content"] == "API latency spike traced to cache misses"
+        assert len(memory.recall_index) == 2
+
+        index = memory.recall_index
+        memory.recall("again")
+        assert memory.recall_index is index  # nothing new: no rebuild
+
+        other.compact_memory()
+        memory.recall("checkout")
+        assert memory.recall_index is not index  # a rewrite elsewhere resets the cursor
+
+    def test_process_task_mentions_related_memories(self, tmp_path):
+        memory = AgentMemory(tmp_path / "memory.json")
+        agent = MockLLMAgent("Test Agent", "Test goal", "Test backstory", memory)
+        agent.process_task("Check API latency")
+        response = agent.process_task("Check API latency again")
+        assert "Related memories: 1" in response
+
+
+class TestMemoryCompaction:
+    @staticmethod
+    def _conversation(agent, task, when):
+        return {"agent": agent, "task": task, "response": "ok", "timestamp": when.isoformat()}
+
+    def test_minhash_estimates_similarity(self):
+        """Near-identical texts score high, unrelated ones low."""
+        hasher = MinHasher()
+        sig = hasher.signature
+        close = hasher.similarity(
+            sig("Memory leak suspected in worker pool after deploy"),
+            sig("Memory leak suspected in the worker pool after deploy"),
+        )
+        far = hasher.similarity(
+            sig("Disk full on db-1"), sig("Checkout conversion dropped on mobile")
+        )
+        assert close >= 0.7
+        assert far < 0.2
+
+    def test_duplicate_groups(self):
+        texts = [
+            "CPU high on api-3 at 91%",
+            "Disk full on db-1",
+            "cpu high on api-7 at 87%",
+            "Memory leak suspected in worker pool after deploy",
+            "Memory leak suspected in the worker pool after deploy",
+        ]
+        groups = sorted(sorted(g) for g in duplicate_groups(texts))
+        assert groups == [[0, 2], [1], [3, 4]]
+
+    @pytest.mark.parametrize("suffix", [".json", ".db"])
+    def test_compaction_merges_insights_with_provenance(self, tmp_path, suffix):
+        """Duplicates collapse into the newest insight; the originals stay reachable."""
+        memory = AgentMemory(tmp_path / f"memory{suffix}")
+        for i in range(10):
+            memory.add_insight(f"CPU usage high on api-{i} at {80 + i}%")
+        memory.add_insight("Disk full on db-1")
+
+        stats = memory.compact_memory()
+        assert (stats.insights_before, stats.insights_after, stats.archived) == (11, 2, 9)
+        merged, disk = memory.get_insights()
+        assert merged["content"] == "CPU usage high on api-9 at 89%"
+        assert merged["occurrences"] == 10 and len(merged["merged_ids"]) == 9
+        assert disk.get("occurrences") is None
+        sources = memory.sources(merged)
+        assert [s["content"] for s in sources] == [
+            f"CPU usage high on api-{i} at {80 + i}%" for i in range(9)
+        ]
+        assert [s["id"] for s in sources] == merged["merged_ids"]
+
+    @pytest.mark.parametrize("suffix", [".json", ".db"])
+    def test_old_conversations_roll_into_summaries(self, tmp_path, suffix):
+        memory_file = tmp_path / f"memory{suffix}"
+        memory = AgentMemory(memory_file)
+        now = datetime(2026, 3, 31, 12)
+        for day, agent in [
+            (2, "Data Analyst"),
+            (2, "Data Analyst"),
+            (2, "Report Generator"),
+            (40, "Data Analyst"),
+        ]:
+            memory._append(
+                "conversations", self._conversation(agent, "Analyze cpu", now - timedelta(days=day))
+            )
+        for i in range(3):
+            memory._append("conversations", self._conversation("Data Analyst", f"recent {i}", now))
+
+        stats = memory.compact_memory(now=now, keep_conversations=2)
+        assert stats.conversations_rolled == 4
+        # The young conversation beyond keep_conversations stays verbatim
+        assert [c["task"] for c in memory.memory["conversations"]] == [
+            "recent 0",
+            "recent 1",
+            "recent 2",
+        ]
+        summaries = {(s["agent"], s["period"]): s for s in memory.memory["summaries"]}
+        assert set(summaries) == {
+            ("Data Analyst", "2026-02"),
+            ("Data Analyst", "2026-03-29"),
+            ("Report Generator", "2026-03-29"),
+        }
+        daily = summaries["Data Analyst", "2026-03-29"]
+        assert daily["conversations"] == 2 and daily["tasks"] == [["analyze cpu", 2]]
+        assert len(memory.sources(daily)) == 2
+
+        # A month later the daily summary folds into its month, incrementally
+        later = now + timedelta(days=31)
+        memory._append(
+            "conversations",
+            self._conversation("Data Analyst", "Analyze cpu", later - timedelta(days=2)),
+        )
+        memory.compact_memory(now=later, keep_conversations=0)
+        periods = {
+            (s["agent"], s["period"]): s["conversations"] for s in memory.memory["summaries"]
+        }
+        assert periods[("Data Analyst", "2026-03")] == 5
+        memory.close()
+        reloaded = AgentMemory(memory_file)
+        assert reloaded.memory["conversations"] == []
+        assert len(reloaded.memory["summaries"]) == 4
+
+    @pytest.mark.parametrize("suffix", [".json", ".db"])
+    def test_writers_are_not_blocked_while_compacting(self, tmp_path, suffix):
+        """Dedupe runs outside the memory's lock; what is appended meanwhile survives."""
+        memory = AgentMemory(tmp_path / f"memory{suffix}")
+        for i in range(5):
+            memory.add_insight(f"CPU usage high on api-{i}")
+        dedupe = memory_compaction.dedupe_insights
+        writers = []
+
+        def dedupe_while_writing(*args, **kwargs):
+            writer = threading.Thread(target=memory.add_insight, args=("Disk full on db-1",))
+            writer.start()
+            writer.join(5)
+            writers.append(writer)
+            return dedupe(*args, **kwargs)
+
+        with patch.object(memory_compaction, "dedupe_insights", side_effect=dedupe_while_writing):
+            stats = memory.compact_memory()
+
+        assert not writers[0].is_alive()
+        assert (stats.insights_before, stats.insights_after) == (5, 1)
+        assert [i["content"] for i in memory.get_insights()] == [
+            "CPU usage high on api-4",
+            "Disk full on db-1",
+        ]
+        memory.close()
+
+    def test_compaction_is_redone_when_the_store_changed_underneath(self, tmp_path):
+        """Records removed since the snapshot are not resurrected by the rewrite."""
+        memory = AgentMemory(tmp_path / "memory.json")
+        for i in range(5):
+            memory.add_insight(f"CPU usage high on api-{i}")
+        memory.add_insight("Disk full on db-1")
+        dedupe = memory_compaction.dedupe_insights
+        calls = []
+
+        def dedupe_after_trim(*args, **kwargs):
+            if not calls:  # another writer drops the disk insight mid-pass
+                memory.rewrite(
+                    ("insights",),
+                    lambda current: {
+                        "insights": [i for i in current["insights"] if "Disk" not in i["content"]]
+                    },
+                )
+            calls.append(len(args[0]))
+            return dedupe(*args, **kwargs)
+
+        with patch.object(memory_compaction, "dedupe_insights", side_effect=dedupe_after_trim):
+            stats = memory.compact_memory()
+
+        assert calls == [6, 5]
+        assert (stats.insights_before, stats.insights_after) == (5, 1)
+        assert [i["content"] for i in memory.get_insights()] == ["CPU usage high on api-4"]
+        memory.close()
+
+    def test_recall_finds_compacted_summaries(self, tmp_path):
+        memory = AgentMemory(tmp_path / "memory.json")
+        old = datetime.now() - timedelta(days=3)
+        for i in range(3):
+            memory._append(
+                "conversations", self._conversation("Data Analyst", "Analyze checkout latency", old)
+            )
+        memory.compact_memory(keep_conversations=0)
+        assert memory.memory["conversations"] == []
+
+        (hit,) = memory.recall("checkout latency", k=1)
+        assert hit["kind"] == "summaries"
+        assert hit["conversations"] == 3
+        memory.close()
+
+    def test_compaction_bounds_file_size(self, tmp_path):
+        memory_file = tmp_path / "memory.json"
+        memory = AgentMemory(memory_file, auto_compact_after=0)
+        start = datetime.now() - timedelta(days=10)
+        for i in range(2000):
+            when = start + timedelta(minutes=5 * i)
+            memory._append(
+                "conversations", self._conversation("Data Analyst", f"Analyze host {i}", when)
+            )
+            memory.add_insight(f"CPU usage high on api-{i % 7} at {50 + i % 40}%")
+        memory.save_memory()
+        before = memory_file.stat().st_size
+
+        memory.compact_memory(keep_conversations=100)
+        assert memory_file.stat().st_size < before / 5
+        assert memory.count_insights() == 1
+        assert len(memory.memory["conversations"]) <= 400  # the last day's worth, at most
+
+    def test_appends_during_compaction_are_kept(self, tmp_path):
+        """The background job and writers share the store's lock: nothing is lost."""
+        memory = AgentMemory(tmp_path / "memory.json")
+        compactor = MemoryCompactor(
+            memory, interval=0.01, keep_conversations=0, rollup_age=timedelta(0)
+        ).start()
+        try:
+            for i in range(200):
+                memory.add_conversation({"agent": "a", "task": f"task {i}", "response": "ok"})
+        finally:
+            compactor.stop()
+        compactor.run_once()
+        summaries = memory.memory["summaries"]
+        assert sum(s["conversations"] for s in summaries) == 200
+        assert sum(len(memory.sources(s)) for s in summaries) == 200
+
+    @pytest.mark.parametrize("suffix", [".json", ".db"])
+    def test_compaction_starts_at_the_threshold(self, tmp_path, suffix):
+        """The crew's memory compacts itself once enough records are appended."""
+        crew = CrewOrchestrator(AgentMemory(tmp_path / f"memory{suffix}", auto_compact_after=12))
+        for i in range(6):
+            crew.memory.add_insight(f"CPU usage high on api-{i}")
+            crew.memory.add_conversation(
+                {"agent": "Data Analyst", "task": f"task {i}", "response": "ok"}
+            )
+        assert crew.memory.compactor is not None
+        deadline = time.monotonic() + 5.0
+        while crew.memory.compactor.last is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert crew.memory.compactor.last.insights_after == 1
+        assert crew.memory.count_insights() == 1
+        crew.memory.close()
+
+    def test_automatic_compaction_can_be_turned_off(self, tmp_path):
+        memory = AgentMemory(tmp_path / "memory.json", auto_compact_after=0)
+        for i in range(50):
+            memory.add_insight(f"CPU usage high on api-{i}")
+        assert memory.compactor is None
+        assert memory.count_insights() == 50
+        memory.close()
+
+
+class TestWorkflow:
+    def test_independent_steps_run_concurrently(self):
+        """Independent steps overlap; a dependent step starts after its dependency ends."""
+        together = threading.Barrier(2, timeout=5)  # broken unless a and c run at once
+
+        def meet(value):
+            def fn(_):
+                together.wait()
+                return value
+
+            return fn
+
+        workflow = Workflow(
+            [
+                Step("a", meet(1)),
+                Step("b", lambda deps: deps["a"] + 1, deps=("a",)),
+                Step("c", meet(10)),
+            ]
+        )
+        run = workflow.run_sync()
+
+        assert run.ok
+        assert run.results == {"a": 1, "b": 2, "c": 10}
+        trace = {t.name: t for t in run.trace.values()}
+        assert trace["b"].start >= trace["a"].start + trace["a"].seconds
+        assert trace["c"].start < trace["a"].start + trace["a"].seconds
+
+    def test_timeout_skips_dependents(self):
+        """A step over its timeout is abandoned and its dependents are skipped."""
+        release, finished = threading.Event(), threading.Event()
+
+        def stuck(_):
+            release.wait(5)
+            finished.set()
+
+        workflow = Workflow(
+            [
+                Step("slow", stuck, timeout=0.05),
+                Step("after", lambda deps: "never", deps=("slow",)),
+                Step("other", lambda _: "fine"),
+            ]
+        )
+        run = workflow.run_sync()
+        abandoned = not finished.is_set()  # the run returned while the step was still blocked
+        release.set()
+
+        assert run.trace["slow"].status == "timeout"
+        assert run.trace["after"].status == "skipped"
+        assert run.results["other"] == "fine"
+        assert abandoned
+
+    def test_errors_are_recorded(self):
+        def boom(_):
+            raise RuntimeError("boom")
+
+        run = Workflow([Step("bad", boom), Step("next", lambda _: 1, deps=("bad",))]).run_sync()
+        assert run.trace["bad"].status == "error"
+        assert run.trace["bad"].error == "boom"
+        assert run.trace["next"].status == "skipped"
+
+    def test_cancel(self):
+        """cancel() from another thread stops the run."""
+        started, release, finished = threading.Event(), threading.Event(), threading.Event()
+
+        def stuck(_):
+            started.set()
+            release.wait(5)
+            finished.set()
+
+        workflow = Workflow(
+            [
+                Step("slow", stuck),
+                Step("after", lambda deps: 1, deps=("slow",)),
+            ]
+        )
+
+        def cancel_once_running():
+            if started.wait(5):
+                workflow.cancel()
+
+        threading.Thread(target=cancel_once_running).start()
+        run = workflow.run_sync()
+        abandoned = not finished.is_set()
+        release.set()
+
+        assert run.trace["slow"].status == "cancelled"
+        assert run.trace["after"].status in ("cancelled", "skipped")
+        assert abandoned
+
+    def test_invalid_graphs(self):
+        with pytest.raises(ValueError, match="unknown"):
+            Workflow([Step("a", lambda _: 1, deps=("missing",))])
+        with pytest.raises(ValueError, match="cycle"):
+            Workflow([Step("a", lambda _: 1, deps=("b",)), Step("b", lambda _: 1, deps=("a",))])
+
+    def test_orchestrator_overlaps_root_cause_with_report(self, tmp_path):
+        """Root cause analysis no longer waits for the report."""
+        with patch("crew_agents.MEMORY_FILE", tmp_path / "memory.json"):
+            orchestrator = CrewOrchestrator()
+
+        together = threading.Barrier(2, timeout=5)  # broken unless both run at once
+
+        def slow_report(analysis):
+            together.wait()
+            return "report"
+
+        def slow_root_cause(**kwargs):
+            together.wait()
+            return {"root_cause": "x"}
+
+        with patch.object(
+            orchestrator.report_generator, "generate_report", side_effect=slow_report
+        ), patch.object(
+            orchestrator.root_cause_analyzer, "analyze_issue", side_effect=slow_root_cause
+        ):
+            result = orchestrator.automated_analysis_workflow({"anomalies": ["High CPU usage"]})
+
+        assert result["workflow_status"] == "completed"
+        assert {t["name"] for t in result["trace"]} == {"analysis", "report", "root_cause"}
+
+
+def _hammer_memory(memory_file, worker, threads, per_thread, options):
+    """Stress-test worker: several threads appending through one AgentMemory."""
+    memory = AgentMemory(Path(memory_file), **options)
+
+    def write(t):
+        for i in range(per_thread):
+            memory.add_insight(f"{worker}-{t}-{i}")
+
+    pool = [threading.Thread(target=write, args=(t,)) for t in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    memory.close()
+
+
+class TestAgentRouter:
+    @pytest.fixture
+    def crew(self, tmp_path):
+        return CrewOrchestrator(AgentMemory(tmp_path / "memory.json"))
+
+    def test_keyword_fast_path(self, crew):
+        """A keyword owned by exactly one agent routes without scoring."""
+        route = crew.router.route("Any outage in the last hour?")
+        assert (route.agent, route.method, route.confidence) == (
+            "Root Cause Analyzer",
+            "keyword",
+            1.0,
+        )
+
+    def test_similarity_routes_queries_without_keywords(self, crew):
+        route = crew.router.route("Prepare slides for the board meeting")
+        assert route.method == "similarity"
+        assert route.agent == "Report Generator"
+        assert route.scores["Report Generator"] == max(route.scores.values())
+
+    def test_low_confidence_falls_back_to_default(self, crew):
+        route = crew.router.route("Hello")
+        assert (route.agent, route.method) == ("Data Analyst", "default")
+
+    def test_interactive_session_records_route(self, crew):
+        crew.interactive_session("Why did checkout go down last night?")
+        context = crew.memory.get_recent_conversations(1)[0]["context"]
+        assert context["agent_selected"] == "Root Cause Analyzer"
+        assert context["routing"]["method"] in ("keyword", "similarity")
+
+    def test_benchmark_accuracy(self, crew):
+        """The router beats the old substring checks on the labelled set by a wide margin."""
+        rows = load_benchmark()
+        correct = sum(crew.router.route(row["query"]).agent == row["agent"] for row in rows)
+        assert correct / len(rows) >= 0.8
+
+    def test_routing_with_dozens_of_agents(self, crew):
+        """Every query gets a route among many agents; latency is bench_routing.py's job."""
+        profiles = crew.router.profiles + [
+            AgentProfile(
+                f"Agent {i}",
+                f"Specialist number {i} for area {i}",
+                examples=(f"question about area {i}",),
+            )
+            for i in range(45)
+        ]
+        router = AgentRouter(profiles, default="Data Analyst")
+        routes = [router.route(row["query"], use_keywords=False).agent for row in load_benchmark()]
+        assert len(routes) == len(load_benchmark()) and set(routes) <= set(router.names)
+        assert router.route("question about area 7", use_keywords=False).agent == "Agent 7"
+
+    def test_unknown_default_is_rejected(self):
+        with pytest.raises(ValueError):
+            AgentRouter([AgentProfile("A", "a")], default="B")
+
+
+class TestMetricAnalysis:
+    def test_to_columns_accepts_rows_columns_and_scalars(self):
+        rows = to_columns([{"cpu": 85, "memory": 76, "host": "a"}, {"cpu": 90}])
+        assert set(rows) == {"cpu", "memory"}
+        assert np.isnan(rows["memory"][1])
+        assert to_columns({"cpu": [1, 2, 3], "note": "text"})["cpu"].tolist() == [1, 2, 3]
+        assert to_columns({"metric1": 100, "metric2": 200})["metric2"].tolist() == [200]
+        assert to_columns({"test": "data"}) == {}
+
+    def test_statistics_trend_outliers_and_correlation(self):
+        rng = np.random.default_rng(0)
+        n = 10_000
+        cpu = 50 + 0.001 * np.arange(n) + rng.normal(0, 1, n)
+        cpu[[10, 20]] = 500
+        memory = 2 * cpu + rng.normal(0, 1, n)
+        result = analyze_metrics({"cpu": cpu, "memory": memory})
+        stats = result.stats["cpu"]
+        assert stats.count == n and stats.max == 500
+        assert stats.p50 == pytest.approx(np.percentile(cpu, 50))
+        assert stats.slope == pytest.approx(0.001, rel=0.2)
+        assert stats.outliers == 2
+        assert result.correlations[0]["metrics"] == ["cpu", "memory"]
+        assert result.correlations[0]["r"] > 0.99
+        assert 0.9 < result.confidence <= 1
+
+    def test_confidence_reflects_sample_size_and_gaps(self):
+        few = analyze_metrics([{"cpu": 1}, {"cpu": 2}])
+        many = analyze_metrics({"cpu": np.arange(1000.0)})
+        gappy = analyze_metrics({"cpu": np.where(np.arange(1000) % 2, np.nan, np.arange(1000.0))})
+        assert few.confidence < gappy.confidence < many.confidence
+
+    def test_analyze_data_feeds_report(self, tmp_path):
+        memory = AgentMemory(tmp_path / "memory.json")
+        analysis = DataAnalystAgent(memory).analyze_data(
+            {"metrics": [{"cpu": 50 + i, "memory": 70} for i in range(100)]}
+        )
+        assert analysis["summary"] == "Analyzed 100 samples across 2 metrics (cpu, memory)"
+        assert any(t.startswith("cpu rising") for t in analysis["trends"])
+        report = ReportGeneratorAgent(memory).generate_report(analysis)
+        assert "| cpu | 100 |" in report
+        assert f"Confidence Level: {analysis['confidence']}" in report
+
+    def test_million_samples(self):
+        """Timing is checked by ``bench_analysis.py --max-seconds``; this checks the statistics."""
+        cpu = np.random.default_rng(0).normal(50, 5, 1_000_000)
+        analysis = analyze_metrics({"cpu": cpu, "memory": cpu * 0.5})
+        assert analysis.samples == 1_000_000
+        assert analysis.stats["cpu"].mean == pytest.approx(50, abs=0.05)
+        assert analysis.stats["memory"].std == pytest.approx(2.5, abs=0.05)
+        assert analysis.correlations[0]["r"] == 1.0
+
+
+class FakeLLMClient(LLMClient):
+    """Scripted provider: answers by matching a substring of the prompt."""
+
+    model = "fake"
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.prompts = []
+
+    def _answer(self, prompt):
+        for needle, answer in self.answers.items():
+            if needle in prompt:
+                return answer
+        return "plain answer"
+
+    async def complete(self, prompt, max_tokens):
+        self.prompts.append(prompt)
+        if prompt.startswith("You will answer"):
+            sections = prompt.split("### Request ")[1:]
+            return Completion(json.dumps([self._answer(p) for p in sections]), 100, 50)
+        return Completion(self._answer(prompt), 40, 10)
+
+
+ANALYSIS_REPLY = json.dumps(
+    {
+        "summary": "LLM summary",
+        "trends": ["CPU rising"],
+        "recommendations": ["Add capacity"],
+        "confidence": 0.9,
+    }
+)
+ISSUE_REPLY = "Here you go: " + json.dumps(
+    {
+        "potential_causes": ["Noisy neighbour"],
+        "root_cause": "Noisy neighbour",
+        "solution_steps": ["Move host"],
+        "confidence": 1.7,
+    }
+)
+
+
+class TestLLMBackend:
+    @pytest.fixture
+    def crew(self, tmp_path):
+        client = FakeLLMClient(
+            {
+                "Interpret these metric statistics": ANALYSIS_REPLY,
+                "Find the root cause": ISSUE_REPLY,
+            }
+        )
+        llm = LLMBackend(client, batch_window=0.05)
+        yield CrewOrchestrator(AgentMemory(tmp_path / "memory.json"), llm=llm)
+        llm.close()
+
+    def test_offline_default_uses_mock(self, tmp_path):
+        crew = CrewOrchestrator(AgentMemory(tmp_path / "memory.json"))
+        assert crew.llm is None
+        assert "Processing:" in crew.interactive_session("Analyze the data")
+
+    def test_structured_outputs(self, crew):
+        analysis = crew.data_analyst.analyze_data({"metrics": [1, 2]})
+        assert analysis["summary"] == "LLM summary"
+        assert analysis["trends"] == ["CPU rising"]
+        assert analysis["recommendations"] == ["Add capacity"]
+        assert analysis["confidence"] == 0.06  # computed, not the model's 0.9
+        assert analysis["statistics"]["value"]["count"] == 2
+        issue = crew.root_cause_analyzer.analyze_issue("Slow API", ["timeouts"], {})
+        assert issue["root_cause"] == "Noisy neighbour"
+        assert issue["confidence"] == 1.0  # clamped
+        assert issue["issue"] == "Slow API"
+
+    def test_unparseable_output_falls_back_to_mock(self, crew):
+        crew.llm.client.answers["Interpret these metric statistics"] = "I cannot do that"
+        analysis = crew.data_analyst.analyze_data({"metrics": [1]})
+        assert analysis["summary"] == "Analyzed 1 samples across 1 metrics (value)"
+
+    def test_responses_are_cached(self, crew):
+        first = crew.llm.ask("Report Generator", "Summarise week 42")
+        second = crew.llm.ask("Report Generator", "Summarise week 42")
+        crew.llm.ask("Report Generator", "Summarise week 42", max_tokens=100)
+        crew.llm.ask("Report Generator", "Summarise week 43")
+        assert first == second == "plain answer"
+        assert len(crew.llm.client.prompts) == 3
+
+    def test_cache_key_covers_recalled_memory(self, crew):
+        """The same task asked again carries the first answer in its prompt, so it is not a cache hit."""
+        crew.report_generator.process_task("Summarise the week", {"week": 42})
+        crew.report_generator.process_task("Summarise the week", {"week": 42})
+        assert len(crew.llm.client.prompts) == 2
+
+    def test_reservations_are_deducted_up_front(self):
+        budget = TokenBudget(1000)
+        reserved = budget.reserve(600)
+        with pytest.raises(BudgetExceeded):
+            budget.reserve(600)
+        budget.settle(reserved, 150)
+        assert budget.used == 150
+        budget.settle(budget.reserve(600), 0)
+        assert budget.used == 150
+
+    def test_token_budget_falls_back_to_mock(self, crew):
+        crew.llm.token_budget = 10
+        response = crew.report_generator.process_task("Summarise the week")
+        assert "Processing:" in response
+        assert crew.llm.client.prompts == []
+
+    def test_budget_is_charged_with_reported_usage(self, crew):
+        crew.report_generator.process_task("Summarise the week")
+        assert crew.llm.budget("Report Generator").used == 50
+        assert crew.llm.budget("Data Analyst").used == 0
+
+    def test_concurrent_workflow_steps_share_one_request(self, crew):
+        """analysis and root_cause run in parallel, so their prompts are packed together."""
+        result = crew.automated_analysis_workflow({"metrics": [1], "anomalies": ["High CPU"]})
+        assert result["workflow_status"] == "completed"
+        assert result["analysis"]["summary"] == "LLM summary"
+        assert result["root_cause_analysis"]["root_cause"] == "Noisy neighbour"
+        assert crew.llm.requests == 1
+
+    def test_unsplittable_batch_is_retried_individually(self, crew):
+        async def broken_pack(prompt, max_tokens):
+            crew.llm.client.prompts.append(prompt)
+            if prompt.startswith("You will answer"):
+                return Completion("not json")
+            return Completion(crew.llm.client._answer(prompt))
+
+        crew.llm.client.complete = broken_pack
+        result = crew.automated_analysis_workflow({"metrics": [1], "anomalies": ["High CPU"]})
+        assert result["analysis"]["summary"] == "LLM summary"
+        assert crew.llm.requests == 3
+
+    def test_parse_json_ignores_fences(self):
+        assert parse_json('```json\n{"a": 1}\n```') == {"a": 1}
+        assert parse_json("no json here") is None
+
+
+class TestConcurrentMemory:
+    def _run_processes(self, memory_file, processes=4, threads=4, per_thread=50, **options):
+        ctx = multiprocessing.get_context("fork")
+        workers = [
+            ctx.Process(
+                target=_hammer_memory, args=(str(memory_file), w, threads, per_thread, options)
+            )
+            for w in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(60)
+            assert worker.exitcode == 0
+        return {
+            f"{w}-{t}-{i}"
+            for w in range(processes)
+            for t in range(threads)
+            for i in range(per_thread)
+        }
+
+    def test_no_lost_updates_across_threads(self, tmp_path):
+        memory_file = tmp_path / "memory.json"
+        _hammer_memory(memory_file, "w", threads=16, per_thread=50, options={"compact_every": 97})
+        contents = [i["content"] for i in AgentMemory(memory_file).memory["insights"]]
+        assert len(contents) == 800
+        assert set(contents) == {f"w-{t}-{i}" for t in range(16) for i in range(50)}
+
+    def test_no_lost_updates_across_processes(self, tmp_path):
+        """Processes x threads appending to one log, with compactions racing the writers."""
+        memory_file = tmp_path / "memory.json"
+        expected = self._run_processes(memory_file, compact_every=97, flush_every=1000)
+
+        store = AgentMemory(memory_file).store
+        contents = [i["content"] for i in store.snapshot()["insights"]]
+        assert len(contents) == len(expected)
+        assert set(contents) == expected
+        assert store.seq == len(expected)
+
+    def test_no_lost_updates_sqlite(self, tmp_path):
+        memory_file = tmp_path / "memory.db"
+        expected = self._run_processes(memory_file, processes=4, threads=4, per_thread=25)
+        memory = AgentMemory(memory_file)
+        assert memory.count_insights() == len(expected)
+        assert {i["content"] for i in memory.memory["insights"]} == expected
+
+    def test_namespaces_are_isolated(self, tmp_path):
+        acme = AgentMemory.for_namespace("acme", "s1", root=tmp_path)
+        other = AgentMemory.for_namespace("globex", "s1", root=tmp_path)
+        acme.add_insight("acme only")
+
+        assert acme.memory_file == tmp_path / "acme" / "s1.json"
+        assert other.count_insights() == 0
+        assert AgentMemory.for_namespace("acme", root=tmp_path).memory_file.name == "_tenant.json"
+        for bad in ("../etc", "a/b", "", ".hidden"):
+            with pytest.raises(ValueError):
+                AgentMemory.for_namespace(bad, root=tmp_path)
+
+    def test_concurrent_sessions(self, tmp_path):
+        """Many sessions served from many threads; each keeps exactly its own history."""
+        sessions = CrewSessions(root=tmp_path)
+        queries = 10
+
+        def client(tenant, session):
+            for i in range(queries):
+                assert f"{session} q{i}" in sessions.ask(tenant, session, f"{session} q{i}")
+
+        keys = [(f"tenant{t}", f"s{s}") for t in range(3) for s in range(4)]
+        pool = [threading.Thread(target=client, args=key) for key in keys for _ in range(2)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+
+        assert len(sessions) == len(keys)
+        for tenant, session in keys:
+            conversations = sessions.get(tenant, session).memory.memory["conversations"]
+            assert len(conversations) == 2 * queries
+            assert all(c["task"].startswith(session) for c in conversations)
+        sessions.close()
+
+    def test_session_eviction(self, tmp_path):
+        sessions = CrewSessions(root=tmp_path, max_sessions=2)
+        for s in ("a", "b", "c"):
+            sessions.ask("t", s, "hello")
+        assert len(sessions) == 2
+        # An evicted session's history is still on disk
+        assert len(sessions.get("t", "a").memory.memory["conversations"]) == 1
+
+    def test_eviction_waits_for_a_crew_in_use(self, tmp_path):
+        """A crew evicted while checked out stays open until its lease ends."""
+        sessions = CrewSessions(root=tmp_path, max_sessions=1, suffix=".db")
+        with sessions.checkout("t", "a") as crew:
+            close = patch.object(crew.memory, "close", wraps=crew.memory.close).start()
+            sessions.ask("t", "b", "hello")  # evicts "a"
+            assert len(sessions) == 1
+            crew.memory.add_insight("written after eviction")
+            assert crew.memory.count_insights() == 1
+            close.assert_not_called()
+        close.assert_called_once()
+        patch.stopall()
+
+        reopened = sessions.get("t", "a")
+        assert reopened is not crew
+        assert [i["content"] for i in reopened.memory.get_insights()] == ["written after eviction"]
+        sessions.close()
+
+
 class TestMockLLMAgent:
     def test_agent_initialization(self):
         """Test MockLLMAgent initialization."""
-        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as tmp:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
             memory_file = Path(tmp.name)
-        
+
         memory = AgentMemory(memory_file)
         agent = MockLLMAgent("Test Agent", "Test goal", "Test backstory", memory)
-        
+
         assert agent.role == "Test Agent"
         assert agent.goal == "Test goal"
         assert agent.backstory == "Test backstory"
         assert agent.memory == memory
-        
+
         # Cleanup
         memory_file.unlink()
 
     def test_process_task(self):
         """Test task processing."""
-        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as tmp:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
             memory_file = Path(tmp.name)
-        
+
         memory = AgentMemory(memory_file)
         agent = MockLLMAgent("Test Agent", "Test goal", "Test backstory", memory)
-        
+
         task = "Test task"
         context = {"key": "value"}
-        
+
         response = agent.process_task(task, context)
-        
+
         assert "[Test Agent]" in response
         assert "Test task" in response
         assert len(memory.memory["conversations"]) == 1
-        
+
         # Cleanup
         memory_file.unlink()
 
     def test_process_task_error_handling(self):
         """Test error handling in task processing."""
-        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as tmp:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
             memory_file = Path(tmp.name)
-        
+
         memory = AgentMemory(memory_file)
         agent = MockLLMAgent("Test Agent", "Test goal", "Test backstory", memory)
-        
+
         # Mock _generate_response to raise exception
-        with patch.object(agent, '_generate_response', side_effect=Exception("Test error")):
+        with patch.object(agent, "_generate_response", side_effect=Exception("Test error")):
             response = agent.process_task("test task")
             assert "Error: Test error" in response
-        
+
         # Cleanup
         memory_file.unlink()
 
@@ -139,55 +1170,55 @@ class TestMockLLMAgent:
 class TestDataAnalystAgent:
     def test_data_analyst_initialization(self):
         """Test DataAnalystAgent initialization."""
-        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as tmp:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
             memory_file = Path(tmp.name)
-        
+
         memory = AgentMemory(memory_file)
         agent = DataAnalystAgent(memory)
-        
+
         assert agent.role == "Data Analyst"
         assert "data analysis" in agent.goal.lower()
-        
+
         # Cleanup
         memory_file.unlink()
 
     def test_analyze_data(self):
         """Test data analysis functionality."""
-        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as tmp:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
             memory_file = Path(tmp.name)
-        
+
         memory = AgentMemory(memory_file)
         agent = DataAnalystAgent(memory)
-        
+
         test_data = {"metric1": 100, "metric2": 200, "metric3": 300}
         result = agent.analyze_data(test_data)
-        
+
         assert "summary" in result
         assert "trends" in result
         assert "recommendations" in result
         assert "confidence" in result
         assert isinstance(result["trends"], list)
         assert isinstance(result["recommendations"], list)
-        
+
         # Check memory was updated
         assert len(memory.memory["insights"]) == 1
-        
+
         # Cleanup
         memory_file.unlink()
 
     def test_analyze_data_error_handling(self):
         """Test error handling in data analysis."""
-        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as tmp:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
             memory_file = Path(tmp.name)
-        
+
         memory = AgentMemory(memory_file)
         agent = DataAnalystAgent(memory)
-        
+
         # Mock memory.add_insight to raise exception
-        with patch.object(memory, 'add_insight', side_effect=Exception("Memory error")):
+        with patch.object(memory, "add_insight", side_effect=Exception("Memory error")):
             result = agent.analyze_data({"test": "data"})
             assert "error" in result
-        
+
         # Cleanup
         memory_file.unlink()
 
@@ -195,35 +1226,35 @@ class TestDataAnalystAgent:
 class TestReportGeneratorAgent:
     def test_report_generator_initialization(self):
         """Test ReportGeneratorAgent initialization."""
-        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as tmp:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
             memory_file = Path(tmp.name)
-        
+
         memory = AgentMemory(memory_file)
         agent = ReportGeneratorAgent(memory)
-        
+
         assert agent.role == "Report Generator"
         assert "report" in agent.goal.lower()
-        
+
         # Cleanup
         memory_file.unlink()
 
     def test_generate_report(self):
         """Test report generation functionality."""
-        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as tmp:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
             memory_file = Path(tmp.name)
-        
+
         memory = AgentMemory(memory_file)
         agent = ReportGeneratorAgent(memory)
-        
+
         analysis = {
             "summary": "Test summary",
             "trends": ["Trend 1", "Trend 2"],
             "recommendations": ["Rec 1", "Rec 2"],
-            "confidence": 0.95
+            "confidence": 0.95,
         }
-        
+
         report = agent.generate_report(analysis)
-        
+
         assert "# Automated Intelligence Report" in report
         assert "Test summary" in report
         assert "Trend 1" in report
@@ -231,53 +1262,119 @@ class TestReportGeneratorAgent:
         assert "Rec 1" in report
         assert "Rec 2" in report
         assert "0.95" in report
-        
+
         # Check memory was updated
         assert len(memory.memory["insights"]) == 1
-        
+
         # Cleanup
         memory_file.unlink()
 
 
+class TestReportBuilder:
+    ANALYSIS = {
+        "summary": "CPU is rising",
+        "trends": [f"finding {i} <details>" for i in range(2000)],
+        "recommendations": ["Add capacity"],
+        "confidence": 0.42,
+    }
+
+    def test_formats_from_one_pass(self):
+        report = ReportBuilder(self.ANALYSIS).build()
+        assert report.markdown.startswith("\n# Automated Intelligence Report")
+        assert "2000. finding 1999 <details>" in report.markdown
+        assert "## Confidence Level: 0.42" in report.markdown
+        assert report.json["findings"] == self.ANALYSIS["trends"]
+        assert report.json["confidence"] == 0.42
+        blocks = [b for m in report.slack for b in m["blocks"]]
+        assert blocks[0]["type"] == "header"
+        assert all(len(m["blocks"]) <= 50 for m in report.slack)
+        texts = [b["text"]["text"] for b in blocks if b["type"] == "section"]
+        assert all(len(t) <= 3000 for t in texts)
+        assert "finding 0 &lt;details&gt;" in texts[1]
+
+    def test_iter_json_is_one_document(self):
+        builder = ReportBuilder(self.ANALYSIS)
+        assert json.loads("".join(builder.iter_json()))["findings"][-1] == "finding 1999 <details>"
+
+    def test_sinks_receive_sections_as_they_are_rendered(self):
+        events = []
+        builder = ReportBuilder(self.ANALYSIS)
+        original = builder.sections
+
+        def traced():
+            for section in original():
+                events.append(("built", section.key))
+                yield section
+
+        builder.sections = traced
+        builder.build(
+            ("markdown",), {"markdown": lambda chunk: events.append(("sent", chunk.split("\n")[1]))}
+        )
+        assert events[:4] == [
+            ("built", "header"),
+            ("sent", "# Automated Intelligence Report"),
+            ("built", "summary"),
+            ("sent", "## Executive Summary"),
+        ]
+
+    def test_slack_stream_posts_full_messages_then_the_rest(self):
+        posted = []
+        with SlackStream(posted.append, channel="#ops", max_blocks=5) as stream:
+            ReportBuilder(self.ANALYSIS).build(("slack",), {"slack": stream.write})
+            full = len(posted)
+        assert full >= 2 and all(len(p["blocks"]) == 5 for p in posted[:full])
+        assert len(posted) == full + 1 and posted[-1]["channel"] == "#ops"
+
+    def test_agent_build_report_records_insight(self, tmp_path):
+        memory = AgentMemory(tmp_path / "memory.json")
+        agent = ReportGeneratorAgent(memory)
+        report = agent.build_report(self.ANALYSIS, formats=("json",))
+        assert report.markdown == "" and report.json["summary"] == "CPU is rising"
+        assert (
+            memory.get_insights()[-1]["content"]
+            == "Generated report with 2000 trends and 1 recommendations"
+        )
+
+
 class TestRootCauseAnalyzer:
     def test_root_cause_analyzer_initialization(self):
         """Test RootCauseAnalyzer initialization."""
-        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as tmp:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
             memory_file = Path(tmp.name)
-        
+
         memory = AgentMemory(memory_file)
         agent = RootCauseAnalyzer(memory)
-        
+
         assert agent.role == "Root Cause Analyzer"
         assert "root cause" in agent.goal.lower()
-        
+
         # Cleanup
         memory_file.unlink()
 
     def test_analyze_issue(self):
         """Test root cause analysis functionality."""
-        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as tmp:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
             memory_file = Path(tmp.name)
-        
+
         memory = AgentMemory(memory_file)
         agent = RootCauseAnalyzer(memory)
-        
+
         issue = "API timeout"
         symptoms = ["High latency", "Connection errors"]
         context = {"load": "high"}
-        
+
         result = agent.analyze_issue(issue, symptoms, context)
-        
+
         assert result["issue"] == issue
         assert result["symptoms"] == symptoms
         assert "potential_causes" in result
         assert "root_cause" in result
         assert "solution_steps" in result
         assert "confidence" in result
-        
+
         # Check memory was updated
         assert len(memory.memory["insights"]) == 1
-        
+
         # Cleanup
         memory_file.unlink()
 
@@ -285,30 +1382,30 @@ class TestRootCauseAnalyzer:
 class TestCrewOrchestrator:
     def test_crew_orchestrator_initialization(self):
         """Test CrewOrchestrator initialization."""
-        with patch('crew_agents.MEMORY_FILE', Path(tempfile.mkdtemp()) / "test_memory.json"):
+        with patch("crew_agents.MEMORY_FILE", Path(tempfile.mkdtemp()) / "test_memory.json"):
             orchestrator = CrewOrchestrator()
-            
-            assert hasattr(orchestrator, 'memory')
-            assert hasattr(orchestrator, 'data_analyst')
-            assert hasattr(orchestrator, 'report_generator')
-            assert hasattr(orchestrator, 'root_cause_analyzer')
+
+            assert hasattr(orchestrator, "memory")
+            assert hasattr(orchestrator, "data_analyst")
+            assert hasattr(orchestrator, "report_generator")
+            assert hasattr(orchestrator, "root_cause_analyzer")
             assert isinstance(orchestrator.data_analyst, DataAnalystAgent)
             assert isinstance(orchestrator.report_generator, ReportGeneratorAgent)
             assert isinstance(orchestrator.root_cause_analyzer, RootCauseAnalyzer)
 
     def test_automated_analysis_workflow(self):
         """Test automated analysis workflow."""
-        with patch('crew_agents.MEMORY_FILE', Path(tempfile.mkdtemp()) / "test_memory.json"):
+        with patch("crew_agents.MEMORY_FILE", Path(tempfile.mkdtemp()) / "test_memory.json"):
             orchestrator = CrewOrchestrator()
-            
+
             test_data = {
                 "metrics": [{"cpu": 85, "memory": 76}],
                 "anomalies": ["High CPU usage"],
-                "timestamp": datetime.now().isoformat()
+                "timestamp": datetime.now().isoformat(),
             }
-            
+
             result = orchestrator.automated_analysis_workflow(test_data)
-            
+
             assert "analysis" in result
             assert "report" in result
             assert "root_cause_analysis" in result
@@ -318,47 +1415,49 @@ class TestCrewOrchestrator:
 
     def test_automated_analysis_workflow_no_anomalies(self):
         """Test automated analysis workflow without anomalies."""
-        with patch('crew_agents.MEMORY_FILE', Path(tempfile.mkdtemp()) / "test_memory.json"):
+        with patch("crew_agents.MEMORY_FILE", Path(tempfile.mkdtemp()) / "test_memory.json"):
             orchestrator = CrewOrchestrator()
-            
+
             test_data = {
                 "metrics": [{"cpu": 50, "memory": 60}],
-                "timestamp": datetime.now().isoformat()
+                "timestamp": datetime.now().isoformat(),
             }
-            
+
             result = orchestrator.automated_analysis_workflow(test_data)
-            
+
             assert result["root_cause_analysis"] is None
             assert result["workflow_status"] == "completed"
 
     def test_interactive_session(self):
         """Test interactive session functionality."""
-        with patch('crew_agents.MEMORY_FILE', Path(tempfile.mkdtemp()) / "test_memory.json"):
+        with patch("crew_agents.MEMORY_FILE", Path(tempfile.mkdtemp()) / "test_memory.json"):
             orchestrator = CrewOrchestrator()
-            
+
             # Test data query
             response = orchestrator.interactive_session("Can you analyze the recent data?")
             assert "[Data Analyst]" in response
-            
+
             # Test report query
             response = orchestrator.interactive_session("Generate a report please")
             assert "[Report Generator]" in response
-            
+
             # Test problem query
             response = orchestrator.interactive_session("There's a problem with the system")
             assert "[Root Cause Analyzer]" in response
-            
+
             # Test default query
             response = orchestrator.interactive_session("Hello")
             assert "[Data Analyst]" in response  # Default agent
 
     def test_workflow_error_handling(self):
         """Test error handling in workflow."""
-        with patch('crew_agents.MEMORY_FILE', Path(tempfile.mkdtemp()) / "test_memory.json"):
+        with patch("crew_agents.MEMORY_FILE", Path(tempfile.mkdtemp()) / "test_memory.json"):
             orchestrator = CrewOrchestrator()
-            
+
             # Mock data_analyst.analyze_data to raise exception
-            with patch.object(orchestrator.data_analyst, 'analyze_data', side_effect=Exception("Test error")):
+            with patch.object(
+                orchestrator.data_analyst, "analyze_data", side_effect=Exception("Test error")
+            ):
                 result = orchestrator.automated_analysis_workflow({"test": "data"})
                 assert "error" in result
 
@@ -366,28 +1465,28 @@ class TestCrewOrchestrator:
 class TestIntegration:
     def test_full_workflow_integration(self):
         """Test complete workflow integration."""
-        with patch('crew_agents.MEMORY_FILE', Path(tempfile.mkdtemp()) / "test_memory.json"):
+        with patch("crew_agents.MEMORY_FILE", Path(tempfile.mkdtemp()) / "test_memory.json"):
             orchestrator = CrewOrchestrator()
-            
+
             # Run complete workflow
             test_data = {
                 "metrics": [{"cpu": 85, "memory": 76}, {"cpu": 90, "memory": 82}],
                 "anomalies": ["High CPU usage", "Memory spike"],
-                "timestamp": datetime.now().isoformat()
+                "timestamp": datetime.now().isoformat(),
             }
-            
+
             result = orchestrator.automated_analysis_workflow(test_data)
-            
+
             # Verify all components worked
             assert result["workflow_status"] == "completed"
             assert "analysis" in result
             assert "report" in result
             assert result["root_cause_analysis"] is not None
-            
+
             # Verify memory was updated
             assert len(orchestrator.memory.memory["conversations"]) > 0
             assert len(orchestrator.memory.memory["insights"]) > 0
-            
+
             # Test interactive session uses the accumulated memory
             response = orchestrator.interactive_session("What patterns do you see?")
             assert "Previous insights" in response or "Recent interactions" in response
@@ -395,15 +1494,15 @@ class TestIntegration:
     def test_memory_persistence_across_sessions(self):
         """Test memory persistence across multiple sessions."""
         memory_file = Path(tempfile.mkdtemp()) / "test_memory.json"
-        
-        with patch('crew_agents.MEMORY_FILE', memory_file):
+
+        with patch("crew_agents.MEMORY_FILE", memory_file):
             # First session
             orchestrator1 = CrewOrchestrator()
             orchestrator1.interactive_session("First query")
-            
+
             # Second session
             orchestrator2 = CrewOrchestrator()
             orchestrator2.interactive_session("Second query")
-            
+
             # Memory should persist
-            assert len(orchestrator2.memory.memory["conversations"]) == 2 
\ No newline at end of file
+            assert len(orchestrator2.memory.memory["conversations"]) == 2